@@ -0,0 +1,139 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Helpers shared by the benchmark scripts.
+"""
+
+import os
+import sys
+import time
+import socket
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+
+_process_time = getattr(time, 'process_time', None) or time.clock
+
+
+def cpu_time():
+    """
+    CPU time (user + system) consumed by this process in seconds.
+    """
+    return _process_time()
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class SimulatorProcess(object):
+    """
+    Simulator running in a separated process, so its CPU time is not
+    accounted to the benchmarked client.
+
+    :param channels: number of channels.
+    :param latency: answer latency of the simulator (s).
+    :param pty: create a pseudo-terminal serial port.
+    """
+    def __init__(self, channels=9, latency=0.0, pty=False):
+        self.host = '127.0.0.1'
+        self.port = free_port()
+        self.serial_port = None
+        cmd = [sys.executable, '-u', '-m', 'smaract.simulator',
+               '--host', self.host, '--port', str(self.port),
+               '--channels', str(channels), '--latency', str(latency)]
+        if pty:
+            cmd.append('--pty')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [p for p in [sys.path[0], env.get('PYTHONPATH')] if p])
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=env)
+        for _ in range(2 if pty else 1):
+            line = self._proc.stdout.readline().decode()
+            if 'serial port' in line:
+                self.serial_port = line.rsplit(' ', 1)[1].strip()
+
+    def close(self):
+        self._proc.terminate()
+        self._proc.wait()
+
+
+class Stats(object):
+    """
+    Latency statistics of a benchmark run.
+
+    :param name: benchmark name.
+    :param latencies: round trip time of each request (s).
+    :param ncmds: number of commands sent.
+    :param elapsed: wall time of the run (s).
+    :param cpu: CPU time of the run (s).
+    """
+    def __init__(self, name, latencies, ncmds, elapsed, cpu):
+        self.name = name
+        self.ncmds = ncmds
+        self.elapsed = elapsed
+        self.cpu = cpu
+        latencies = sorted(latencies)
+        self.p50 = percentile(latencies, 0.50)
+        self.p99 = percentile(latencies, 0.99)
+
+    @property
+    def rate(self):
+        return self.ncmds / self.elapsed
+
+    def as_dict(self):
+        return {'name': self.name, 'commands': self.ncmds,
+                'cmd_per_s': self.rate, 'p50_us': self.p50 * 1e6,
+                'p99_us': self.p99 * 1e6,
+                'cpu_us_per_cmd': self.cpu / self.ncmds * 1e6}
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def timed(name, func, nrequests, ncmds_per_request=1):
+    """
+    Run func nrequests times and measure the latency of each call.
+    """
+    latencies = []
+    cpu0 = cpu_time()
+    t0 = time.time()
+    for _ in range(nrequests):
+        t = time.time()
+        func()
+        latencies.append(time.time() - t)
+    elapsed = time.time() - t0
+    cpu = cpu_time() - cpu0
+    return Stats(name, latencies, nrequests * ncmds_per_request, elapsed, cpu)
+
+
+def print_table(results):
+    header = '%-40s %10s %10s %10s %12s' % ('benchmark', 'cmd/s', 'p50[us]',
+                                           'p99[us]', 'cpu/cmd[us]')
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        d = r.as_dict()
+        print('%-40s %10.0f %10.1f %10.1f %12.2f' % (
+            d['name'], d['cmd_per_s'], d['p50_us'], d['p99_us'],
+            d['cpu_us_per_cmd']))
@@ -0,0 +1,141 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Command formatting microbenchmark. It compares the cost of rendering the
+wire frame of a command with the previous formatting (name and channel,
+joined parameters and framing, one step each) and with the precompiled
+CommandTemplate cached on the axes, for a query without parameters and a
+movement with two. It also measures the send path of an axis command up
+to the data written by the I/O thread. The hand-off to the I/O thread is
+not included: see the layers of benchmarks/throughput.py.
+
+Examples:
+
+    python benchmarks/command_format.py
+    python benchmarks/command_format.py --calls 1000000
+"""
+
+import json
+import timeit
+import argparse
+
+from smaract.communication import PendingAnswer
+from smaract.protocol import CommandTemplate, frame_cmds, to_bytes
+
+
+def previous_format(str_cmd, axis_nr, *pars):
+    """
+    Previous formatting of SmaractBaseAxis._format_cmd.
+    """
+    str_cmd = "%s%d" % (str_cmd, axis_nr)
+    return "%s" % (str_cmd + "".join([",%d" % i for i in pars]))
+
+
+def previous_frame(str_cmd, axis_nr, *pars):
+    """
+    Previous formatting and framing of a command up to the wire.
+    """
+    cmd = previous_format(str_cmd, axis_nr, *pars)
+    return to_bytes(''.join([':%s\n' % c for c in [cmd]]))
+
+
+def template_frame(templates, str_cmd, axis_nr, *pars):
+    """
+    Frame rendered by the template cached on the axis, as _send_cmd.
+    """
+    template = templates.get((str_cmd, len(pars)))
+    if pars:
+        return to_bytes(template.frame(*pars))
+    return to_bytes(template.line)
+
+
+def ns_per_call(func, calls):
+    # Best of 5 runs
+    return min(timeit.repeat(func, number=calls, repeat=5)) / calls * 1e9
+
+
+def bench_format(calls):
+    """
+    :return: list of (case, previous ns, template ns).
+    """
+    templates = {('GP', 0): CommandTemplate('GP', 3, 0),
+                 ('MPA', 2): CommandTemplate('MPA', 3, 2)}
+    results = []
+    for name, cmd in (('GP3 (no parameters)', ('GP', 3)),
+                      ('MPA3,1000,0 (2 parameters)', ('MPA', 3, 1000, 0))):
+        assert previous_frame(*cmd) == template_frame(templates, *cmd)
+        results.append((name,
+                        ns_per_call(lambda: previous_frame(*cmd), calls),
+                        ns_per_call(lambda: template_frame(templates, *cmd),
+                                    calls)))
+    return results
+
+
+def bench_send(calls):
+    """
+    Send path of an axis command up to the write of the I/O thread, without
+    the thread hand-off: formatting, PendingAnswer and wire data.
+
+    :return: list of (case, previous ns, template ns).
+    """
+    templates = {}
+
+    def previous_path(str_cmd, *pars):
+        pending = PendingAnswer(previous_format(str_cmd, 0, *pars))
+        return to_bytes(frame_cmds([pending.cmd]))
+
+    def template_path(str_cmd, *pars):
+        template = templates.get((str_cmd, len(pars))) or \
+            templates.setdefault((str_cmd, len(pars)),
+                                 CommandTemplate(str_cmd, 0, len(pars)))
+        if pars:
+            line = template.frame(*pars)
+            cmd = line[1:-1]
+        else:
+            cmd, line = template.cmd, template.line
+        pending = PendingAnswer(cmd, frame=line, template=template)
+        return to_bytes(''.join([p.frame for p in [pending]]))
+    results = []
+    for name, cmd in (('send path GP0', ('GP',)),
+                      ('send path MPA0,1000,0', ('MPA', 1000, 0))):
+        assert previous_path(*cmd) == template_path(*cmd)
+        results.append((name,
+                        ns_per_call(lambda: previous_path(*cmd), calls),
+                        ns_per_call(lambda: template_path(*cmd), calls)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', default=100000, type=int,
+                        help='calls per formatting measurement')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = bench_format(args.calls)
+    results += bench_send(max(1, args.calls // 10))
+    print('%-30s %14s %14s %8s' % ('case', 'previous ns', 'template ns',
+                                   'speedup'))
+    print('-' * 69)
+    for name, previous, template in results:
+        print('%-30s %14.0f %14.0f %7.1fx' % (name, previous, template,
+                                              previous / template))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{'case': n, 'previous_ns': p, 'template_ns': t}
+                       for n, p, t in results], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
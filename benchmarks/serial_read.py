@@ -0,0 +1,114 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Serial read path benchmark. It compares the chunked reads of SerialCom with
+the previous byte by byte path (flush and pyserial readline per command),
+for single commands and pipelined batches, against a simulator on a
+pseudo-terminal serial pair started in a separated process. The
+pseudo-terminal does not emulate the baudrate, so it measures the software
+cost of the read path.
+
+Use --serial-port to benchmark a real controller.
+
+Examples:
+
+    python benchmarks/serial_read.py
+    python benchmarks/serial_read.py --serial-port /dev/ttyUSB0 --baudrate 115200
+"""
+
+import json
+import time
+import argparse
+
+from benchutil import SimulatorProcess, timed, print_table
+
+from serial import Serial
+
+from smaract.communication import SerialCom
+from smaract.protocol import to_bytes, to_str
+
+
+class LineSerialCom(Serial):
+    """
+    Previous read path: flush and pyserial readline, byte by byte.
+    """
+    def send_cmd(self, cmd):
+        self.flush()
+        self.write(to_bytes(cmd))
+        return to_str(self.readline())
+
+    def write_cmd(self, cmd):
+        self.write(to_bytes(cmd))
+
+    def read_answer(self, timeout=None):
+        return to_str(self.readline())
+
+
+def bench(name, com, nchannels, nrequests):
+    cmds = ['GP%d' % (i % nchannels) for i in range(nrequests)]
+    it = iter(cmds)
+
+    def request():
+        if not com.send_cmd(':%s\n' % next(it)):
+            raise RuntimeError('Timeout')
+    results = [timed('%s sync' % name, request, nrequests)]
+    batch = ''.join([':GS%d\n' % (i % nchannels) for i in range(18)])
+
+    def pipelined():
+        com.write_cmd(batch)
+        for _ in range(18):
+            if not com.read_answer():
+                raise RuntimeError('Timeout')
+    results.append(timed('%s batch(18)' % name, pipelined,
+                         max(1, nrequests // 18), 18))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--serial-port', help='real controller serial port')
+    parser.add_argument('--baudrate', default=115200, type=int)
+    parser.add_argument('--channels', default=9, type=int)
+    parser.add_argument('--latency', default=0.0, type=float,
+                        help='simulated answer latency (s)')
+    parser.add_argument('--requests', default=2000, type=int)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    sim = None
+    port = args.serial_port
+    if port is None:
+        sim = SimulatorProcess(args.channels, args.latency, pty=True)
+        port = sim.serial_port
+        time.sleep(0.2)
+    results = []
+    try:
+        for name, cls in (('readline', LineSerialCom),
+                          ('SerialCom', SerialCom)):
+            com = cls(port, args.baudrate, timeout=3)
+            try:
+                results += bench(name, com, args.channels, args.requests)
+            finally:
+                com.close()
+    finally:
+        if sim is not None:
+            sim.close()
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([r.as_dict() for r in results], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
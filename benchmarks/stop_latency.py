@@ -0,0 +1,121 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Stop latency benchmark. It measures the time from the call to stop() until
+its acknowledgement (the controller executes the stop before acknowledging
+it) while other threads keep the wire busy with batches of reads, with and
+without the priority lane.
+
+By default it runs against a simulator started in a separated process. Use
+--host to measure a real controller (the axis 0 is stopped, not moved).
+
+Examples:
+
+    python benchmarks/stop_latency.py
+    python benchmarks/stop_latency.py --latency 0.002 --pollers 8
+"""
+
+import json
+import time
+import argparse
+import threading
+
+from benchutil import SimulatorProcess, Stats
+
+from smaract import SmaractMCSController
+from smaract.communication import CommType
+
+
+def bench_stop(name, ctrl, nstops, npollers, priority):
+    """
+    Stop the axis 0 nstops times while npollers threads read the position
+    and state of all the axes in batches.
+    """
+    cmds = ['GP%d' % i for i in range(len(ctrl))]
+    cmds += ['GS%d' % i for i in range(len(ctrl))]
+    running = [True]
+
+    def poll():
+        while running[0]:
+            ctrl.send_cmds(cmds)
+    pollers = [threading.Thread(target=poll) for _ in range(npollers)]
+    for poller in pollers:
+        poller.daemon = True
+        poller.start()
+    latencies = []
+    try:
+        time.sleep(0.1)
+        t0 = time.time()
+        for _ in range(nstops):
+            t = time.time()
+            ctrl.send_cmd('S0', priority=priority)
+            latencies.append(time.time() - t)
+            time.sleep(0.005)
+        elapsed = time.time() - t0
+    finally:
+        running[0] = False
+        for poller in pollers:
+            poller.join()
+    stats = Stats(name, latencies, nstops, elapsed, 0)
+    stats.max = max(latencies)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', help='real controller address')
+    parser.add_argument('--port', default=5000, type=int)
+    parser.add_argument('--latency', default=0.001, type=float,
+                        help='simulated answer latency (s)')
+    parser.add_argument('--stops', default=200, type=int)
+    parser.add_argument('--pollers', default=4, type=int,
+                        help='threads reading in batches')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    sim = None
+    if args.host:
+        host, port = args.host, args.port
+    else:
+        sim = SimulatorProcess(9, args.latency)
+        host, port = sim.host, sim.port
+        time.sleep(0.2)
+    try:
+        ctrl = SmaractMCSController(CommType.Socket, host, port)
+        results = [bench_stop('idle', ctrl, args.stops, 0, True),
+                   bench_stop('%d pollers, queued' % args.pollers, ctrl,
+                              args.stops, args.pollers, False),
+                   bench_stop('%d pollers, priority' % args.pollers, ctrl,
+                              args.stops, args.pollers, True)]
+        ctrl._comm.close()
+    finally:
+        if sim is not None:
+            sim.close()
+
+    header = '%-40s %10s %10s %10s' % ('stop latency', 'p50[us]', 'p99[us]',
+                                       'max[us]')
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print('%-40s %10.1f %10.1f %10.1f' % (r.name, r.p50 * 1e6,
+                                              r.p99 * 1e6, r.max * 1e6))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{'name': r.name, 'p50_us': r.p50 * 1e6,
+                        'p99_us': r.p99 * 1e6, 'max_us': r.max * 1e6}
+                       for r in results], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Throughput and latency benchmark of the communication layers. It measures
+commands/second, p50/p99 round trip latency and CPU time per command of each
+transport in synchronous, pipelined (batch) and asynchronous mode, plus the
+cost of each software layer of the send path.
+
+By default it runs against a simulator started in a separated process (TCP
+and pseudo-terminal serial port) and an in-process Tango DeviceProxy
+stand-in, whose calls take the round trip to a remote device server given
+by --tango-latency. The Tango transport is measured with and without its
+bulk mode. Use --host, --serial-port or --tango-device to benchmark a real
+controller.
+
+Examples:
+
+    python benchmarks/throughput.py
+    python benchmarks/throughput.py --host 10.0.34.194 --requests 2000
+"""
+
+import json
+import time
+import argparse
+
+from benchutil import SimulatorProcess, Stats, timed, print_table, cpu_time
+
+from smaract import SmaractMCSController
+from smaract.axis import SmaractMCSLinearAxis
+from smaract.communication import CommType
+from smaract.constants import CommunicationMode
+from smaract.controller import SmaractBaseController
+from smaract.protocol import CommandTemplate, unframe
+from smaract.simulator import SmaractSimulator, SimulatorDeviceProxy
+
+
+def status_cmds(ctrl):
+    """
+    Commands of a status refresh: position and state of every channel.
+    """
+    cmds = ['GP%d' % i for i in range(len(ctrl))]
+    return cmds + ['GS%d' % i for i in range(len(ctrl))]
+
+
+def bench_sync(name, ctrl, nrequests):
+    cmds = status_cmds(ctrl)
+    it = iter(range(nrequests))
+
+    def request():
+        ctrl.send_cmd(cmds[next(it) % len(cmds)])
+    return timed('%s sync' % name, request, nrequests)
+
+
+def bench_batch(name, ctrl, nrequests):
+    cmds = status_cmds(ctrl)
+    nbatches = max(1, nrequests // len(cmds))
+    return timed('%s batch(%d)' % (name, len(cmds)),
+                 lambda: ctrl.send_cmds(cmds), nbatches, len(cmds))
+
+
+def bench_async(name, ctrl, nrequests, window):
+    """
+    Keep up to window commands in flight. The latency of each command is
+    measured from its submission until the reader thread delivers it.
+    """
+    cmds = status_cmds(ctrl)
+    ctrl.communication_mode = CommunicationMode.ASYNC
+    latencies = []
+
+    def done(t):
+        return lambda pending: latencies.append(time.time() - t)
+    try:
+        cpu0 = cpu_time()
+        t0 = time.time()
+        inflight = []
+        for i in range(nrequests):
+            pending = ctrl.send_cmd_async(cmds[i % len(cmds)])
+            pending.add_done_callback(done(time.time()))
+            inflight.append(pending)
+            if len(inflight) >= window:
+                inflight.pop(0).result(3)
+        for pending in inflight:
+            pending.result(3)
+        elapsed = time.time() - t0
+        cpu = cpu_time() - cpu0
+    finally:
+        ctrl.communication_mode = CommunicationMode.SYNC
+    return Stats('%s async(%d)' % (name, window), latencies, nrequests,
+                 elapsed, cpu)
+
+
+class NullCom(object):
+    """
+    Transport answering immediately with a canned answer, to measure the
+    cost of the software layers on top of it.
+    """
+    answer = ':P0,100\n'
+
+    def __init__(self):
+        self._answers = 0
+
+    def send_cmd(self, cmd):
+        return self.answer
+
+    def write_cmd(self, cmd):
+        self._answers += cmd.count('\n')
+
+    def read_answer(self, timeout=None):
+        if not self._answers:
+            time.sleep(timeout or 0)
+            return ''
+        self._answers -= 1
+        return self.answer
+
+
+class DirectIO(object):
+    """
+    Stand-in of the IOThread sending the commands from the calling thread,
+    so the layers are measured without the noise of the thread handoff.
+    """
+    reader = None
+
+    def __init__(self, comm):
+        self._comm = comm
+
+    def submit(self, pendings, priority=False):
+        for p in pendings:
+            p.set_answer(unframe(self._comm.send_cmd(p.frame)))
+
+
+def bench_layers(n, repeat=5):
+    """
+    Cost of each layer of the send path on top of a null transport. The
+    I/O thread is bypassed.
+
+    :return: list of (layer, ns per call, ns added by the layer).
+    """
+    ctrl = SmaractBaseController(CommType.Simulator, SmaractSimulator(1))
+    null = NullCom()
+    ctrl._comm._io.close()
+    ctrl._comm._comm = null
+    ctrl._comm._io = DirectIO(null)
+    axis = SmaractMCSLinearAxis(ctrl, 0)
+    template = CommandTemplate('GP', 0)
+    # The command is given framed with its template, as the axes do
+    layers = [('transport (null)', lambda: null.send_cmd(':GP0\n')),
+              ('SmaractCommunication.send_cmd',
+               lambda: ctrl._comm.send_cmd('GP0', frame=':GP0\n',
+                                           template=template)),
+              ('SmaractBaseController.send_cmd',
+               lambda: ctrl.send_cmd('GP0', frame=':GP0\n',
+                                     template=template)),
+              ('SmaractBaseAxis._send_cmd', lambda: axis._send_cmd('GP')),
+              ('SmaractMCSLinearAxis.position', lambda: axis.position)]
+    # Best of several runs, as timeit does. The layers are interleaved so
+    # the noise of the machine affects all of them alike.
+    best = [float('inf')] * len(layers)
+    for _ in range(repeat):
+        for i, (layer, func) in enumerate(layers):
+            t0 = time.time()
+            for _ in range(n):
+                func()
+            best[i] = min(best[i], (time.time() - t0) / n * 1e9)
+    results = []
+    previous = 0
+    for (layer, func), ns in zip(layers, best):
+        results.append((layer, ns, ns - previous))
+        previous = ns
+    return results
+
+
+def controllers(args):
+    """
+    Yield (name, controller) for each transport to benchmark.
+    """
+    real = args.host or args.serial_port or args.tango_device
+    if args.host:
+        yield 'socket', SmaractMCSController(CommType.Socket, args.host,
+                                             args.port)
+    if args.serial_port:
+        yield 'serial', SmaractMCSController(CommType.Serial,
+                                             args.serial_port, args.baudrate,
+                                             8, 'N', 1, 3)
+    if args.tango_device:
+        yield 'tango', SmaractMCSController(CommType.SerialTango,
+                                            args.tango_device)
+        yield 'tango bulk', SmaractMCSController(CommType.SerialTango,
+                                                 args.tango_device, True)
+    if real:
+        return
+    sim = SimulatorProcess(args.channels, args.latency, pty=True)
+    try:
+        time.sleep(0.2)
+        yield 'socket(sim)', SmaractMCSController(CommType.Socket, sim.host,
+                                                  sim.port)
+        yield 'serial(sim pty)', SmaractMCSController(
+            CommType.Serial, sim.serial_port, 115200, 8, 'N', 1, 3)
+    finally:
+        sim.close()
+    simulator = SmaractSimulator(args.channels, latency=args.latency)
+    yield 'tango(stand-in)', SmaractMCSController(
+        CommType.SerialTango,
+        SimulatorDeviceProxy(simulator, call_latency=args.tango_latency))
+    yield 'tango bulk(stand-in)', SmaractMCSController(
+        CommType.SerialTango,
+        SimulatorDeviceProxy(simulator, call_latency=args.tango_latency),
+        True)
+    yield 'in-process(sim)', SmaractMCSController(CommType.Simulator,
+                                                  simulator)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', help='real controller address')
+    parser.add_argument('--port', default=5000, type=int)
+    parser.add_argument('--serial-port', help='real controller serial port')
+    parser.add_argument('--baudrate', default=9600, type=int)
+    parser.add_argument('--tango-device', help='Tango Serial device name')
+    parser.add_argument('--tango-latency', default=0.0005, type=float,
+                        help='round trip of each call to the Tango '
+                        'stand-in (s)')
+    parser.add_argument('--channels', default=9, type=int,
+                        help='simulated channels')
+    parser.add_argument('--latency', default=0.0, type=float,
+                        help='simulated answer latency (s)')
+    parser.add_argument('--requests', default=1000, type=int)
+    parser.add_argument('--window', default=32, type=int,
+                        help='commands in flight in async mode')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for name, ctrl in controllers(args):
+        results.append(bench_sync(name, ctrl, args.requests))
+        results.append(bench_batch(name, ctrl, args.requests))
+        results.append(bench_async(name, ctrl, args.requests, args.window))
+        if hasattr(ctrl._comm._comm, 'close'):
+            ctrl._comm._comm.close()
+    print_table(results)
+
+    print('')
+    layers = bench_layers(args.requests * 4)
+    print('%-40s %12s %12s' % ('layer', 'ns/call', 'added ns'))
+    print('-' * 66)
+    for layer, ns, added in layers:
+        print('%-40s %12.0f %12.0f' % (layer, ns, added))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'transports': [r.as_dict() for r in results],
+                       'layers': [{'layer': l, 'ns': ns, 'added_ns': a}
+                                  for l, ns, a in layers]}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
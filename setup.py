@@ -45,7 +45,9 @@ classifiers = [
 
     # Specify the Python versions you support here. In particular, ensure
     # that you indicate whether you support Python 2, Python 3 or both.
-    'Programming Language :: Python :: 2.7',
+    'Programming Language :: Python :: 3',
+    'Programming Language :: Python :: 3 :: Only',
+    'Programming Language :: Python :: 3.7',
 ]
 
 setup(
@@ -63,6 +65,8 @@ setup(
     description='Python library to for Smaract Motor Controllers',
     long_description=long_description,
     requires=['setuptools (>=1.1)'],  # In PyPI
+    # The asyncio front-end (smaract.aio) needs 3.7
+    python_requires='>=3.7',
     # TODO: include the requirements.
     # install_requires=['socket', 'serial'],  # In PyPI
     classifiers=classifiers
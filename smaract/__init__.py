@@ -13,6 +13,7 @@
 
 
 from .controller import SmaractSDCController, SmaractMCSController
+from .group import ControllerGroup
 from .communication import CommType
 from .constants import Direction, SensorMode, EffectorType, Status
 
@@ -0,0 +1,665 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+asyncio front-end of the MCS controllers (Python 3.7 or newer).
+
+The classes mirror SmaractMCSController, SmaractMCSLinearAxis and
+SmaractMCSAngularAxis, but every property and command returns an asyncio
+future instead of blocking::
+
+    ctrl = await AsyncSmaractMCSController.connect('10.0.34.194')
+    await ctrl[0].move(1000, wait=True)
+    position = await ctrl[0].position
+
+The controller is used on a single non-blocking TCP connection. The requests
+of all the coroutines are pipelined on it and their answers are matched in
+order, so many concurrent requests and waits do not need any thread.
+
+The properties and methods are generated from the sync classes: each one is
+replayed on a sync instance whose commands are answered with the answers
+already received, and the first command not answered yet is sent. So they
+convert the answers and check the parameters exactly as the sync classes.
+"""
+
+import asyncio
+import functools
+import inspect
+from collections import deque
+
+from .constants import *
+from .protocol import FrameDecoder, encode, parse_reply
+from .communication import CommType
+from .controller import SmaractMCSController
+from .axis import SmaractMCSBaseAxis, SmaractMCSLinearAxis, \
+    SmaractMCSAngularAxis
+
+__all__ = ['AsyncSocketCom', 'AsyncSmaractMCSController',
+           'AsyncSmaractMCSLinearAxis', 'AsyncSmaractMCSAngularAxis']
+
+
+def _then(fut, func):
+    """
+    Chain func to the result of a future.
+
+    :param fut: asyncio future.
+    :param func: called with the result of fut. It can return a value or
+    another future.
+    :return: future with the value returned by func.
+    """
+    result = fut.get_loop().create_future()
+
+    def copy(f):
+        if result.done():
+            return
+        if f.cancelled():
+            result.cancel()
+        elif f.exception() is not None:
+            result.set_exception(f.exception())
+        else:
+            result.set_result(f.result())
+
+    def chain(f):
+        if result.done():
+            return
+        if f.cancelled():
+            result.cancel()
+            return
+        if f.exception() is not None:
+            result.set_exception(f.exception())
+            return
+        try:
+            value = func(f.result())
+        except Exception as e:
+            result.set_exception(e)
+            return
+        if asyncio.isfuture(value):
+            value.add_done_callback(copy)
+        else:
+            result.set_result(value)
+
+    fut.add_done_callback(chain)
+    return result
+
+
+class AsyncSocketCom(asyncio.Protocol):
+    """
+    Non-blocking TCP transport. The controller is used in synchronous
+    communication mode, so every command is answered and the answers are
+    matched with the requests in order. The unsolicited messages (reports)
+    are delivered to the listeners.
+
+    :param timeout: time (s) to wait for each answer.
+    :param loop: event loop.
+    """
+    def __init__(self, timeout=3.0, loop=None):
+        self.timeout = timeout
+        self.listeners = []
+        self._loop = loop or asyncio.get_event_loop()
+        self._transport = None
+        self._rx = FrameDecoder()
+        self._pending = deque()
+        self._barrier = None
+
+    @classmethod
+    def connect(cls, host, port=5000, timeout=3.0, loop=None):
+        """
+        Open the connection.
+
+        :param host: controller address.
+        :param port: controller port.
+        :param timeout: time (s) to wait for each answer.
+        :param loop: event loop.
+        :return: future with the AsyncSocketCom instance.
+        """
+        loop = loop or asyncio.get_event_loop()
+        com = cls(timeout, loop)
+        fut = asyncio.ensure_future(
+            loop.create_connection(lambda: com, host, port), loop=loop)
+        fut = asyncio.ensure_future(asyncio.wait_for(fut, timeout), loop=loop)
+        return _then(fut, lambda _: com)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def synchronize(self):
+        """
+        Set the synchronous communication mode. The answers pending from a
+        previous session (e.g. in asynchronous mode) are discarded.
+
+        :return: future done when the controller is synchronized.
+        """
+        self._barrier = self._loop.create_future()
+        self._expire_later(self._barrier)
+        self._transport.write(encode(['SCM0', 'GCM']))
+        return self._barrier
+
+    def send_cmd(self, cmd):
+        """
+        Send a command.
+
+        :param cmd: command without the frame characters.
+        :return: future with the answer, without the frame characters.
+        """
+        return self.send_cmds([cmd])[0]
+
+    def send_cmds(self, cmds, on_last=None):
+        """
+        Send several commands on a single write.
+
+        :param cmds: list of commands.
+        :param on_last: function called with the future of the last command
+        as soon as its answer is received, before any later message is
+        dispatched (the future callbacks are scheduled on the event loop).
+        :return: list of futures with the answers.
+        """
+        if self._transport is None or self._transport.is_closing():
+            raise RuntimeError('The connection is closed')
+        futs = []
+        for cmd in cmds:
+            fut = self._loop.create_future()
+            # A timed out request keeps its place on the queue, so the
+            # answers received later are still matched in order.
+            self._expire_later(fut)
+            self._pending.append((fut, None))
+            futs.append(fut)
+        if on_last is not None:
+            self._pending[-1] = (futs[-1], on_last)
+        self._transport.write(encode(cmds))
+        return futs
+
+    def _expire_later(self, fut):
+        handle = self._loop.call_later(self.timeout, self._expire, fut)
+        fut.add_done_callback(lambda f: handle.cancel())
+
+    def _expire(self, fut):
+        if not fut.done():
+            fut.set_exception(RuntimeError('Timeout waiting for the answer'))
+
+    # asyncio.Protocol interface
+    # -------------------------------------------------------------------------
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        self._rx.feed(data)
+        while True:
+            ans = self._rx.next_reply()
+            if ans is None:
+                break
+            self._dispatch(ans)
+
+    def connection_lost(self, exc):
+        error = RuntimeError('Connection lost: %s' % (exc or 'closed'))
+        futs = [fut for fut, _ in self._pending]
+        self._pending.clear()
+        if self._barrier is not None:
+            futs.append(self._barrier)
+        for fut in futs:
+            if not fut.done():
+                fut.set_exception(error)
+
+    def _dispatch(self, ans):
+        code = ans.code
+        if self._barrier is not None:
+            if code == 'CM':
+                barrier, self._barrier = self._barrier, None
+                if not barrier.done():
+                    barrier.set_result(ans)
+            return
+        if code in (Report.COMPLETED, Report.TRIGGERED) or \
+                not self._pending:
+            for listener in self.listeners:
+                listener(ans)
+            return
+        fut, on_answer = self._pending.popleft()
+        if not fut.done():
+            fut.set_result(ans)
+        if on_answer is not None:
+            on_answer(fut)
+
+
+class _Request(BaseException):
+    """
+    Raised by a replay when the method needs the answer of a request which
+    is not received yet (see AsyncSmaractMCSController._call). It is not an
+    Exception, so the error handling of the sync methods does not catch it.
+
+    :param cmds: command (send_cmd) or list of commands (send_cmds).
+    :param raise_errors: see SmaractBaseController.send_cmds.
+    :param axis_nr: channel of a movement command waited for its report.
+    :param timeout: time (s) to wait for the report of the movement.
+    """
+    def __init__(self, cmds, raise_errors=True, axis_nr=None, timeout=None):
+        BaseException.__init__(self, cmds)
+        self.cmds = cmds
+        self.raise_errors = raise_errors
+        self.axis_nr = axis_nr
+        self.timeout = timeout
+
+
+class _Completion(object):
+    """
+    Completion of a movement on a replay, see
+    SmaractMCSController.send_movement.
+    """
+    def __init__(self, replay, axis_nr, cmd):
+        self._replay = replay
+        self._axis_nr = axis_nr
+        self._cmd = cmd
+
+    def result(self, timeout=None):
+        return self._replay._answer(
+            _Request(self._cmd, axis_nr=self._axis_nr, timeout=timeout))
+
+
+class _ReplayController(SmaractMCSController):
+    """
+    Controller where the methods of the sync controller and axes are
+    replayed. The commands are answered with the answers already received,
+    in order, and the first command without answer raises _Request.
+    """
+    def __init__(self, reporting):
+        list.__init__(self)
+        self._lazy_axes = False
+        self._metadata = None
+        self._reporting = reporting
+        self.answers = []
+        self.index = 0
+
+    def _answer(self, request):
+        if self.index == len(self.answers):
+            raise request
+        ans = self.answers[self.index]
+        self.index += 1
+        return ans
+
+    def send_cmd(self, cmd, priority=None, frame=None, template=None):
+        return self._answer(_Request(cmd))
+
+    def send_cmds(self, cmds, raise_errors=True):
+        return self._answer(_Request(list(cmds), raise_errors))
+
+    def send_movement(self, axis_nr, cmd):
+        return _Completion(self, axis_nr, cmd)
+
+    def _invalidate_cache(self, cmds):
+        pass
+
+
+def _mirror_method(func, name=None):
+    @functools.wraps(func)
+    def method(self, *args, **kwargs):
+        return self._call(lambda: func(self._sync, *args, **kwargs))
+    if name is not None:
+        method.__name__ = method.__qualname__ = name
+    return method
+
+
+def _mirror_property(prop):
+    def fget(self):
+        return self._call(lambda: prop.fget(self._sync))
+    return property(fget, doc=prop.__doc__)
+
+
+def _public_members(sync_cls, exclude=()):
+    """
+    :return: names of the public properties and methods of a sync class.
+    """
+    names = []
+    for name in dir(sync_cls):
+        member = getattr(sync_cls, name)
+        if name.startswith('_') or name in exclude:
+            continue
+        if isinstance(member, property) or inspect.isfunction(member):
+            names.append(name)
+    return names
+
+
+def _mirror(cls, names, setters=()):
+    """
+    Add to an asyncio class the members of its sync class (SYNC_CLASS)
+    which it does not define. The properties and the methods return
+    futures and the property setters become set_<name> methods.
+
+    :param cls: asyncio class.
+    :param names: names of the members of the sync class.
+    :param setters: names of the properties whose setter is mirrored.
+    :return: cls
+    """
+    for name in names:
+        if hasattr(cls, name):
+            continue
+        member = getattr(cls.SYNC_CLASS, name)
+        if not isinstance(member, property):
+            setattr(cls, name, _mirror_method(member))
+            continue
+        setattr(cls, name, _mirror_property(member))
+        setter = 'set_' + name
+        if name in setters and member.fset is not None and \
+                not hasattr(cls, setter) and \
+                not hasattr(cls.SYNC_CLASS, setter):
+            setattr(cls, setter, _mirror_method(member.fset, setter))
+    return cls
+
+
+class AsyncSmaractMCSController(list):
+    """
+    asyncio version of SmaractMCSController. Use the connect class method
+    to create it.
+
+    The properties and methods of SmaractMCSController listed in MEMBERS
+    are available and return futures; the property setters are set_<name>
+    methods. The asynchronous communication mode is not supported (the
+    controller is used in synchronous mode), so the communication_mode
+    setter, async_errors and the triggered movements are not available,
+    neither the baudrate (serial only) and metadata cache methods.
+
+    :param com: connected AsyncSocketCom.
+    """
+    SYNC_CLASS = SmaractMCSController
+    ERROR_CODES = SmaractMCSController.ERROR_CODES
+    SENSOR_CODE = SmaractMCSController.SENSOR_CODE
+    LINEAR_SENSORS = SmaractMCSController.LINEAR_SENSORS
+    ROTARY_SENSORS = SmaractMCSController.ROTARY_SENSORS
+    # Mirrored members of SmaractMCSController
+    MEMBERS = ['version', 'nchannels', 'id', 'communication_mode', 'reset',
+               'set_hcm_enabled', 'sensor_enabled', 'trigger_command',
+               'keep_alive', 'stop_all', 'snapshot']
+
+    def __init__(self, com):
+        list.__init__(self)
+        self._comm = com
+        # Movements waiting for their completion report, by channel
+        self._completions = {}
+        # Channels with the report on complete enabled
+        self._reporting = set()
+        # The sync methods are replayed on it
+        self._sync = _ReplayController(self._reporting)
+        com.listeners.append(self._on_report)
+
+    @classmethod
+    def connect(cls, host, port=5000, timeout=3.0, loop=None):
+        """
+        Connect to the controller and create its axes.
+
+        :param host: controller address.
+        :param port: controller port.
+        :param timeout: time (s) to wait for each answer.
+        :param loop: event loop.
+        :return: future with the controller.
+        """
+        fut = AsyncSocketCom.connect(host, port, timeout, loop)
+        return _then(fut, lambda com: cls(com)._create_axes())
+
+    def _create_axes(self):
+        fut = _then(self._comm.synchronize(), lambda _: self.nchannels)
+
+        def sensors(nchannels):
+            cmds = ['GST%d' % axis_nr for axis_nr in range(nchannels)]
+            return asyncio.gather(*self.send_cmds(cmds))
+
+        def create(answers):
+            for axis_nr, ans in enumerate(answers):
+                axis = self._create_axis(axis_nr, ans)
+                self.append(axis)
+                self._sync.append(axis._sync)
+            return self
+        return _then(_then(fut, sensors), create)
+
+    def _create_axis(self, axis_nr, ans):
+        """
+        Create the axis of a channel.
+
+        :param axis_nr: channel index.
+        :param ans: answer of the GST command.
+        :return: AsyncSmaractMCSLinearAxis or AsyncSmaractMCSAngularAxis.
+        """
+        sensor_code = int(ans.values[-1])
+        if sensor_code in self.LINEAR_SENSORS:
+            return AsyncSmaractMCSLinearAxis(self, axis_nr)
+        elif sensor_code in self.ROTARY_SENSORS:
+            return AsyncSmaractMCSAngularAxis(self, axis_nr)
+        msg = "Failed to create axis %s\n" % axis_nr
+        msg += 'There is not axis class for sensor code %d' % sensor_code
+        raise RuntimeError(msg)
+
+    def close(self):
+        self._comm.close()
+
+    @property
+    def comm_type(self):
+        """
+        Get the communication type for this controller.
+
+        :return: communication type
+        """
+        return CommType.Socket
+
+    def send_cmd(self, cmd):
+        """
+        Send a command to the controller.
+
+        :param cmd: string command following the Smaract ASCii Programming
+        Interface.
+        :return: future with the answer. It raises RuntimeError if the
+        controller returns an error.
+        """
+        return _then(self._comm.send_cmd(cmd), self._check)
+
+    def send_cmds(self, cmds):
+        """
+        Send several commands on a single write.
+
+        :param cmds: list of commands.
+        :return: list of futures with the answers.
+        """
+        return [_then(fut, self._check)
+                for fut in self._comm.send_cmds(cmds)]
+
+    # The requests are never blocking
+    send_cmd_async = send_cmd
+    send_cmds_async = send_cmds
+
+    def send_movement(self, axis_nr, cmd):
+        """
+        Send a movement command and get its completion, reported by the
+        controller (see SmaractMCSController.send_movement).
+
+        :param axis_nr: channel index.
+        :param cmd: movement command, e.g. 'MPA0,1000,0'.
+        :return: future done when the movement is completed.
+        """
+        cmds = [cmd, 'GS%d' % axis_nr]
+        if axis_nr not in self._reporting:
+            cmds.insert(0, 'SRC%d,1' % axis_nr)
+        completion = self._comm._loop.create_future()
+
+        def started(fut):
+            # The previous answers are already received
+            try:
+                for f in futs:
+                    self._check(f.result())
+                state = int(fut.result().values[0])
+            except Exception as e:
+                completion.set_exception(
+                    RuntimeError('Command %s failed. %s' % (cmd, e)))
+                return
+            if state in Status.moving_states:
+                self._completions.setdefault(axis_nr, []).append(completion)
+            else:
+                completion.set_result(
+                    parse_reply('%s%d' % (Report.COMPLETED, axis_nr)))
+        futs = self._comm.send_cmds(cmds, started)
+        self._reporting.add(axis_nr)
+        return completion
+
+    def _on_report(self, ans):
+        if ans.code == Report.COMPLETED:
+            for completion in self._completions.pop(ans.channel, []):
+                if not completion.done():
+                    completion.set_result(ans)
+
+    def _check(self, ans):
+        return parse_reply(ans).check(self.ERROR_CODES)
+
+    def _call(self, func):
+        """
+        Run a method of the sync classes on the replay controller. Each
+        time it needs an answer not received yet, the request is sent and
+        the method is run again, once answered, with all the answers.
+
+        :param func: function without arguments calling the method.
+        :return: future with the value returned by the method.
+        """
+        answers = []
+
+        def run():
+            self._sync.answers = answers
+            self._sync.index = 0
+            try:
+                return func()
+            except _Request as request:
+                return _then(self._request(request), answered)
+
+        def answered(ans):
+            answers.append(ans)
+            return run()
+
+        result = self._comm._loop.create_future()
+        try:
+            value = run()
+        except Exception as e:
+            result.set_exception(e)
+            return result
+        if asyncio.isfuture(value):
+            return value
+        result.set_result(value)
+        return result
+
+    def _request(self, request):
+        """
+        Send the request of a replay.
+
+        :param request: _Request.
+        :return: future with the answer expected by the replay.
+        """
+        loop = self._comm._loop
+        if request.axis_nr is not None:
+            fut = self.send_movement(request.axis_nr, request.cmds)
+            if request.timeout is not None:
+                fut = asyncio.ensure_future(
+                    asyncio.wait_for(fut, request.timeout), loop=loop)
+            return fut
+        if not isinstance(request.cmds, list):
+            return self.send_cmd(request.cmds)
+        if not request.cmds:
+            fut = loop.create_future()
+            fut.set_result([])
+            return fut
+        return asyncio.gather(*self.send_cmds(request.cmds),
+                              return_exceptions=not request.raise_errors)
+
+
+_mirror(AsyncSmaractMCSController, AsyncSmaractMCSController.MEMBERS,
+        ['sensor_enabled'])
+
+
+class AsyncSmaractMCSBaseAxis(object):
+    """
+    asyncio version of SmaractMCSBaseAxis. The properties and methods of
+    the sync axis class (SYNC_CLASS) return futures, and the property
+    setters are set_<name> methods, e.g. set_closed_loop_vel. The answers
+    are not cached.
+    """
+    SYNC_CLASS = SmaractMCSBaseAxis
+
+    def __init__(self, ctrl, axis_nr=0):
+        self._ctrl = ctrl
+        self._axis_nr = axis_nr
+        # The sync methods are replayed on it
+        self._sync = self.SYNC_CLASS(ctrl._sync, axis_nr)
+        self._sync.cache_ttl = {}
+
+    def _call(self, func):
+        return self._ctrl._call(func)
+
+    def _format_cmd(self, str_cmd, *pars):
+        return self._sync._format_cmd(str_cmd, *pars)
+
+    def _send_cmd(self, str_cmd, *pars):
+        return self._ctrl.send_cmd(self._format_cmd(str_cmd, *pars))
+
+    def move_async(self, position, hold_time=0):
+        """
+        Start a movement to an absolute position and get its completion,
+        reported by the controller (the report on complete is enabled on
+        the channel).
+
+        :param position: target position.
+        :param hold_time: hold the movement for this amount of time in ms.
+        :return: future done when the movement is completed.
+        """
+        return self._ctrl.send_movement(
+            self._axis_nr, self._sync._move_cmd(position, hold_time))
+
+    def wait_stopped(self, poll_interval=0.05):
+        """
+        Poll the state until the positioner is stopped. The polling is
+        scheduled on the event loop, it does not use any thread. The wait
+        option of the movement commands does not need polling.
+
+        :param poll_interval: time (s) between state requests.
+        :return: future done when the positioner is stopped.
+        """
+        loop = self._ctrl._comm._loop
+        done = loop.create_future()
+
+        def poll():
+            _then(self.state, check).add_done_callback(failed)
+
+        def check(state):
+            if state == Status.STOPPED:
+                if not done.done():
+                    done.set_result(None)
+            elif not done.done():
+                loop.call_later(poll_interval, poll)
+
+        def failed(f):
+            if f.exception() is not None and not done.done():
+                done.set_exception(f.exception())
+        poll()
+        return done
+
+
+def _mirror_axis(cls):
+    names = _public_members(cls.SYNC_CLASS, ['invalidate_cache'])
+    return _mirror(cls, names, names)
+
+
+@_mirror_axis
+class AsyncSmaractMCSLinearAxis(AsyncSmaractMCSBaseAxis):
+    """
+    asyncio version of SmaractMCSLinearAxis.
+    """
+    SYNC_CLASS = SmaractMCSLinearAxis
+
+
+@_mirror_axis
+class AsyncSmaractMCSAngularAxis(AsyncSmaractMCSBaseAxis):
+    """
+    asyncio version of SmaractMCSAngularAxis. The positions are total
+    angles in micro-degrees.
+    """
+    SYNC_CLASS = SmaractMCSAngularAxis
@@ -12,8 +12,10 @@
 # ------------------------------------------------------------------------------
 
 
+import time
 import weakref
-from constants import *
+from .constants import *
+from .protocol import CommandTemplate
 
 
 class SmaractBaseAxis(object):
@@ -22,11 +24,49 @@ class SmaractBaseAxis(object):
     Smaract axis. The methods here implemented correspond to those
     at the axis level. The _send_cmd function wrappers the current controller
     _send_cmd method.
+
+    The answers of the queries are cached for the time set per command on
+    cache_ttl, or per command and first parameter, e.g. ('GCP', key) for a
+    channel property. The controller invalidates them when it sends a
+    command to the channel (see invalidate_cache).
     """
+    # Default time to live (s) of the cached answers, by query. 0 disables
+    # the cache of the query. The channel properties changed by the
+    # controller itself (counters, inputs) are not cached.
+    CACHE_TTL = {'GCLA': 1.0, 'GCLS': 1.0, 'GCP': 1.0, 'GEET': 1.0,
+                 'GPL': 1.0, 'GAL': 1.0, 'GSC': 1.0, 'GSD': 1.0, 'GST': 1.0,
+                 'GTE': 1.0, 'GCT': 1.0, 'GSN': 1.0, 'GFV': 1.0,
+                 'GP': 0, 'GA': 0, 'GS': 0, 'GPPK': 0, 'GVL': 0, 'GF': 0,
+                 'GGO': 0, 'GTP': 0,
+                 ('GCP', ChannelProperties.Counter): 0,
+                 ('GCP', ChannelProperties.QueueSize): 0,
+                 ('GCP', ChannelProperties.DigitalIn): 0,
+                 ('GCP', ChannelProperties.DigitalInEdge): 0}
+    # Queries whose answer changes with the movements and the reports
+    DYNAMIC_QUERIES = ['GP', 'GA', 'GS', 'GPPK', 'GVL', 'GF', 'GGO', 'GTP']
+    # Queries whose answer is changed by each command (besides the dynamic
+    # ones). Any other command invalidates all the cached answers.
+    CACHE_SETTERS = {'SCLA': ['GCLA'], 'SCLS': ['GCLS'], 'SCP': ['GCP'],
+                     'SEET': ['GEET'], 'SPL': ['GPL'], 'SAL': ['GAL'],
+                     'SSC': ['GSC'], 'SSD': ['GSD'], 'SST': ['GST'],
+                     'STE': ['GTE'], 'SRC': [], 'SRT': [], 'SCLF': [],
+                     'SSW': [], 'SZF': [], 'SP': [], 'S': [], 'CS': [],
+                     'FRM': [], 'FP': [], 'MPA': [], 'MPR': [], 'MAA': [],
+                     'MAR': [], 'MST': [], 'MSCA': [], 'MSCR': [],
+                     'MGFA': [], 'MGOA': [], 'MGOR': []}
+
     def __init__(self, ctrl, axis_nr=0):
         self._axis_nr = axis_nr
         ref = weakref.ref(ctrl)
         self._ctrl = ref()
+        self.cache_ttl = dict(self.CACHE_TTL)
+        # command -> (query, expiration time, answer)
+        self._cache = {}
+        # Changes on every invalidation, so that the answers read meanwhile
+        # are not cached
+        self._cache_generation = 0
+        # (command name, number of parameters) -> CommandTemplate
+        self._templates = {}
         
     def _send_cmd(self, str_cmd, *pars):
         """
@@ -37,9 +77,70 @@ class SmaractBaseAxis(object):
         :param pars: optional parameters required by the command.
         :return: command answer.
         """
-        str_cmd = "%s%d" % (str_cmd, self._axis_nr)
-        cmd = "%s" % (str_cmd + "".join([",%d" % i for i in pars]))
-        return self._ctrl.send_cmd(cmd)
+        template = self._templates.get((str_cmd, len(pars))) or \
+            self._template(str_cmd, len(pars))
+        if pars:
+            line = template.frame(*pars)
+            cmd = line[1:-1]
+        else:
+            cmd, line = template.cmd, template.line
+        ttl = self.cache_ttl.get(str_cmd)
+        if ttl and pars:
+            ttl = self.cache_ttl.get((str_cmd, pars[0]), ttl)
+        if not ttl:
+            return self._ctrl.send_cmd(cmd, frame=line, template=template)
+        now = time.time()
+        entry = self._cache.get(cmd)
+        if entry is not None and entry[1] > now:
+            return entry[2]
+        generation = self._cache_generation
+        ans = self._ctrl.send_cmd(cmd, frame=line, template=template)
+        if generation == self._cache_generation:
+            self._cache[cmd] = (str_cmd, now + ttl, ans)
+        return ans
+
+    def invalidate_cache(self, queries=None):
+        """
+        Drop cached answers of the axis queries.
+
+        :param queries: names of the queries, e.g. ['GCLS']. None drops all.
+        :return: None
+        """
+        self._cache_generation += 1
+        for cmd, entry in list(self._cache.items()):
+            if queries is None or entry[0] in queries:
+                self._cache.pop(cmd, None)
+
+    def _cmd_sent(self, name):
+        """
+        Invalidate the cached answers changed by a command sent to the
+        channel.
+
+        :param name: command name, e.g. 'SCLS'.
+        :return: None
+        """
+        queries = self.CACHE_SETTERS.get(name)
+        if queries is None:
+            self.invalidate_cache()
+        else:
+            self.invalidate_cache(self.DYNAMIC_QUERIES + queries)
+
+    def _template(self, str_cmd, npars):
+        """
+        Get the precompiled command of the channel, created on first use.
+
+        :param str_cmd: String command following the ASCii Smaract API.
+        :param npars: number of parameters.
+        :return: CommandTemplate.
+        """
+        template = CommandTemplate(str_cmd, self._axis_nr, npars)
+        self._templates[(str_cmd, npars)] = template
+        return template
+
+    def _format_cmd(self, str_cmd, *pars):
+        template = self._templates.get((str_cmd, len(pars))) or \
+            self._template(str_cmd, len(pars))
+        return template.render(*pars)
 
     @property
     def safe_direction(self):
@@ -103,7 +204,7 @@ class SmaractBaseAxis(object):
         Documentation: MCS Manual section 3.4
         """
         ans = self._send_cmd('GP')
-        return float(ans.split(',')[1])
+        return ans.position
 
     @property
     def state(self):
@@ -361,6 +462,51 @@ class SmaractMCSBaseAxis(SmaractBaseAxis):
     """
     Specific class for MCS controllers.
     """
+    # Quantities available on SmaractMCSController.snapshot
+    # name: (command, numpy type)
+    SNAPSHOT_FIELDS = {'position': ('GP', 'f8'),
+                       'state': ('GS', 'i4'),
+                       'closed_loop_vel': ('GCLS', 'f8'),
+                       'closed_loop_acc': ('GCLA', 'f8'),
+                       'physical_position_known': ('GPPK', 'i4'),
+                       'voltage_level': ('GVL', 'f8')}
+
+    def _snapshot_cmd(self, field):
+        """
+        Command used to read a quantity on a controller snapshot.
+
+        :param field: any of the SNAPSHOT_FIELDS.
+        :return: command string.
+        """
+        return '%s%d' % (self.SNAPSHOT_FIELDS[field][0], self._axis_nr)
+
+    def _snapshot_value(self, field, ans):
+        """
+        Converts the answer of a snapshot command to the value returned by
+        the equivalent property.
+
+        :param field: any of the SNAPSHOT_FIELDS.
+        :param ans: command answer (Reply).
+        :return: value
+        """
+        if field == 'position':
+            return ans.position
+        value = float(ans.values[-1])
+        if field == 'voltage_level':
+            value = (value * 100) / 4095
+        return value
+
+    def _send_movement(self, str_cmd, *pars):
+        """
+        Send a movement command and get its completion reported by the
+        controller.
+
+        :param str_cmd: String command following the ASCii Smaract API.
+        :param pars: optional parameters required by the command.
+        :return: PendingReport done when the movement is completed.
+        """
+        cmd = self._format_cmd(str_cmd, *pars)
+        return self._ctrl.send_movement(self._axis_nr, cmd)
 
     @property
     def channel_type(self):
@@ -596,7 +742,8 @@ class SmaractMCSBaseAxis(SmaractBaseAxis):
         if value not in valid_values:
             raise ValueError('Wrong value. Valid values: %r' % valid_values)
         idx = valid_values.index(value)
-        self.set_channel_property(ChannelProperties.EmergencyStop, idx)
+        cmd = self._format_cmd('SCP', ChannelProperties.EmergencyStop, idx)
+        self._ctrl.send_cmd(cmd, priority=True)
 
 # TODO: Investigate why it raises error 157  
     # @property
@@ -650,7 +797,9 @@ class SmaractMCSBaseAxis(SmaractBaseAxis):
 
         Documentation: MCS Manual section 4.4
         """
-        self.set_channel_property(ChannelProperties.BroadcastStop, int(value))
+        cmd = self._format_cmd('SCP', ChannelProperties.BroadcastStop,
+                               int(value))
+        self._ctrl.send_cmd(cmd, priority=True)
 
     @property
     def scale_inverted(self):
@@ -705,9 +854,50 @@ class SmaractMCSBaseAxis(SmaractBaseAxis):
     ############################################################################
     #                       Commands
     ############################################################################
+    def calibrate_sensor(self, wait=False, timeout=None):
+        """
+        Increase the accuracy of the position calculation.
+        Channel Type: Positioner.
+
+        :param wait: wait until the controller reports the end of the
+        calibration.
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :return: None
+
+        Documentation: MCS Manual section 3.3
+        """
+        if wait:
+            self._send_movement('CS').result(timeout)
+        else:
+            self._send_cmd('CS')
+
+    def find_reference_mark(self, direction, hold_time=0, auto_zero=0,
+                            wait=False, timeout=None):
+        """
+        Move to a known physical position of the positioner. See
+        SmaractBaseAxis.find_reference_mark.
+        Channel Type: Positioner
+
+        :param direction: any valid direction value.
+        :param hold_time: held after find reference mark in ms.
+        :param auto_zero: flag to reset the position to 0.
+        :param wait: wait until the controller reports that the mark is
+        found.
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :return: None
+
+        Documentation: MCS Manual section 3.3
+        """
+        if wait:
+            self._send_movement('FRM', direction, hold_time,
+                                auto_zero).result(timeout)
+        else:
+            self._send_cmd('FRM', direction, hold_time, auto_zero)
+
     def get_capture_buffer(self, buffer_idx):
         """
-        Retrieves the contents of the capture buffer.
+        Retrieves the contents of the capture buffer. For continuous
+        acquisitions see smaract.capture.CaptureStream.
         Channel Type: Positioner.
 
         :param buffer_idx: buffer index for the selected channel.
@@ -839,6 +1029,10 @@ class SmaractMCSBaseAxis(SmaractBaseAxis):
         Documentation: MCS Manual section 3.2
         """
         self._send_cmd('SRC', enable)
+        if enable:
+            self._ctrl._reporting.add(self._axis_nr)
+        else:
+            self._ctrl._reporting.discard(self._axis_nr)
 
     def set_report_on_triggered(self, enable):
         """
@@ -999,9 +1193,12 @@ class SmaractMCSAngularAxis(SmaractMCSBaseAxis):
         Documentation: MCS Manual section 3.4
         """
         ans = self._send_cmd('GA')
-        angle, revolution = [float(x) for x in ans.split(',')[-2:]]
-        position = (revolution * TURN) + angle
-        return position
+        return ans.position
+
+    def _snapshot_cmd(self, field):
+        if field == 'position':
+            return 'GA%d' % self._axis_nr
+        return SmaractMCSBaseAxis._snapshot_cmd(self, field)
 
     @property
     def position_limits(self):
@@ -1015,7 +1212,7 @@ class SmaractMCSAngularAxis(SmaractMCSBaseAxis):
         """
         ans = self._send_cmd('GAL')
         # Answer (minAngle, minRev, maxAngle, maxRev)
-        values = [float(x) for x in ans.split(',')[-4:]]
+        values = [float(x) for x in ans.values[-4:]]
         min_angle = (values[1] * TURN) + values[0]
         max_angle = (values[3] * TURN) + values[2]
         return [min_angle, max_angle]
@@ -1044,16 +1241,52 @@ class SmaractMCSAngularAxis(SmaractMCSBaseAxis):
     ############################################################################
     #                       Commands
     ############################################################################
-    def move(self, position, hold_time=0):
+    def move(self, position, hold_time=0, wait=False, timeout=None):
         """
         Move method. The units are micro-degrees and milliseconds.
         :param relative_pos: the position is the absolute total angle
+        :param hold_time: hold the movement for this amount of time in ms.
+        :param wait: wait until the controller reports the end of the
+        movement.
+        :param timeout: maximum time to wait in seconds (None: forever).
         :return:
         """
+        if wait:
+            self.move_async(position, hold_time).result(timeout)
+            return
         angle, revolutions = self._angle_rev(position)
         hold_time = int(hold_time)
         self.move_angle_absolute(angle, revolutions, hold_time)
 
+    def move_async(self, position, hold_time=0):
+        """
+        Start a movement to an absolute total angle and get its completion,
+        reported by the controller (the report on complete is enabled on
+        the channel).
+
+        :param position: target total angle.
+        :param hold_time: hold the movement for this amount of time in ms.
+        :return: PendingReport. Its result method waits for the end of the
+        movement and add_done_callback registers a function called then.
+        """
+        return self._ctrl.send_movement(self._axis_nr,
+                                        self._move_cmd(position, hold_time))
+
+    def _move_cmd(self, position, hold_time=0):
+        """
+        Command of a movement to an absolute total angle.
+
+        :param position: target total angle.
+        :param hold_time: hold the movement for this amount of time in ms.
+        :return: command string.
+        """
+        angle, revolutions = self._angle_rev(position)
+        hold_time = int(hold_time)
+        is_angle_in_range(angle)
+        is_revolution_in_range(revolutions)
+        is_hold_time_in_range(hold_time)
+        return self._format_cmd('MAA', angle, revolutions, hold_time)
+
     def _angle_rev(self, position):
         sign = 0
         if position < 0:
@@ -1137,14 +1370,46 @@ class SmaractMCSLinearAxis(SmaractMCSBaseAxis):
     ############################################################################
     #                       Commands
     ############################################################################
-    def move(self, position, hold_time=0):
+    def move(self, position, hold_time=0, wait=False, timeout=None):
         """
         Move method
         :param position: the position is the absolute total angle
+        :param hold_time: hold the movement for this amount of time in ms.
+        :param wait: wait until the controller reports the end of the
+        movement.
+        :param timeout: maximum time to wait in seconds (None: forever).
         :return:
         """
         hold_time = int(hold_time)
-        self.move_position_absolute(position, hold_time)
+        if wait:
+            self.move_async(position, hold_time).result(timeout)
+        else:
+            self.move_position_absolute(position, hold_time)
+
+    def move_async(self, position, hold_time=0):
+        """
+        Start a movement to an absolute position and get its completion,
+        reported by the controller (the report on complete is enabled on
+        the channel).
+
+        :param position: target position.
+        :param hold_time: hold the movement for this amount of time in ms.
+        :return: PendingReport. Its result method waits for the end of the
+        movement and add_done_callback registers a function called then.
+        """
+        return self._ctrl.send_movement(self._axis_nr,
+                                        self._move_cmd(position, hold_time))
+
+    def _move_cmd(self, position, hold_time=0):
+        """
+        Command of a movement to an absolute position.
+
+        :param position: target position.
+        :param hold_time: hold the movement for this amount of time in ms.
+        :return: command string.
+        """
+        is_hold_time_in_range(hold_time)
+        return self._format_cmd('MPA', position, int(hold_time))
 
     def move_position_absolute(self, position, hold_time=0):
         """
@@ -0,0 +1,178 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Streaming of the capture buffer of an axis: the positions captured by the
+controller on trigger events are drained continuously into a preallocated
+NumPy ring buffer, or a memory-mapped file for long acquisitions.
+"""
+
+import time
+import threading
+
+from .constants import ChannelProperties
+
+
+class CaptureStream(object):
+    """
+    Drain the capture buffer of an axis into a ring buffer. Each poll reads
+    the capture counter (Counter channel property) and the capture buffer
+    in one exchange; the samples are parsed straight into the ring, without
+    a Python object per sample. The counter detects the samples lost by the
+    controller when the buffer is not drained fast enough.
+
+    :param axis: SmaractMCSBaseAxis instance.
+    :param size: capacity of the ring buffer, in samples. The oldest samples
+    are overwritten.
+    :param path: file for a memory-mapped ring buffer (None: in memory).
+    :param buffer_idx: capture buffer index.
+    :param trigger_source: if not None, it is set as the trigger source of
+    the capture buffer and the counter (CaptureBuffer and
+    CounterTriggerSource channel properties) before streaming.
+    :param period: time between polls of the streaming thread (s).
+    """
+    def __init__(self, axis, size=1000000, path=None, buffer_idx=0,
+                 trigger_source=None, period=0.01):
+        import numpy
+
+        self.axis = axis
+        self.size = size
+        self.path = path
+        self.buffer_idx = buffer_idx
+        self.trigger_source = trigger_source
+        self.period = period
+        if path is None:
+            self._ring = numpy.zeros(size, dtype='f8')
+        else:
+            self._ring = numpy.memmap(path, 'f8', 'w+', shape=(size,))
+        # Samples received and samples lost by the controller
+        self.count = 0
+        self.lost = 0
+        self._cmds = [axis._format_cmd('GCP', ChannelProperties.Counter),
+                      axis._format_cmd('GB', buffer_idx)]
+        self._counter0 = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self.error = None
+
+    def configure(self):
+        """
+        Set the trigger source (if given) and get the counter reference. It
+        is called by start.
+
+        :return: None
+        """
+        if self.trigger_source is not None:
+            for key in (ChannelProperties.CaptureBuffer,
+                        ChannelProperties.CounterTriggerSource):
+                self.axis.set_channel_property(key, self.trigger_source)
+        # The captures before the stream starts are discarded. The counter
+        # is read after the buffer is drained, so that no capture meanwhile
+        # is taken as lost.
+        ans = self.axis._ctrl.send_cmds(self._cmds[::-1])
+        self._counter0 = int(ans[1].rsplit(',', 1)[1])
+
+    def poll(self):
+        """
+        Drain the capture buffer once.
+
+        :return: number of samples received.
+        """
+        import numpy
+
+        counter_ans, buffer_ans = self.axis._ctrl.send_cmds(self._cmds)
+        counter = int(counter_ans.rsplit(',', 1)[1]) - self._counter0
+        fields = buffer_ans.split(',', 2)
+        if len(fields) < 3 or not fields[2]:
+            samples = numpy.empty(0)
+        else:
+            samples = numpy.fromstring(fields[2], dtype='f8', sep=',')
+        with self._lock:
+            self._append(samples)
+            # The counter is read before the buffer is drained, so without
+            # losses the samples received are at least the counted ones
+            self.lost = max(self.lost, counter - self.count)
+        return len(samples)
+
+    def data(self, n=None):
+        """
+        Get a copy of the last samples received, oldest first.
+
+        :param n: number of samples (default: all the ones kept).
+        :return: NumPy array.
+        """
+        import numpy
+
+        with self._lock:
+            kept = min(self.count, self.size)
+            n = kept if n is None else min(n, kept)
+            end = self.count % self.size
+            start = (end - n) % self.size
+            if n == 0:
+                return numpy.empty(0)
+            if start < end:
+                return self._ring[start:end].copy()
+            return numpy.concatenate((self._ring[start:], self._ring[:end]))
+
+    def start(self):
+        """
+        Configure the capture and start draining it from a thread.
+
+        :return: self
+        """
+        self.configure()
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='CaptureStream')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop the streaming thread, after draining the buffer a last time.
+
+        :return: None
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.path is not None:
+            self._ring.flush()
+
+    def _append(self, samples):
+        n = len(samples)
+        if n >= self.size:
+            samples = samples[-self.size:]
+            self.count += n - self.size
+            n = self.size
+        start = self.count % self.size
+        first = min(n, self.size - start)
+        self._ring[start:start + first] = samples[:first]
+        self._ring[:n - first] = samples[first:]
+        self.count += n
+
+    def _run(self):
+        while True:
+            running = self._running
+            try:
+                self.poll()
+            except RuntimeError as e:
+                # The stream stops on errors, kept for the caller
+                self.error = e
+                return
+            if not running:
+                return
+            time.sleep(self.period)
@@ -12,8 +12,22 @@
 # ------------------------------------------------------------------------------
 
 
+import os
+import time
+import select
+import threading
+from collections import deque
 from serial import Serial
-from socket import socket, AF_INET, SOCK_STREAM
+from socket import socket, socketpair, timeout as socket_timeout, AF_INET, \
+    SOCK_STREAM
+try:
+    from socket import AF_UNIX
+except ImportError:
+    AF_UNIX = None
+
+from .protocol import FRAME_START, FRAME_END, ERROR_CODE, FrameDecoder, \
+    to_bytes, split_cmd, is_priority, answer_key, unframe, is_report, \
+    parse_reply
 
 
 def comm_error_handler(f):
@@ -26,23 +40,624 @@ def comm_error_handler(f):
         try:
             ans = f(*args, **kwargs)
             return ans
-        except Exception, e:
+        except Exception as e:
             msg = ('Problem with the communication. Verify the hardware. '
                    'Error: %s' % e)
             raise RuntimeError(msg)
     return new_func
 
 
+# Protects the callbacks of the PendingAnswer instances
+_callbacks_lock = threading.Lock()
+
+
+class _Waker(object):
+    """
+    Self-pipe which interrupts a select waiting for the answers of a
+    transport, see the wakeup method of the transports.
+    """
+    def __init__(self):
+        self._r, self._w = socketpair()
+        self._r.setblocking(False)
+        self._w.setblocking(False)
+
+    def fileno(self):
+        return self._r.fileno()
+
+    def wakeup(self):
+        try:
+            self._w.send(b'\0')
+        except (OSError, ValueError):
+            # Already awake (full) or closed
+            pass
+
+    def clear(self):
+        try:
+            while self._r.recv(64):
+                pass
+        except OSError:
+            pass
+
+    def close(self):
+        self._r.close()
+        self._w.close()
+
+
+class PendingAnswer(object):
+    """
+    Answer of a command which is still in flight. The answer is filled by the
+    thread reading from the communication layer and collected by the thread
+    which sent the command.
+
+    :param cmd: command without the frame characters.
+    :param key: (code, channel) of the answer in asynchronous mode.
+    :param checker: function used to check the answer.
+    :param frame: command already framed, e.g. rendered by a
+    CommandTemplate (by default it is framed here).
+    :param template: CommandTemplate which rendered the command (or any
+    object with its name and channel), they are used instead of parsing
+    the command.
+    """
+    def __init__(self, cmd, key=None, checker=None, frame=None,
+                 template=None):
+        self.cmd = cmd
+        self.frame = frame or FRAME_START + cmd + FRAME_END
+        self.key = key
+        if template is None:
+            self.name, self.channel = split_cmd(cmd)
+        else:
+            self.name, self.channel = template.name, template.channel
+        self.checker = checker
+        self._event = threading.Event()
+        self._ans = None
+        self._exc = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def set_answer(self, ans):
+        self._ans = ans
+        self._finish()
+
+    def set_exception(self, exc):
+        self._exc = exc
+        self._finish()
+
+    def add_done_callback(self, callback):
+        """
+        Register a function called with this object once the answer arrives.
+        If the answer is already there, the function is called immediately.
+
+        :param callback: function(pending_answer)
+        :return: None
+        """
+        with _callbacks_lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def follow(self, leader):
+        """
+        Take the answer (or the exception) of another PendingAnswer of the
+        same command.
+
+        :param leader: PendingAnswer already done.
+        :return: None
+        """
+        if leader._exc is not None:
+            self.set_exception(leader._exc)
+        else:
+            self.set_answer(leader._ans)
+
+    def result(self, timeout=None):
+        """
+        Wait for the answer of the command.
+
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :return: answer without the frame characters.
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError('Timeout waiting the answer of command %s' %
+                               self.cmd)
+        if self._exc is not None:
+            raise self._exc
+        if self.checker is not None and self._ans is not None:
+            self.checker(self._ans)
+        return self._ans
+
+    def _finish(self):
+        with _callbacks_lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class PendingReport(PendingAnswer):
+    """
+    Report of the controller still to come, e.g. the completion of a
+    movement. It is filled by the thread reading from the communication
+    layer, which keeps reading while there are reports awaited even if no
+    command is in flight.
+
+    :param cmd: command which causes the report.
+    :param comm: SmaractCommunication instance.
+    """
+    def __init__(self, cmd, comm):
+        PendingAnswer.__init__(self, cmd)
+        comm._io.watch(self)
+
+
+class AsyncAnswerReader(threading.Thread):
+    """
+    Thread which reads continuously the answers of a controller working in
+    asynchronous communication mode. The controller processes the commands
+    in order, so each answer is delivered to the oldest pending command
+    waiting for the same answer code and channel, and error answers to the
+    oldest pending command of the channel. The commands which are not
+    acknowledged are also tracked in send order as pending error slots, so
+    the error of such a command is not taken by a later query of the same
+    channel: they are done once an answer of a later command arrives, and
+    their errors are stored and passed to the listeners as the answers not
+    expected by any command, together with the reports.
+
+    :param comm: transport.
+    :param listeners: list of functions called with the answers not
+    expected by any command.
+    """
+    # Maximum number of not acknowledged commands tracked
+    MAX_SILENT = 1024
+
+    def __init__(self, comm, listeners=None):
+        threading.Thread.__init__(self, name='SmaractAsyncAnswerReader')
+        self.daemon = True
+        self._comm = comm
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._nsilent = 0
+        self._last = None
+        self.listeners = listeners if listeners is not None else []
+        self.errors = deque(maxlen=64)
+
+    def submit(self, pendings, last=False, write=True):
+        """
+        Register the answers expected by several commands and send them in
+        one write.
+
+        :param pendings: list of PendingAnswer, the key of the commands which
+        are not answered is None.
+        :param last: the thread ends after the answer of the last command.
+        :param write: False if the commands are already written.
+        :return: None
+        """
+        with self._lock:
+            if last:
+                self._last = pendings[-1]
+            self._register(pendings)
+            if write:
+                self._comm.write_cmd(''.join([p.frame for p in pendings]))
+
+    def run(self):
+        while True:
+            try:
+                line = self._comm.read_answer()
+            except Exception as e:
+                self._fail_all(e)
+                return
+            if not line:
+                continue
+            if self._dispatch(parse_reply(unframe(line))):
+                return
+
+    def _register(self, pendings):
+        for p in pendings:
+            if p.key is None:
+                self._nsilent += 1
+            self._pending.append(p)
+        while self._nsilent > self.MAX_SILENT:
+            for p in self._pending:
+                if p.key is None:
+                    self._pending.remove(p)
+                    self._nsilent -= 1
+                    break
+
+    def _dispatch(self, ans):
+        code, channel = ans.code, ans.channel
+        error = code == ERROR_CODE
+        pending = None
+        acknowledged = []
+        with self._lock:
+            for p in self._pending:
+                if p.key == (code, channel) or \
+                        (error and p.channel == channel):
+                    pending = p
+                    break
+            if pending is not None:
+                # The previous commands not acknowledged were successful
+                kept = []
+                while True:
+                    p = self._pending.popleft()
+                    if p.key is None:
+                        self._nsilent -= 1
+                        if p is not pending:
+                            acknowledged.append(p)
+                    elif p is not pending:
+                        kept.append(p)
+                    if p is pending:
+                        break
+                self._pending.extendleft(reversed(kept))
+        for p in acknowledged:
+            p.set_answer(None)
+        if pending is None or pending.key is None:
+            if ans.is_error:
+                cmd = pending.cmd if pending is not None else None
+                self.errors.append((cmd, ans))
+            if pending is not None:
+                pending.set_answer(ans)
+            for listener in list(self.listeners):
+                listener(ans)
+            return False
+        pending.set_answer(ans)
+        return pending is self._last
+
+    def discard(self, pending):
+        """
+        Stop waiting the answer of a command, e.g. after a timeout, so a
+        later answer of the same code and channel is not taken by it.
+
+        :param pending: PendingAnswer registered.
+        :return: True if it was still waiting its answer.
+        """
+        with self._lock:
+            try:
+                self._pending.remove(pending)
+            except ValueError:
+                return False
+            if pending.key is None:
+                self._nsilent -= 1
+            return True
+
+    def _fail_all(self, exc):
+        with self._lock:
+            pending, self._pending = self._pending, deque()
+            self._nsilent = 0
+        for p in pending:
+            p.set_exception(RuntimeError(str(exc)))
+
+
+class IOThread(threading.Thread):
+    """
+    Thread which performs the I/O of a controller, so the commands can be
+    sent from any thread. The commands are queued with their PendingAnswer
+    and the commands queued together are written in one batch. In
+    synchronous communication mode this thread reads their answers in
+    order, passing the reports to the listeners, and while idle it keeps
+    reading the reports awaited by PendingReport instances. The transports
+    without read timeout (READ_TIMEOUT False, e.g. Tango) are not read
+    while idle, they are polled with POLL_CMD instead: the reports come
+    before its answer. In asynchronous mode the answers are read by an
+    AsyncAnswerReader.
+
+    The priority commands (e.g. stop) skip the queue: they are written at
+    once by the thread sending them, even while a batch is in flight, and
+    repeated after the queued commands and the rest of the batch being
+    written. To bound their latency, at most
+    MAX_IN_FLIGHT commands of a batch are written ahead of the answers read
+    in synchronous mode.
+
+    The queries (commands starting with G) identical to one already queued
+    or in flight share its answer instead of being sent again, unless any
+    other command was submitted meanwhile.
+
+    The transports with a wakeup method interrupt a read with timeout when
+    it is called, so the idle reads of the reports do not delay the
+    requests. The others are read while idle with IDLE_READ_TIMEOUT.
+
+    The callbacks of the PendingAnswer are called from the reading thread,
+    so they must not wait for the answer of other commands.
+
+    :param comm: transport.
+    :param listeners: list of functions called with the reports and, in
+    asynchronous mode, the answers not expected by any command.
+    """
+    # Read timeout (s) while idle waiting for reports, it is the maximum
+    # delay added to a new request.
+    IDLE_READ_TIMEOUT = 0.005
+
+    # Read timeout (s) while idle waiting for reports on the transports with
+    # a wakeup method, which interrupts the read when a request comes.
+    IDLE_WAKEUP_TIMEOUT = 0.5
+
+    # Period (s) and command of the polls while idle waiting for reports on
+    # the transports without read timeout
+    IDLE_POLL_PERIOD = 0.05
+    POLL_CMD = 'GCM'
+
+    # Commands written and not answered yet in synchronous mode
+    MAX_IN_FLIGHT = 16
+
+    def __init__(self, comm, listeners):
+        threading.Thread.__init__(self, name='SmaractIO')
+        self.daemon = True
+        self._comm = comm
+        self._listeners = listeners
+        self._cond = threading.Condition()
+        self._queue = deque()
+        # A batch taken from the queue is being written
+        self._sending = False
+        self._watched = set()
+        self._closed = False
+        # Serializes the writes; the commands written in synchronous mode
+        # wait their answer in _inflight, in the same order.
+        self._wlock = threading.Lock()
+        self._inflight = deque()
+        # Queries queued or in flight: command -> (PendingAnswer, epoch). The
+        # epoch changes with any other command, which may change the answer.
+        self._queries = {}
+        self._epoch = 0
+        self.coalesced = 0
+        self.reader = None
+        self._read_timeout = getattr(comm, 'READ_TIMEOUT', True)
+        self._wakeup = getattr(comm, 'wakeup', None)
+        # In an idle read, which is woken up by the requests
+        self._idle = False
+
+    def submit(self, pendings, priority=False):
+        """
+        Queue commands to be sent.
+
+        :param pendings: list of PendingAnswer.
+        :param priority: write them at once, before the queued commands.
+        :return: None
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('The communication is closed')
+            if not priority:
+                pendings = self._coalesce(pendings)
+                self._queue.extend(pendings)
+                self._notify()
+                return
+            self._epoch += 1
+            if self._queue or self._sending:
+                # A copy follows the queued commands and the batch being
+                # written, so none of them (e.g. a movement) is executed
+                # after the stop.
+                self._queue.extend([PendingAnswer(p.cmd, frame=p.frame,
+                                                  template=p)
+                                    for p in pendings])
+        with self._wlock:
+            if self.reader is not None:
+                self._submit_async(pendings)
+            else:
+                self._write_sync(pendings)
+        with self._cond:
+            # Wake up the thread to read the answers
+            self._notify()
+
+    def watch(self, report):
+        """
+        Keep reading until the report is done.
+
+        :param report: PendingReport
+        :return: None
+        """
+        with self._cond:
+            self._watched.add(report)
+            self._cond.notify()
+        report.add_done_callback(self._unwatch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not (self._queue or self._closed or
+                           (self.reader is None and
+                            (self._watched or self._inflight))):
+                    self._cond.wait()
+                pendings = list(self._queue)
+                self._queue.clear()
+                self._sending = bool(pendings)
+                closed = self._closed
+            if closed:
+                self._fail(pendings + list(self._inflight) +
+                           list(self._watched), 'The communication is closed')
+                return
+            try:
+                if pendings:
+                    self._send(pendings)
+                    with self._cond:
+                        self._sending = False
+                elif self._inflight:
+                    self._read()
+                elif self._read_timeout:
+                    self._idle_read()
+                else:
+                    self._poll()
+            except Exception as e:
+                with self._cond:
+                    self._sending = False
+                with self._wlock:
+                    pendings += list(self._inflight)
+                    self._inflight.clear()
+                self._fail(pendings + list(self._watched), str(e))
+
+    def _notify(self):
+        # Called with _cond acquired
+        self._cond.notify()
+        if self._idle:
+            self._idle = False
+            self._wakeup()
+
+    def _idle_read(self):
+        """
+        Read the reports awaited while there is no command to send. The
+        read is woken up by the new requests if the transport supports it,
+        otherwise it is short.
+        """
+        if self._wakeup is None:
+            self._read(self.IDLE_READ_TIMEOUT)
+            return
+        with self._cond:
+            if self._queue or self._closed:
+                return
+            self._idle = True
+        try:
+            self._read(self.IDLE_WAKEUP_TIMEOUT)
+        finally:
+            with self._cond:
+                self._idle = False
+
+    def _coalesce(self, pendings):
+        queued = []
+        for p in pendings:
+            if not p.cmd.startswith('G'):
+                self._epoch += 1
+                queued.append(p)
+                continue
+            leader, epoch = self._queries.get(p.cmd, (None, None))
+            if epoch == self._epoch:
+                self.coalesced += 1
+                leader.add_done_callback(p.follow)
+                continue
+            self._queries[p.cmd] = (p, self._epoch)
+            p.add_done_callback(self._query_done)
+            queued.append(p)
+        return queued
+
+    def _query_done(self, pending):
+        with self._cond:
+            if self._queries.get(pending.cmd, (None,))[0] is pending:
+                del self._queries[pending.cmd]
+
+    def _unwatch(self, report):
+        with self._cond:
+            self._watched.discard(report)
+
+    def _send(self, pendings):
+        # The mode changes after a SCM command, so the batch is split there
+        # (unless it sets the current mode)
+        start = 0
+        for i, p in enumerate(pendings):
+            if p.cmd.startswith('SCM') and \
+                    (p.cmd[3:] == '1') == (self.reader is None):
+                self._send_segment(pendings[start:i + 1])
+                with self._wlock:
+                    self._change_mode(p)
+                start = i + 1
+        self._send_segment(pendings[start:])
+
+    def _send_segment(self, pendings):
+        if not pendings:
+            return
+        if self.reader is not None:
+            with self._wlock:
+                self._submit_async(pendings)
+            return
+        written = 0
+        while not pendings[-1].done():
+            room = self.MAX_IN_FLIGHT - len(self._inflight)
+            if written < len(pendings) and room > 0:
+                chunk = pendings[written:written + room]
+                written += len(chunk)
+                with self._wlock:
+                    self._write_sync(chunk)
+            else:
+                self._read()
+
+    def _poll(self):
+        """
+        Read the reports awaited with a query, without blocking the commands
+        queued meanwhile.
+        """
+        with self._cond:
+            if not (self._queue or self._closed):
+                self._cond.wait(self.IDLE_POLL_PERIOD)
+            if self._queue or self._closed or not self._watched:
+                return
+        self._send_segment([PendingAnswer(self.POLL_CMD)])
+
+    def _submit_async(self, pendings, write=True):
+        if not self.reader.is_alive():
+            raise RuntimeError('The asynchronous reader is stopped')
+        for p in pendings:
+            p.key = answer_key(p.cmd, p.name, p.channel)
+        self.reader.submit(pendings, write=write)
+
+    def _write_sync(self, pendings):
+        self._comm.write_cmd(''.join([p.frame for p in pendings]))
+        self._inflight.extend(pendings)
+
+    def _read(self, timeout=None):
+        """
+        Read one message in synchronous mode: a report or the answer of the
+        oldest command in flight.
+        """
+        ans = self._comm.read_answer(timeout)
+        if is_report(ans) or (ans and not self._inflight):
+            self._report(ans)
+            return
+        if not ans:
+            if timeout is None:
+                with self._wlock:
+                    p = self._inflight.popleft()
+                p.set_exception(RuntimeError('Timeout waiting the answer of '
+                                             'command %s' % p.cmd))
+            return
+        with self._wlock:
+            p = self._inflight.popleft()
+        p.set_answer(parse_reply(unframe(ans)))
+
+    def _change_mode(self, pending):
+        mode = pending.cmd[3:]
+        if self.reader is None and mode == '1':
+            if pending.result(0).is_error:
+                return
+            self.reader = AsyncAnswerReader(self._comm, self._listeners)
+            self.reader.start()
+            # Priority commands written after the mode change
+            inflight = list(self._inflight)
+            self._inflight.clear()
+            if inflight:
+                self._submit_async(inflight, write=False)
+        elif self.reader is not None and mode == '0':
+            # The controller answers already in synchronous mode. The reader
+            # ends after the answer of a query, so no answer is lost.
+            reader, self.reader = self.reader, None
+            last = PendingAnswer('GCM', answer_key('GCM'))
+            reader.submit([last], last=True)
+            last.result(3.0)
+            reader.join(3.0)
+
+    def _report(self, ans):
+        ans = parse_reply(unframe(ans))
+        for listener in list(self._listeners):
+            listener(ans)
+
+    def _fail(self, pendings, msg):
+        for p in pendings:
+            if not p.done():
+                p.set_exception(RuntimeError(msg))
+
+
 class CommType(object):
     Serial = 1
     SerialTango = 2
     Socket = 3
+    Simulator = 4
 
 
 class SmaractCommunication(object):
     """
     Abstract class which provides a certain communication layer to the smaract
-    motion controller.
+    motion controller. It is thread safe: the I/O is performed by a thread
+    of the controller (see IOThread).
     """
     def __init__(self, comm_type, *args):
         if comm_type == CommType.Serial:
@@ -54,13 +669,158 @@ class SmaractCommunication(object):
         elif comm_type == CommType.Socket:
             self._comm = SocketCom(*args)
             self._comm_type = CommType.Socket
+        elif comm_type == CommType.Simulator:
+            from .simulator import SimulatorCom
+            self._comm = SimulatorCom(*args)
+            self._comm_type = CommType.Simulator
         else:
             raise ValueError()
+        self._listeners = []
+        self._io = IOThread(self._comm, self._listeners)
+        self._io.start()
 
-    def send_cmd(self, cmd):
-        cmd = ':%s\n' % cmd
-        ans = self._comm.send_cmd(cmd)
-        return ans[1:-1]
+    def send_cmd(self, cmd, timeout=3.0, priority=None, frame=None,
+                 template=None):
+        """
+        Send a command and wait for its answer.
+
+        :param cmd: command without the frame characters.
+        :param timeout: maximum time to wait the answer in seconds.
+        :param priority: skip the queue of commands to send. By default,
+        only for the PRIORITY_COMMANDS.
+        :param frame: command already framed (see CommandTemplate).
+        :param template: CommandTemplate which rendered the command (the
+        command is not parsed then).
+        :return: answer (None if the command is not answered in
+        asynchronous communication mode).
+        """
+        pending = PendingAnswer(cmd, frame=frame, template=template)
+        if priority is None:
+            priority = is_priority(cmd, pending.name)
+        self._io.submit([pending], priority)
+        if self.is_async() and \
+                answer_key(cmd, pending.name, pending.channel) is None:
+            return None
+        return self._wait(pending, timeout)
+
+    def send_cmds(self, cmds, timeout=3.0, priority=None):
+        """
+        Send several commands in one write and wait for their answers. The
+        answers are returned in the same order as the commands.
+
+        :param cmds: list of commands without the frame characters.
+        :param timeout: maximum time to wait each answer in seconds.
+        :param priority: skip the queue of commands to send. By default,
+        only for the PRIORITY_COMMANDS.
+        :return: list of answers (None for the commands which are not
+        answered in asynchronous communication mode).
+        """
+        pendings = self.send_cmds_async(cmds, priority=priority)
+        silent = self.is_async()
+        return [None if silent and
+                answer_key(p.cmd, p.name, p.channel) is None
+                else self._wait(p, timeout) for p in pendings]
+
+    def _wait(self, pending, timeout):
+        """
+        Wait for the answer of a command. On timeout in asynchronous mode
+        the command stops waiting, otherwise it would take the answer of the
+        next command of the same code and channel.
+
+        :param pending: PendingAnswer submitted.
+        :param timeout: maximum time to wait in seconds.
+        :return: answer.
+        """
+        try:
+            return pending.result(timeout)
+        except RuntimeError as e:
+            reader = self._io.reader
+            if not pending.done() and reader is not None and \
+                    reader.discard(pending):
+                # Done, so the queries sharing its answer are released
+                pending.set_exception(e)
+            raise
+
+    def send_cmd_async(self, cmd, checker=None):
+        """
+        Send a command without waiting for its answer. Only in asynchronous
+        communication mode there can be several commands in flight on the
+        wire, in synchronous mode the commands are queued.
+
+        :param cmd: command without the frame characters.
+        :param checker: function used to check the answer.
+        :return: PendingAnswer or None if the command is not answered.
+        """
+        pending = self.send_cmds_async([cmd], checker)[0]
+        if self.is_async() and \
+                answer_key(cmd, pending.name, pending.channel) is None:
+            return None
+        return pending
+
+    def send_cmds_async(self, cmds, checker=None, priority=None):
+        """
+        Send several commands in one write without waiting for their
+        answers.
+
+        :param cmds: list of commands without the frame characters.
+        :param checker: function used to check the answers.
+        :param priority: skip the queue of commands to send. By default,
+        only for the PRIORITY_COMMANDS.
+        :return: list of PendingAnswer. The commands which are not answered
+        in asynchronous mode are done with None once a later command is
+        answered, or with their error answer.
+        """
+        pendings = [PendingAnswer(cmd, checker=checker) for cmd in cmds]
+        if priority is None:
+            priority = any([is_priority(p.cmd, p.name) for p in pendings])
+        self._io.submit(pendings, priority)
+        return pendings
+
+    def is_async(self):
+        return self._io.reader is not None
+
+    def add_listener(self, callback):
+        """
+        Register a function called with the messages sent by the controller
+        without request (reports) and, in asynchronous communication mode,
+        with the answers not expected by any command (e.g. errors of
+        commands which are not acknowledged). It is called from the thread
+        reading from the controller.
+
+        :param callback: function(answer)
+        :return: None
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """
+        Unregister a function registered with add_listener.
+
+        :param callback: function(answer)
+        :return: None
+        """
+        self._listeners.remove(callback)
+
+    def pop_async_errors(self):
+        """
+        Get and clean the error answers of commands which are not
+        acknowledged in asynchronous communication mode.
+
+        :return: list of (command, error answer), the command is None if the
+        error does not correspond to any command sent.
+        """
+        reader = self._io.reader
+        if reader is None:
+            return []
+        errors = []
+        while reader.errors:
+            errors.append(reader.errors.popleft())
+        return errors
+
+    def close(self):
+        self._io.close()
+        if hasattr(self._comm, 'close'):
+            self._comm.close()
 
     def get_comm_type(self):
         return self._comm_type
@@ -69,47 +829,320 @@ class SmaractCommunication(object):
 class SerialCom(Serial):
     """
     Class which implements the Serial communication layer with ASCII interface
-    for Smaract motion controllers.
+    for Smaract motion controllers. The answers are read in chunks into a
+    persistent receive buffer split on new line characters (FrameDecoder),
+    as in SocketCom:
+    each read takes all the bytes already received by the driver (e.g. the
+    answers of several pipelined commands) and it only blocks while there
+    is none, instead of reading byte by byte up to the new line. The read
+    timeout of read_answer is applied with select, without reconfiguring
+    the port, and the wakeup method interrupts it.
+
+    Where select is not available on serial ports (Windows), the reads ask
+    for a whole chunk and end when the line is idle for INTER_BYTE_CHARS
+    characters at the current baudrate (inter_byte_timeout).
     """
+    RX_CHUNK_SIZE = 4096
+    # Idle characters which end a chunk read without select
+    INTER_BYTE_CHARS = 2
+    # Interrupts read_answer, only with select (see IOThread)
+    wakeup = None
+
+    def __init__(self, *args, **kwargs):
+        self._rx = FrameDecoder(self.RX_CHUNK_SIZE)
+        self._select = os.name == 'posix'
+        self._waker = None
+        if self._select:
+            self._waker = _Waker()
+            self.wakeup = self._waker.wakeup
+        Serial.__init__(self, *args, **kwargs)
+        self.configure_reads()
+
+    def configure_reads(self):
+        """
+        Adapt the reads to the current baudrate. It must be called after
+        changing the baudrate.
+
+        :return: None
+        """
+        if not self._select:
+            # 10 bits per character: start, 8 data bits and stop
+            self.inter_byte_timeout = \
+                self.INTER_BYTE_CHARS * 10.0 / self.baudrate
+
+    def set_baudrate(self, baudrate):
+        """
+        Change the baudrate of the port, discarding the input received at
+        the previous one.
+
+        :param baudrate: new baudrate.
+        :return: None
+        """
+        self.baudrate = baudrate
+        self.configure_reads()
+        self.reset_input_buffer()
+        self._rx.clear()
+
     @comm_error_handler
     def send_cmd(self, cmd):
-        self.flush()
-        self.write(cmd)
-        return self.readline()
+        self.write(to_bytes(cmd))
+        ans = self._read_line(self.timeout)
+        if not ans:
+            raise RuntimeError('Timeout waiting the answer of command %s' %
+                               cmd.strip())
+        return ans
+
+    @comm_error_handler
+    def write_cmd(self, cmd):
+        self.write(to_bytes(cmd))
+
+    @comm_error_handler
+    def read_answer(self, timeout=None):
+        if timeout is None:
+            return self._read_line(self.timeout)
+        return self._read_line(timeout, self._waker)
+
+    def close(self):
+        Serial.close(self)
+        if self._waker is not None:
+            self._waker.close()
+            self._waker = None
+
+    def _read_line(self, timeout, waker=None):
+        """
+        Read one answer from the receive buffer, reading from the port only
+        when the buffer does not hold a complete answer.
+
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :param waker: _Waker which interrupts the read.
+        :return: answer including the new line character or empty string on
+        timeout or wakeup, the partial answer is kept for the next read.
+        """
+        end = None if timeout is None else time.time() + timeout
+        fds = [self.fileno()] if waker is None else [self.fileno(), waker]
+        while True:
+            line = self._rx.next_line()
+            if line is not None:
+                return line
+            n = self.in_waiting
+            if not n:
+                if self._select:
+                    delay = None if end is None else \
+                        max(0, end - time.time())
+                    ready = select.select(fds, [], [], delay)[0]
+                    if waker in ready:
+                        waker.clear()
+                        return ''
+                    if not ready:
+                        return ''
+                    n = self.in_waiting or 1
+                else:
+                    n = self.RX_CHUNK_SIZE
+            data = self.read(n)
+            if not data:
+                return ''
+            self._rx.feed(data)
 
 
 class SerialTangoCom(object):
     """
     Class which implements the Serial (through TANGO Device Serial)
     communication layer with ASCii interface for Smaract motion controllers.
+    The read timeout is the one of the Serial device, so it is not read
+    while idle (see IOThread).
+
+    Each call to the Serial device is a round trip to its device server. In
+    bulk mode the input is flushed only before the first command and after
+    an error, and when several answers are expected they are read in bulk
+    with DevSerReadRaw and split in lines locally: a batch of commands
+    costs one DevSerWriteString, one DevSerReadLine and one DevSerReadRaw
+    if the answers arrive together, instead of one call per answer. The
+    priority commands are written by other threads while the I/O thread
+    reads (see IOThread), so the bulk state is guarded by a lock and the
+    input is not flushed while answers are expected.
+
+    :param device_name: name of the Serial device or an already created
+    DeviceProxy (e.g. smaract.simulator.SimulatorDeviceProxy).
+    :param bulk: enable the bulk mode.
     """
-    def __init__(self, device_name):
+    # The reads ignore the timeout given
+    READ_TIMEOUT = False
+
+    def __init__(self, device_name, bulk=False):
+        self.bulk = bulk
+        # Input read and not returned yet, answers expected (bulk mode)
+        self._rx = FrameDecoder()
+        self._expected = 0
+        self._flushed = False
+        self._lock = threading.Lock()
+        if hasattr(device_name, 'DevSerWriteString'):
+            self.device = device_name
+            return
         import PyTango
         self.device = PyTango.DeviceProxy(device_name)
 
     @comm_error_handler
     def send_cmd(self, cmd):
+        if self.bulk:
+            self._write(cmd)
+            return self._read_line()
         # flush both input and output
         self.device.DevSerFlush(2)
         self.device.DevSerWriteString(cmd)
         return self.device.DevSerReadLine()
 
+    @comm_error_handler
+    def write_cmd(self, cmd):
+        if self.bulk:
+            self._write(cmd)
+        else:
+            self.device.DevSerWriteString(cmd)
+
+    @comm_error_handler
+    def read_answer(self, timeout=None):
+        # The read timeout is the one of the Serial device
+        if self.bulk:
+            return self._read_line()
+        return self.device.DevSerReadLine()
+
+    def _write(self, cmd):
+        with self._lock:
+            try:
+                if not self._flushed and not self._expected:
+                    self.device.DevSerFlush(2)
+                    self._rx.clear()
+                    self._flushed = True
+                self.device.DevSerWriteString(cmd)
+            except Exception:
+                self._failed()
+                raise
+            self._expected += cmd.count('\n')
+
+    def _read_line(self):
+        # The device is read without the lock, so the priority commands
+        # are written meanwhile
+        try:
+            with self._lock:
+                line = self._rx.next_line()
+            if line is None:
+                data = to_bytes(self.device.DevSerReadLine())
+                with self._lock:
+                    self._rx.feed(data)
+                    line = self._rx.next_line()
+                    more = self._expected > 1
+                if line is None:
+                    # Timeout, the partial answer is kept
+                    return ''
+                if more:
+                    # The following answers may be already there
+                    data = to_bytes(self.device.DevSerReadRaw())
+                    with self._lock:
+                        self._rx.feed(data)
+        except Exception:
+            with self._lock:
+                self._failed()
+            raise
+        with self._lock:
+            if self._expected and not is_report(line):
+                self._expected -= 1
+        return line
+
+    def _failed(self):
+        # Called with the lock acquired. The commands in flight fail, the
+        # input is flushed before the next command.
+        self._flushed = False
+        self._expected = 0
+
 
 class SocketCom(socket):
     """
     Class which implements the Socket communication layer with ASCii interface
-    for Smaract motion controllers.
+    for Smaract motion controllers. The answers are received into a persistent
+    buffer split on new line characters (FrameDecoder), so an answer split in
+    several TCP segments or several answers in one segment are handled. The
+    bytes after the last new line are kept for the next answer.
+
+    The timeout of read_answer is applied with select, without changing the
+    timeout of the socket while other threads write to it, and the wakeup
+    method interrupts it.
+
+    A host starting with / is the path of a Unix socket (e.g. the one of a
+    SmaractProxy), the port is ignored then.
     """
+    RX_BUFFER_SIZE = 4096
+
     def __init__(self, host='localhost', port=5000, timeout=3.0):
-        super(SocketCom, self).__init__(family=AF_INET, type=SOCK_STREAM)
+        unix = host.startswith('/')
+        if unix and AF_UNIX is None:
+            raise RuntimeError('Unix sockets are not supported')
+        family = AF_UNIX if unix else AF_INET
+        super(SocketCom, self).__init__(family=family, type=SOCK_STREAM)
+        self._rx = FrameDecoder(self.RX_BUFFER_SIZE)
+        self._waker = _Waker()
         self.settimeout(timeout)
         try:
-            self.connect((host, port))
+            self.connect(host if unix else (host, port))
         except Exception as e:
             raise RuntimeError('There are problem to connect to the smaract. '
                                'Maybe there is another client connected. '
                                'Error: %s' % e)
+
     @comm_error_handler
     def send_cmd(self, cmd):
-        self.sendall(cmd)
-        return self.recv(1024)
+        self.sendall(to_bytes(cmd))
+        ans = self._read_line()
+        if not ans:
+            raise RuntimeError('Timeout waiting the answer of command %s' %
+                               cmd.strip())
+        return ans
+
+    @comm_error_handler
+    def write_cmd(self, cmd):
+        self.sendall(to_bytes(cmd))
+
+    @comm_error_handler
+    def read_answer(self, timeout=None):
+        if timeout is None:
+            return self._read_line()
+        return self._read_line(timeout)
+
+    def wakeup(self):
+        """
+        Interrupt a read_answer with timeout, which returns an empty string.
+        """
+        self._waker.wakeup()
+
+    def close(self):
+        super(SocketCom, self).close()
+        self._waker.close()
+
+    def _read_line(self, timeout=None):
+        """
+        Read one answer from the receive buffer, receiving from the socket
+        only when the buffer does not hold a complete answer.
+
+        :param timeout: maximum time to wait in seconds, waiting also for
+        the wakeup (by default, the timeout of the socket).
+        :return: answer including the new line character or empty string on
+        timeout or wakeup.
+        """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            line = self._rx.next_line()
+            if line is not None:
+                return line
+            if end is not None:
+                ready = select.select([self, self._waker], [], [],
+                                      max(0, end - time.time()))[0]
+                if self._waker in ready:
+                    self._waker.clear()
+                    return ''
+                if not ready:
+                    return ''
+            try:
+                n = self.recv_into(self._rx.buffer())
+            except socket_timeout:
+                return ''
+            if n == 0:
+                raise RuntimeError('Connection closed by the controller')
+            self._rx.advance(n)
@@ -35,6 +35,7 @@ MIN_SCAN_SPEED = 0
 MAX_SCAN_SPEED = 4095e6
 MIN_BAUDRATE = 9600
 MAX_BAUDRATE = 115200
+BAUDRATES = [9600, 19200, 38400, 57600, 115200]
 MIN_DELAY = 100
 MAX_DELAY = 60000
 TRIGGER_INDEX_0 = 1792
@@ -60,6 +61,10 @@ class Status(object):
     HOMING = 7
     LOCKED = 9
 
+    # States of a movement not completed yet
+    moving_states = [STEPPING, SCANNING, TARGETING, WAITING, CALIBRATING,
+                     HOMING]
+
     states_txt = {0: 'Stopped',
                   1: 'Stepping',
                   2: 'Scanning',
@@ -143,6 +148,16 @@ class CommunicationMode(object):
     ASYNC = 1
 
 
+class Report(object):
+    """
+    Codes of the messages sent by the controller without request, when the
+    report on complete/triggered features are enabled for a channel:
+    :<code><channel>
+    """
+    COMPLETED = 'MCC'
+    TRIGGERED = 'MTT'
+
+
 class ChannelType(object):
     """
     Defines the channel types available
@@ -423,7 +438,7 @@ def is_baudrate_in_range(values):
     for value in values:
         if not (MIN_BAUDRATE <= value <= MAX_BAUDRATE):
             msg = 'Valid baudrate range: [%d,%d]' %\
-                  (MIN_TRIGGER, MAX_TRIGGER)
+                  (MIN_BAUDRATE, MAX_BAUDRATE)
             raise ValueError(msg)
 
 
@@ -9,9 +9,12 @@
 # ------------------------------------------------------------------------------
 
 
-from constants import *
-from axis import SmaractSDCAxis, SmaractMCSAngularAxis, SmaractMCSLinearAxis
-from communication import SmaractCommunication
+from .constants import *
+from .axis import SmaractSDCAxis, SmaractMCSAngularAxis, SmaractMCSLinearAxis, \
+    SmaractMCSBaseAxis
+from .communication import SmaractCommunication, CommType, PendingReport
+from .metadata import MetadataCache, BaudrateCache, DEFAULT_DIRECTORY
+from .protocol import parse_reply, split_cmd
 
 
 class SmaractBaseController(list):
@@ -92,39 +95,212 @@ class SmaractBaseController(list):
 
     ROTARY_SENSORS = [2, 8, 14, 20, 22, 23, 25, 26, 27, 28, 29]
 
-    def __init__(self, comm_type, *args):
+    def __init__(self, comm_type, *args, **kwargs):
         """
         Class constructor. Requires an axis or list of axes from class
         SmaractBase axis (or derived classes).
 
         :param axes: axis or list of axes.
+        :param metadata_cache: directory where the static metadata of the
+        controller is cached (True: ~/.cache/smaract). By default it is
+        always read from the controller.
         """
+        metadata_cache = kwargs.pop('metadata_cache', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' %
+                            ', '.join(kwargs))
         list.__init__(self)
+        self._metadata = None
+        self._metadata_dir = metadata_cache
         self._comm = SmaractCommunication(comm_type, *args)
 
-    def send_cmd(self, cmd):
+    def send_cmd(self, cmd, priority=None, frame=None, template=None):
         """
         Communication function used to send any command to the smaract
         controller.
         :param cmd: string command following the Smaract ASCii Programming
         Interface.
+        :param priority: send the command before the ones queued by other
+        threads. By default, only for the stop command.
+        :param frame: command already framed, e.g. rendered by the
+        CommandTemplate of an axis.
+        :param template: CommandTemplate which rendered the command, its
+        name and channel are not parsed again.
         :return:
         """
-        ans = self._comm.send_cmd(cmd)
-        flg_error = ans[0] == 'E' and ans[1] != 'S'
-        if flg_error:
-            error_code = int(ans.rsplit(',', 1)[1])
-            if error_code != 0:
-                if error_code in self.ERROR_CODES:
-                    error_msg = self.ERROR_CODES[error_code]
-                else:
-                    error_msg = 'There is not message for this error on ' + \
-                        'the documentation'
-                msg = ('Error %d: %s' % (error_code, error_msg))
-                                                   
-                raise RuntimeError(msg)
+        if self._metadata is not None:
+            ans = self._metadata.get(cmd)
+            if ans is not None:
+                return ans
+        self._invalidate_cache([cmd])
+        ans = self._comm.send_cmd(cmd, priority=priority, frame=frame,
+                                  template=template)
+        self._invalidate_cache([cmd])
+        # In asynchronous communication mode the commands which do not
+        # return a value are not acknowledged.
+        if ans is None:
+            return ans
+        self._check_answer(ans)
+        if self._metadata is not None:
+            self._metadata.store(cmd, ans)
+            self._metadata.flush()
         return ans
 
+    def send_cmds(self, cmds, raise_errors=True):
+        """
+        Communication function used to send several commands to the smaract
+        controller in one write. The answers are read afterwards, in the
+        same order, which saves one round trip per command.
+
+        :param cmds: list of string commands following the Smaract ASCii
+        Programming Interface.
+        :param raise_errors: if True the first error reported is raised
+        once all the answers are read, otherwise the error is returned in
+        place of the answer.
+        :return: list of answers.
+        """
+        answers = list(cmds)
+        sent = []
+        for i, cmd in enumerate(cmds):
+            ans = None
+            if self._metadata is not None:
+                ans = self._metadata.get(cmd)
+            if ans is None:
+                sent.append(i)
+            else:
+                answers[i] = ans
+        if sent:
+            sent_cmds = [cmds[i] for i in sent]
+            self._invalidate_cache(sent_cmds)
+            for i, ans in zip(sent, self._comm.send_cmds(sent_cmds)):
+                answers[i] = ans
+            self._invalidate_cache(sent_cmds)
+        error = None
+        for i, ans in enumerate(answers):
+            if ans is None:
+                continue
+            try:
+                self._check_answer(ans)
+            except RuntimeError as e:
+                answers[i] = RuntimeError('Command %s failed. %s' %
+                                          (cmds[i], e))
+                if error is None:
+                    error = answers[i]
+                continue
+            if self._metadata is not None:
+                self._metadata.store(cmds[i], ans)
+        if self._metadata is not None:
+            self._metadata.flush()
+        if raise_errors and error is not None:
+            raise error
+        return answers
+
+    def send_cmd_async(self, cmd):
+        """
+        Communication function used to send a command to the smaract
+        controller without waiting for its answer. Only in asynchronous
+        communication mode there can be several commands in flight.
+
+        :param cmd: string command following the Smaract ASCii Programming
+        Interface.
+        :return: PendingAnswer (its result method returns the answer) or None
+        if the command is not answered.
+        """
+        self._invalidate_cache([cmd])
+        pending = self._comm.send_cmd_async(cmd, self._check_answer)
+        if pending is not None and not cmd.startswith('G'):
+            pending.add_done_callback(
+                lambda pending: self._invalidate_cache([cmd]))
+        return pending
+
+    def send_cmds_async(self, cmds):
+        """
+        Communication function used to send several commands to the smaract
+        controller in one write without waiting for their answers.
+
+        :param cmds: list of string commands following the Smaract ASCii
+        Programming Interface.
+        :return: list of PendingAnswer (their result method returns the
+        answer or raises RuntimeError if the controller returns an error).
+        """
+        self._invalidate_cache(cmds)
+        pendings = self._comm.send_cmds_async(cmds, self._check_answer)
+        writes = [cmd for cmd in cmds if not cmd.startswith('G')]
+        if writes:
+            pendings[-1].add_done_callback(
+                lambda pending: self._invalidate_cache(writes))
+        return pendings
+
+    def _created_axes(self):
+        """
+        :return: list of the axes already created.
+        """
+        return list(self)
+
+    def _invalidate_cache(self, cmds):
+        """
+        Invalidate the answers cached by the axes which are changed by the
+        given commands. It is called before sending the commands and after
+        their answers, as the queries read meanwhile may get either value.
+
+        :param cmds: list of string commands.
+        :return: None
+        """
+        for cmd in cmds:
+            if cmd.startswith('G'):
+                continue
+            name, channel = split_cmd(cmd)
+            for axis in self._created_axes():
+                if channel is None:
+                    axis.invalidate_cache()
+                elif axis._axis_nr == channel:
+                    axis._cmd_sent(name)
+
+    def stop_all(self):
+        """
+        Stops the ongoing motions of all the positioners. The stop commands
+        are sent before the commands queued by other threads.
+
+        :return: None
+        """
+        self.send_cmds(['S%d' % axis_nr for axis_nr in range(len(self))])
+
+    def _load_metadata(self, system_id=None):
+        """
+        Load the cached metadata of the connected controller, identified by
+        its ID, if the metadata cache is enabled.
+
+        :param system_id: controller ID (default: read it).
+        :return: None
+        """
+        directory = self._metadata_dir
+        if directory is None:
+            return
+        if directory is True:
+            directory = DEFAULT_DIRECTORY
+        if system_id is None:
+            system_id = self.id
+        self._metadata = MetadataCache(directory, system_id)
+
+    @property
+    def metadata_cache(self):
+        """
+        Get the cache of the static metadata of the controller.
+
+        :return: MetadataCache or None if it is disabled.
+        """
+        return self._metadata
+
+    @classmethod
+    def _check_answer(cls, ans):
+        """
+        Raise the error reported on the answer of a command, if any.
+
+        :param ans: command answer (Reply).
+        :return: None
+        """
+        parse_reply(ans).check(cls.ERROR_CODES)
+
     @property
     def comm_type(self):
         """
@@ -145,7 +321,7 @@ class SmaractBaseController(list):
         """
         cmd = 'GIV'
         ans = self.send_cmd(cmd)
-        return 'Version: %s' % '.'.join(ans[2:].split(','))
+        return 'Version: %s' % '.'.join(ans.values)
 
     @property
     def nchannels(self):
@@ -158,7 +334,7 @@ class SmaractBaseController(list):
         """
         cmd = 'GNC'
         ans = self.send_cmd(cmd)
-        return int(ans[1:])
+        return int(ans.values[0])
 
     @property
     def id(self):
@@ -178,8 +354,9 @@ class SmaractSDCController(SmaractBaseController):
     (SDC). This class extends the base class with the ASCII commands specific
     for the SDC motion controller.
     """
-    def __init__(self, comm_type, *args):
-        SmaractBaseController.__init__(self, comm_type, *args)
+    def __init__(self, comm_type, *args, **kwargs):
+        SmaractBaseController.__init__(self, comm_type, *args, **kwargs)
+        self._load_metadata()
         axis = SmaractSDCAxis(self)
         self.append(axis)
 
@@ -191,38 +368,205 @@ class SmaractMCSController(SmaractBaseController):
     for the MCS motion controller.
     """
 
-    def __init__(self, comm_type, *args):
-        SmaractBaseController.__init__(self, comm_type, *args)
+    # Queries whose answers check the communication at a new baudrate
+    BAUDRATE_CHECK = ['GIV', 'GNC', 'GSI']
+    # Time to wait each answer while the baudrate is negotiated (s)
+    BAUDRATE_CHECK_TIMEOUT = 0.5
+
+    def __init__(self, comm_type, *args, **kwargs):
+        """
+        :param lazy_axes: if True, each axis is created (and its sensor type
+        read) when it is accessed for the first time.
+
+        See SmaractBaseController for the other parameters.
+        """
+        self._lazy_axes = kwargs.pop('lazy_axes', False)
+        SmaractBaseController.__init__(self, comm_type, *args, **kwargs)
+        # Movements waiting for their completion report, by channel
+        self._completions = {}
+        # Channels with the report on complete enabled
+        self._reporting = set()
+        self._comm.add_listener(self._on_report)
 
         # Configure communication mode to synchronous
         # The communication library work with acknowledge
-
+        # The number of channels (and the controller ID used by the metadata
+        # cache) are read in the same exchange.
         mode = CommunicationMode.SYNC
-        cmd = 'SCM%d' % mode
-        self.send_cmd(cmd)
-        self._create_axes()
-        
-    def _create_axes(self):
+        cmds = ['SCM%d' % mode, 'GNC']
+        if self._metadata_dir is not None:
+            cmds.append('GSI')
+        answers = self.send_cmds(cmds)
+        if self._metadata_dir is not None:
+            self._load_metadata(answers[2])
+            self._metadata.store('GNC', answers[1])
+            self._metadata.flush()
+        self._create_axes(int(answers[1].values[0]))
+
+    def _create_axes(self, nchannels=None):
+        """
+        Create the axes, by the sensor type of each channel. The sensor
+        types are read in one exchange, unless the axes are lazy.
+
+        :param nchannels: number of channels (default: read it).
+        :return: None
+        """
         # We need to remake the complete axis list
-        try:
-            while True:
-                self.pop()
-        except IndexError:
-            pass
+        del self[:]
+        if nchannels is None:
+            nchannels = self.nchannels
+        if self._lazy_axes:
+            self.extend([None] * nchannels)
+            return
+        cmds = ['GST%d' % axis_nr for axis_nr in range(nchannels)]
+        for axis_nr, ans in enumerate(self.send_cmds(cmds)):
+            self.append(self._create_axis(axis_nr, ans))
+
+    def _create_axis(self, axis_nr, ans=None):
+        """
+        Create the axis of a channel.
 
-        for axis_nr in range(self.nchannels):
+        :param axis_nr: channel index.
+        :param ans: answer of the GST command (default: send it).
+        :return: SmaractMCSLinearAxis or SmaractMCSAngularAxis.
+        """
+        if ans is None:
             ans = self.send_cmd('GST%d' % axis_nr)
-            sensor_code = int(ans.rsplit(',', 1)[1])
-            if sensor_code in self.LINEAR_SENSORS:
-                axis = SmaractMCSLinearAxis(self, axis_nr)
-                self.append(axis)
-            elif sensor_code in self.ROTARY_SENSORS:
-                axis = SmaractMCSAngularAxis(self, axis_nr)
-                self.append(axis)
+        sensor_code = int(ans.values[-1])
+        if sensor_code in self.LINEAR_SENSORS:
+            return SmaractMCSLinearAxis(self, axis_nr)
+        elif sensor_code in self.ROTARY_SENSORS:
+            return SmaractMCSAngularAxis(self, axis_nr)
+        msg = "Failed to create axis %s\n" % axis_nr
+        msg += 'There is not axis class for sensor code %d' % sensor_code
+        raise RuntimeError(msg)
+
+    def __getitem__(self, index):
+        if not self._lazy_axes:
+            return list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        axis = list.__getitem__(self, index)
+        if axis is None:
+            if index < 0:
+                index += len(self)
+            axis = self._create_axis(index)
+            self[index] = axis
+        return axis
+
+    def __iter__(self):
+        if not self._lazy_axes:
+            return list.__iter__(self)
+        return (self[i] for i in range(len(self)))
+
+    def _created_axes(self):
+        """
+        :return: list of the axes already created (see lazy_axes).
+        """
+        return [axis for axis in list.__iter__(self) if axis is not None]
+
+    def send_movement(self, axis_nr, cmd):
+        """
+        Send a movement command and get its completion, reported by the
+        controller without polling. The report on complete is enabled on
+        the channel if needed, and the state is read in the same exchange:
+        the movement is waited only if it is not already finished.
+
+        :param axis_nr: channel index.
+        :param cmd: movement command, e.g. 'MPA0,1000,0'.
+        :return: PendingReport. Its result method returns the completion
+        report or raises RuntimeError if the command fails.
+        """
+        cmds = [cmd, 'GS%d' % axis_nr]
+        if axis_nr not in self._reporting:
+            cmds.insert(0, 'SRC%d,1' % axis_nr)
+        # The report invalidates the cache again when the movement ends
+        self._invalidate_cache(cmds)
+        pendings = self._comm.send_cmds_async(cmds, self._check_answer)
+        return self._track_completion(axis_nr, cmd, pendings[:-1],
+                                      pendings[-1])
+
+    def _track_completion(self, axis_nr, cmd, pendings, state):
+        """
+        Get the completion of a movement already sent, reported by the
+        controller (the report on complete must be enabled in the same
+        exchange).
+
+        :param axis_nr: channel index.
+        :param cmd: movement command.
+        :param pendings: PendingAnswer of the commands of the movement.
+        :param state: PendingAnswer of the state read after them.
+        :return: PendingReport.
+        """
+        completion = PendingReport(cmd, self._comm)
+
+        def started(pending):
+            # Called from the reading thread when the state is read. The
+            # reports of previous movements were already received, and the
+            # next report is not dispatched until this returns.
+            try:
+                for p in pendings:
+                    p.result(0)
+                state = int(pending.result(0).values[0])
+            except Exception as e:
+                completion.set_exception(
+                    RuntimeError('Command %s failed. %s' % (cmd, e)))
+                return
+            if state in Status.moving_states:
+                self._completions.setdefault(axis_nr, []).append(completion)
             else:
-                msg = "Failed to create axis %s\n" % axis_nr
-                msg += 'There is not axis class for sensor code %d' % sensor_code
-                raise RuntimeError()
+                completion.set_answer(
+                    parse_reply('%s%d' % (Report.COMPLETED, axis_nr)))
+        self._reporting.add(axis_nr)
+        state.add_done_callback(started)
+        return completion
+
+    def _on_report(self, ans):
+        for axis in self._created_axes():
+            if axis._axis_nr == ans.channel:
+                axis.invalidate_cache(axis.DYNAMIC_QUERIES)
+        if ans.code == Report.COMPLETED:
+            for completion in self._completions.pop(ans.channel, []):
+                completion.set_answer(ans)
+
+    def snapshot(self, fields=('position', 'state'), raise_errors=True):
+        """
+        Reads the given quantities of all the axes in one pipelined exchange
+        with the controller. The angular positions are converted to total
+        angle like the position property of the axis.
+
+        :param fields: names of the quantities, any of
+        SmaractMCSBaseAxis.SNAPSHOT_FIELDS.
+        :param raise_errors: if False the values of the commands which fail
+        are filled with NaN (or -1 for integer values) instead of raising the
+        error.
+        :return: NumPy structured array with one row per axis and the fields
+        'channel' and the requested quantities.
+        """
+        import numpy
+
+        for field in fields:
+            if field not in SmaractMCSBaseAxis.SNAPSHOT_FIELDS:
+                raise ValueError('Wrong snapshot field: %r' % field)
+        cmds = [axis._snapshot_cmd(field) for axis in self for field in fields]
+        answers = self.send_cmds(cmds, raise_errors)
+        dtype = [('channel', 'i4')]
+        dtype += [(field, SmaractMCSBaseAxis.SNAPSHOT_FIELDS[field][1])
+                  for field in fields]
+        result = numpy.empty(len(self), dtype=dtype)
+        answers = iter(answers)
+        for row, axis in enumerate(self):
+            values = [axis._axis_nr]
+            for field in fields:
+                ans = next(answers)
+                if isinstance(ans, Exception):
+                    value = -1 if result.dtype[field].kind == 'i' else \
+                        float('nan')
+                else:
+                    value = axis._snapshot_value(field, ans)
+                values.append(value)
+            result[row] = tuple(values)
+        return result
 
     # 3.1 - Initialization commands
     # -------------------------------------------------------------------------
@@ -238,18 +582,44 @@ class SmaractMCSController(SmaractBaseController):
         ans = self.send_cmd('GCM')
         return int(ans[-1])
 
-    # The communication class is based on synchronous communication, for that
-    #  reason it is not possible to change the type of communication.
-    # @communication_mode.setter
-    # def communication_mode(self, mode):
-    #     """
-    #     Sets the type of communication with the controller.
-    #
-    #     :param mode: 0 (SYNC) or 1 (ASYMC)
-    #     :return: None
-    #     """
-    #     cmd = 'SCM%d' % mode
-    #     self.send_cmd(cmd)
+    @communication_mode.setter
+    def communication_mode(self, mode):
+        """
+        Sets the type of communication with the controller. In asynchronous
+        mode a thread reads the answers of the controller, so several
+        commands can be in flight at the same time (see send_cmd_async).
+        The commands which do not return a value are not acknowledged and
+        their errors can be retrieved with the async_errors property.
+
+        :param mode: 0 (SYNC) or 1 (ASYNC)
+        :return: None
+        """
+        if mode not in (CommunicationMode.SYNC, CommunicationMode.ASYNC):
+            raise ValueError('Wrong communication mode: %r' % mode)
+        # The communication layer follows the mode set by the command
+        self.send_cmd('SCM%d' % mode)
+        if self.communication_mode != mode:
+            raise RuntimeError('The communication mode was not changed')
+
+    @property
+    def async_errors(self):
+        """
+        Gets (and cleans) the errors reported by the controller in
+        asynchronous communication mode for commands which are not
+        acknowledged.
+
+        :return: list of error messages.
+        """
+        errors = []
+        for cmd, ans in self._comm.pop_async_errors():
+            try:
+                self._check_answer(ans)
+            except RuntimeError as e:
+                if cmd is None:
+                    cmd = 'on the controller' if ans.channel is None \
+                        else 'on channel %d' % ans.channel
+                errors.append('Command %s failed. %s' % (cmd, e))
+        return errors
 
     def reset(self):
         """
@@ -315,21 +685,235 @@ class SmaractMCSController(SmaractBaseController):
         cmd = 'TC%d' % (trigger_idx + TRIGGER_INDEX_0)
         self.send_cmd(cmd)
 
+    def _triggered_move_cmds(self, positions, trigger_idx, hold_time):
+        # ATC applies to the next command sent to the channel, so each
+        # movement is queued right after it
+        is_trigger_in_range(int(trigger_idx))
+        source = int(trigger_idx) + TRIGGER_INDEX_0
+        if not self._comm.is_async():
+            raise RuntimeError('The triggered commands are only available '
+                               'in asynchronous communication mode')
+        moves = []
+        for axis_nr in sorted(positions):
+            axis = self[axis_nr]
+            cmds = ['ATC%d,%d' % (axis._axis_nr, source),
+                    axis._move_cmd(positions[axis_nr], hold_time)]
+            moves.append((axis._axis_nr, cmds))
+        return moves
+
+    def _clean_trigger_queues(self, axes_nr):
+        self.send_cmds(['CTCQ%d' % axis_nr for axis_nr in axes_nr],
+                       raise_errors=False)
+
+    def load_triggered_move(self, positions, hold_time=0, trigger_idx=0):
+        """
+        Load the movements of several axes into their command queues, in
+        one exchange with the controller. They start together on the same
+        controller cycle when the trigger index is triggered, e.g. by
+        trigger_command. If any movement can not be loaded the queues of
+        all the axes are cleaned.
+        The command queue is only available with asynchronous communication.
+
+        :param positions: dictionary {axis number: target position}. The
+        angular positions are total angles, as the move method of the axis.
+        :param hold_time: hold the positions for this amount of time in ms.
+        :param trigger_idx: trigger index of the movements (0-255).
+        :return: None
+        """
+        moves = self._triggered_move_cmds(positions, trigger_idx, hold_time)
+        self._load_triggered(
+            moves, [cmd for _, axis_cmds in moves for cmd in axis_cmds])
+
+    def _load_triggered(self, moves, cmds):
+        """
+        Send the commands loading triggered movements and wait for their
+        acknowledgement. If any of them fails the queues of all the axes
+        are cleaned.
+
+        :param moves: list of (axis number, commands of the movement).
+        :param cmds: commands to send.
+        :return: None
+        """
+        # The answer of the last query acknowledges the previous commands,
+        # or their errors are returned in its place
+        cmds = cmds + ['GCM']
+        try:
+            for pending in self.send_cmds_async(cmds):
+                pending.result(3)
+        except RuntimeError:
+            self._clean_trigger_queues([axis_nr for axis_nr, _ in moves])
+            raise
+
+    def triggered_move(self, positions, hold_time=0, trigger_idx=0,
+                       wait=False, timeout=None):
+        """
+        Move several axes at the same time: the movements are loaded into
+        the command queues of the axes and, once all of them are loaded,
+        triggered with one command, so all the axes start on the same
+        controller cycle. If any movement can not be loaded the queues of
+        all the axes are cleaned and none is triggered, as in
+        load_triggered_move.
+        The command queue is only available with asynchronous communication.
+
+        :param positions: dictionary {axis number: target position}. The
+        angular positions are total angles, as the move method of the axis.
+        :param hold_time: hold the positions for this amount of time in ms.
+        :param trigger_idx: trigger index used to load the movements, its
+        command queue must be empty.
+        :param wait: wait until the controller reports the end of all the
+        movements.
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :return: list of PendingReport, the completions of the movements
+        sorted by axis number.
+        """
+        moves = self._triggered_move_cmds(positions, trigger_idx, hold_time)
+        cmds = []
+        for axis_nr, axis_cmds in moves:
+            # The report on complete is enabled before the trigger
+            if axis_nr not in self._reporting:
+                cmds.append('SRC%d,1' % axis_nr)
+            cmds.extend(axis_cmds)
+        self._load_triggered(moves, cmds)
+        cmds = ['TC%d' % (int(trigger_idx) + TRIGGER_INDEX_0)]
+        cmds.extend(['GS%d' % axis_nr for axis_nr, _ in moves])
+        self._invalidate_cache(cmds)
+        pendings = self._comm.send_cmds_async(cmds, self._check_answer)
+        completions = []
+        for (axis_nr, axis_cmds), state in zip(moves, pendings[1:]):
+            completions.append(self._track_completion(
+                axis_nr, axis_cmds[-1], pendings[:1], state))
+        if wait:
+            for completion in completions:
+                completion.result(timeout)
+        return completions
+
     # 3.5 - Miscellaneous commands
     # -------------------------------------------------------------------------
     def configure_baudrate(self, baudrate):
         """
-        Sets the baudrate of the RS-232 interface.
+        Sets the baudrate of the RS-232 interface. The serial port follows
+        once the controller acknowledges it, so no other command must be
+        sent meanwhile.
         IMPORTANT: NOT AVAILABLE for network interface.
 
         :param baudrate: valid baudrate value
         :return: applied baudrate value.
         """
-        # TODO: Restrict only to serial communication layer.
         is_baudrate_in_range(baudrate)
+        port = self._serial_port()
         cmd = 'BR%d' % baudrate
         ans = self.send_cmd(cmd)
-        return int(ans[2:])
+        baudrate = int(ans[2:])
+        if port is not None:
+            port.set_baudrate(baudrate)
+        return baudrate
+
+    def negotiate_baudrate(self, baudrates=BAUDRATES, remember=True):
+        """
+        Raise the baudrate of the controller and of the serial port to the
+        highest one which passes a check: the answers of BAUDRATE_CHECK
+        must be the same as at the current baudrate. The candidates are
+        tried from the highest and each one which fails is reverted. The
+        result is stored by serial port, and the next negotiation tries
+        the stored baudrate first.
+        It requires the synchronous communication mode, and no other
+        command must be sent meanwhile.
+
+        :param baudrates: candidate baudrates.
+        :param remember: store the result, in the directory of the
+        metadata cache (True: ~/.cache/smaract).
+        :return: applied baudrate.
+        """
+        port = self._serial_port()
+        if port is None:
+            raise RuntimeError('The baudrate can only be negotiated on '
+                               'serial connections')
+        if self._comm.is_async():
+            raise RuntimeError('The baudrate can only be negotiated in '
+                               'synchronous communication mode')
+        cache = None
+        if remember:
+            directory = remember
+            if directory is True:
+                directory = self._metadata_dir
+            if directory in (None, True):
+                directory = DEFAULT_DIRECTORY
+            cache = BaudrateCache(directory)
+        current = port.baudrate
+        candidates = sorted([b for b in baudrates if b > current],
+                            reverse=True)
+        stored = cache.get(port.port) if cache is not None else None
+        if stored in candidates:
+            candidates.remove(stored)
+            candidates.insert(0, stored)
+        timeout = port.timeout
+        port.timeout = self.BAUDRATE_CHECK_TIMEOUT
+        try:
+            reference = self._comm.send_cmds(self.BAUDRATE_CHECK)
+            for baudrate in candidates:
+                if self._try_baudrate(port, baudrate, current, reference):
+                    current = baudrate
+                    break
+        finally:
+            port.timeout = timeout
+        if cache is not None:
+            cache.store(port.port, current)
+        return current
+
+    def _serial_port(self):
+        """
+        :return: SerialCom of the connection, None for the simulator.
+        """
+        if self.comm_type == CommType.Serial:
+            return self._comm._comm
+        if self.comm_type == CommType.Simulator:
+            return None
+        raise RuntimeError('The baudrate can only be configured on serial '
+                           'connections')
+
+    def _check_link(self, reference):
+        try:
+            return self._comm.send_cmds(self.BAUDRATE_CHECK) == reference
+        except RuntimeError:
+            return False
+
+    def _try_baudrate(self, port, baudrate, previous, reference):
+        """
+        Change the baudrate and check the communication. If it fails, the
+        previous baudrate is restored.
+
+        :return: True if the communication works at the new baudrate.
+        """
+        try:
+            self.configure_baudrate(baudrate)
+        except RuntimeError:
+            # The answer may be lost while the controller changed
+            pass
+        else:
+            if self._check_link(reference):
+                return True
+        # The controller may receive the commands even if its answers are
+        # corrupted: set the previous baudrate, whatever the answer.
+        try:
+            self._comm.send_cmds(['BR%d' % previous])
+        except RuntimeError:
+            pass
+        port.set_baudrate(previous)
+        if self._check_link(reference):
+            return False
+        # Find the controller and set the previous baudrate again
+        for rate in BAUDRATES:
+            port.set_baudrate(rate)
+            if not self._check_link(reference):
+                continue
+            try:
+                self.configure_baudrate(previous)
+            except RuntimeError:
+                continue
+            if self._check_link(reference):
+                return False
+        raise RuntimeError('The communication with the controller is lost '
+                           'changing the baudrate to %d' % baudrate)
 
     def keep_alive(self, delay=0):
         """
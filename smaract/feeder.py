@@ -0,0 +1,256 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Flow-controlled feeding of the command queues of the axes: the movements
+of a point by point scan are loaded as triggered commands while there is
+room for them, so scans longer than the queue capacity run from a Python
+iterable without ever filling the queues.
+"""
+
+import time
+import threading
+from collections import deque
+from itertools import islice
+
+from .constants import ChannelProperties, Report, TRIGGER_INDEX_0
+from .protocol import split_answer
+
+
+class QueueFeeder(object):
+    """
+    Load the movements of a scan into the command queues of several axes,
+    keeping the queues full but never over their capacity. Each point is
+    one movement per axis, loaded with the given trigger source, so every
+    trigger moves all the axes to the next point.
+
+    The room left in each queue is tracked locally: it is read from the
+    QueueSize and QueueCapacity channel properties when the feeding starts,
+    reduced by each movement loaded and increased by each report of a
+    triggered movement (the report on triggered is enabled on the axes).
+    The points are taken from the iterable only when they fit, and the
+    loads are pipelined without waiting for their acknowledgement.
+    The command queue is only available with asynchronous communication.
+
+    :param ctrl: SmaractMCSController instance.
+    :param axes: list of axis numbers.
+    :param points: iterable of points, each one a sequence with the target
+    position of each axis. The angular positions are total angles, as the
+    move method of the axis.
+    :param trigger_source: trigger source of the movements, by default the
+    trigger index 0 of trigger_command.
+    :param hold_time: hold the positions for this amount of time in ms.
+    :param period: maximum time waiting for room in the queues before
+    checking if the feeding is stopped (s).
+    """
+    def __init__(self, ctrl, axes, points, trigger_source=TRIGGER_INDEX_0,
+                 hold_time=0, period=0.1):
+        self.ctrl = ctrl
+        self.axes = [ctrl[axis_nr] for axis_nr in axes]
+        self.points = iter(points)
+        self.trigger_source = trigger_source
+        self.hold_time = hold_time
+        self.period = period
+        # Points loaded, and movements triggered per axis number
+        self.loaded = 0
+        self.triggered = dict([(axis._axis_nr, 0) for axis in self.axes])
+        self.capacity = {}
+        self._queued = {}
+        self._inflight = deque()
+        self._cond = threading.Condition()
+        self._listening = False
+        self._running = False
+        self._thread = None
+        self.error = None
+
+    def configure(self):
+        """
+        Enable the report on triggered of the axes and read the size and
+        capacity of their queues. It is called by run.
+
+        :return: None
+        """
+        if not self.ctrl._comm.is_async():
+            raise RuntimeError('The triggered commands are only available '
+                               'in asynchronous communication mode')
+        if not self._listening:
+            self.ctrl._comm.add_listener(self._on_report)
+            self._listening = True
+        # The size is read before the reports are enabled: the movements
+        # triggered meanwhile are not reported and they are still taken as
+        # queued, so the room is underestimated but never overestimated.
+        cmds = []
+        for axis in self.axes:
+            cmds += [axis._format_cmd('GCP', ChannelProperties.QueueCapacity),
+                     axis._format_cmd('GCP', ChannelProperties.QueueSize),
+                     axis._format_cmd('SRT', 1)]
+        answers = self.ctrl.send_cmds(cmds)
+        with self._cond:
+            for i, axis in enumerate(self.axes):
+                capacity, size = answers[3 * i:3 * i + 2]
+                self.capacity[axis._axis_nr] = int(capacity.rsplit(',', 1)[1])
+                self._queued[axis._axis_nr] = int(size.rsplit(',', 1)[1])
+
+    @property
+    def queued(self):
+        """
+        :return: dictionary {axis number: movements loaded and not
+        triggered yet}.
+        """
+        with self._cond:
+            return dict(self._queued)
+
+    def run(self):
+        """
+        Configure the axes and load all the points, waiting for room in the
+        queues when they are full. It returns when all the points are loaded
+        and acknowledged by the controller, or when the feeding is stopped.
+
+        :return: number of points loaded.
+        """
+        self._running = True
+        self.configure()
+        while self._running:
+            npoints = self._wait_room()
+            if npoints == 0:
+                continue
+            points = list(islice(self.points, npoints))
+            if not points:
+                break
+            self._load(points)
+        self._check_inflight(wait=True)
+        return self.loaded
+
+    def wait_empty(self, timeout=None):
+        """
+        Wait until all the movements loaded are triggered.
+
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :return: None
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while any(self._queued.values()):
+                delay = None if end is None else end - time.time()
+                if delay is not None and delay <= 0:
+                    raise RuntimeError('Timeout waiting the triggers of the '
+                                       'queued movements')
+                self._cond.wait(delay)
+
+    def start(self):
+        """
+        Load the points from a thread.
+
+        :return: self
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='QueueFeeder')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """
+        Wait until the thread loads all the points.
+
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :return: None
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                raise RuntimeError('Timeout waiting the queue feeder')
+        if self.error is not None:
+            raise self.error
+
+    def close(self, clean=False):
+        """
+        Stop loading points and the tracking of the triggered movements.
+
+        :param clean: cancel the movements queued and not triggered yet.
+        :return: None
+        """
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if clean:
+            cmds = [axis._format_cmd('CTCQ') for axis in self.axes]
+            for pending in self.ctrl.send_cmds_async(cmds + ['GCM']):
+                pending.result(3)
+            with self._cond:
+                for axis_nr in self._queued:
+                    self._queued[axis_nr] = 0
+                self._cond.notify_all()
+        if self._listening:
+            self.ctrl._comm.remove_listener(self._on_report)
+            self._listening = False
+
+    def _wait_room(self):
+        # Number of points which fit in all the queues, 0 if the wait ends
+        # without room
+        with self._cond:
+            room = min([self.capacity[axis_nr] - n
+                        for axis_nr, n in self._queued.items()])
+            if room <= 0:
+                self._cond.wait(self.period)
+                room = min([self.capacity[axis_nr] - n
+                            for axis_nr, n in self._queued.items()])
+        self._check_inflight()
+        return max(room, 0)
+
+    def _load(self, points):
+        cmds = []
+        for point in points:
+            if len(point) != len(self.axes):
+                raise ValueError('Wrong number of positions: %r' % (point,))
+            for axis, position in zip(self.axes, point):
+                cmds += [axis._format_cmd('ATC', self.trigger_source),
+                         axis._move_cmd(position, self.hold_time)]
+        # The answer of the last query acknowledges the previous commands,
+        # or their errors are returned in its place
+        cmds.append('GCM')
+        with self._cond:
+            for axis_nr in self._queued:
+                self._queued[axis_nr] += len(points)
+        self._inflight.append((len(points),
+                               self.ctrl.send_cmds_async(cmds)))
+
+    def _check_inflight(self, wait=False):
+        # Check the loads acknowledged, in order
+        while self._inflight:
+            npoints, pendings = self._inflight[0]
+            if not wait and not pendings[-1].done():
+                return
+            for pending in pendings:
+                pending.result(3)
+            self._inflight.popleft()
+            self.loaded += npoints
+
+    def _on_report(self, ans):
+        code, channel = split_answer(ans)
+        if code != Report.TRIGGERED or channel not in self._queued:
+            return
+        with self._cond:
+            self.triggered[channel] += 1
+            self._queued[channel] = max(0, self._queued[channel] - 1)
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            self.run()
+        except Exception as e:
+            # The feeding stops on errors, kept for the caller
+            self.error = e
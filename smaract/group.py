@@ -0,0 +1,232 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+import time
+import threading
+
+from .controller import SmaractMCSController
+
+
+def _run_all(func, items):
+    """
+    Call a function for each item, each call in its own thread.
+
+    :param func: function of one argument.
+    :param items: list of arguments.
+    :return: list of results, with the exception raised in place of the
+    result of the calls which fail.
+    """
+    results = [None] * len(items)
+
+    def run(i, item):
+        try:
+            results[i] = func(item)
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=run, args=(i, item))
+               for i, item in enumerate(items)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class ControllerGroup(list):
+    """
+    Group of controllers operated together. The operations are run on all
+    the controllers concurrently, and their results returned in a list with
+    one item per controller. If any controller fails, a RuntimeError
+    listing all the errors is raised once every controller is done, unless
+    raise_errors is False: then the exception is returned in place of the
+    result of the controller.
+
+    :param controllers: list of SmaractMCSController/SmaractSDCController.
+    """
+
+    def __init__(self, controllers=()):
+        list.__init__(self, controllers)
+
+    @classmethod
+    def connect(cls, configs, raise_errors=True, **kwargs):
+        """
+        Create the controllers in parallel.
+
+        :param configs: list of (controller class, comm_type, *args) tuples,
+        e.g. (SmaractMCSController, CommType.Socket, '10.0.0.1', 5000).
+        :param raise_errors: if False the exception raised by a controller
+        constructor is kept in the group in place of the controller.
+        :param kwargs: keyword arguments of all the controllers, e.g.
+        metadata_cache=True.
+        :return: ControllerGroup
+        """
+        def create(config):
+            return config[0](*config[1:], **kwargs)
+        controllers = _run_all(create, list(configs))
+        group = cls(controllers)
+        if raise_errors:
+            try:
+                group._check(controllers)
+            except RuntimeError:
+                group.close()
+                raise
+        return group
+
+    def close(self):
+        """
+        Close the communication with all the controllers.
+
+        :return: None
+        """
+        for ctrl in self._connected():
+            ctrl._comm.close()
+
+    def map(self, func, raise_errors=True):
+        """
+        Call a function with each controller, concurrently.
+
+        :param func: function of one argument, the controller.
+        :param raise_errors: see ControllerGroup.
+        :return: list of results.
+        """
+        return self._check(_run_all(func, list(self)), raise_errors)
+
+    def send_cmds(self, cmds, raise_errors=True, timeout=3.0):
+        """
+        Send commands to all the controllers and wait for all the answers:
+        the exchanges with the controllers overlap, so it takes one round
+        trip. In asynchronous communication mode a query follows the
+        commands, so the ones which are not acknowledged are confirmed (or
+        fail) with its answer; their answer is None.
+
+        :param cmds: list of commands, the same for all the controllers, or
+        function returning the commands of a given controller.
+        :param raise_errors: see ControllerGroup.
+        :param timeout: maximum time to wait all the answers in seconds.
+        :return: list with the list of answers of each controller.
+        """
+        pendings = []
+        for ctrl in self:
+            try:
+                ctrl_cmds = list(cmds(ctrl) if callable(cmds) else cmds)
+                barrier = ctrl._comm.is_async()
+                if barrier:
+                    ctrl_cmds.append('GCM')
+                ctrl_pendings = ctrl.send_cmds_async(ctrl_cmds)
+                if barrier:
+                    ctrl_pendings = ctrl_pendings[:-1]
+                pendings.append(ctrl_pendings)
+            except Exception as e:
+                pendings.append(e)
+        deadline = time.time() + timeout
+        results = []
+        for ctrl_pendings in pendings:
+            if isinstance(ctrl_pendings, Exception):
+                results.append(ctrl_pendings)
+                continue
+            try:
+                results.append([p.result(max(0, deadline - time.time()))
+                                for p in ctrl_pendings])
+            except Exception as e:
+                results.append(e)
+        return self._check(results, raise_errors)
+
+    def stop_all(self, raise_errors=True):
+        """
+        Stop the ongoing motions of all the positioners of all the
+        controllers, in one round trip. The stop commands are sent before
+        the commands queued by other threads.
+
+        :param raise_errors: see ControllerGroup.
+        :return: None
+        """
+        self.send_cmds(lambda ctrl: ['S%d' % i for i in range(len(ctrl))],
+                       raise_errors)
+
+    def snapshot(self, fields=('position', 'state'), raise_errors=True):
+        """
+        Read the given quantities of all the axes of the MCS controllers
+        (see SmaractMCSController.snapshot).
+
+        :param fields: names of the quantities.
+        :param raise_errors: see ControllerGroup. The errors of single
+        commands are filled with NaN too, like in
+        SmaractMCSController.snapshot.
+        :return: list with the NumPy structured array of each controller, or
+        None for the controllers without snapshot.
+        """
+        def snapshot(ctrl):
+            if not isinstance(ctrl, SmaractMCSController):
+                return None
+            return ctrl.snapshot(fields, raise_errors)
+        return self.map(snapshot, raise_errors)
+
+    def find_reference_marks(self, direction, hold_time=0, auto_zero=0,
+                             timeout=None, raise_errors=True):
+        """
+        Move all the positioners of all the controllers to their reference
+        mark at the same time and wait until they are found (for the MCS
+        controllers, which report the completion).
+
+        :param direction: any valid direction value.
+        :param hold_time: held after find reference mark in ms.
+        :param auto_zero: flag to reset the position to 0.
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :param raise_errors: see ControllerGroup.
+        :return: None
+        """
+        def home(ctrl):
+            if not isinstance(ctrl, SmaractMCSController):
+                for axis in ctrl:
+                    axis.find_reference_mark(direction, hold_time, auto_zero)
+                return
+            cmds = ['FRM%d,%d,%d,%d' % (i, direction, hold_time, auto_zero)
+                    for i in range(len(ctrl))]
+            completions = [ctrl.send_movement(i, cmd)
+                           for i, cmd in enumerate(cmds)]
+            errors = []
+            for completion in completions:
+                try:
+                    completion.result(timeout)
+                except RuntimeError as e:
+                    errors.append(str(e))
+            if errors:
+                raise RuntimeError('. '.join(errors))
+        self.map(home, raise_errors)
+
+    def set_axes_property(self, name, value, raise_errors=True):
+        """
+        Set a property of all the axes of all the controllers, e.g.
+        group.set_axes_property('closed_loop_vel', 1e6).
+
+        :param name: axis property name.
+        :param value: value set to every axis.
+        :param raise_errors: see ControllerGroup.
+        :return: None
+        """
+        def push(ctrl):
+            for axis in ctrl:
+                setattr(axis, name, value)
+        self.map(push, raise_errors)
+
+    def _connected(self):
+        return [ctrl for ctrl in self if not isinstance(ctrl, Exception)]
+
+    def _check(self, results, raise_errors=True):
+        errors = ['Controller %d: %s' % (i, result)
+                  for i, result in enumerate(results)
+                  if isinstance(result, Exception)]
+        if raise_errors and errors:
+            raise RuntimeError('\n'.join(errors))
+        return results
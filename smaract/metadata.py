@@ -0,0 +1,153 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+import os
+import re
+import json
+import threading
+
+from .protocol import parse_reply, split_cmd
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'smaract')
+
+
+class MetadataCache(object):
+    """
+    Answers of the queries of the static metadata of a controller (number of
+    channels, interface version, serial numbers, firmware versions, channel
+    types and feature permissions). They are stored on disk, in a JSON file
+    named after the controller ID, so that they are read from the controller
+    only once. The sensor types are not cached, they can be changed (SST)
+    and they select the class of the axes, so they are read on each
+    connection. The answers stored are written to the file on flush, once
+    per exchange.
+
+    :param directory: directory of the cache files, created if needed.
+    :param system_id: controller ID (answer of the GSI command).
+    """
+    QUERIES = ['GNC', 'GIV', 'GSN', 'GFV', 'GCT', 'GFP', 'FP']
+
+    def __init__(self, directory, system_id):
+        self.path = os.path.join(directory, '%s.json' %
+                                 re.sub(r'[^\w.-]', '_', system_id))
+        self._lock = threading.Lock()
+        # Answers stored and not written yet
+        self._dirty = False
+        try:
+            with open(self.path) as f:
+                self._answers = json.load(f)
+        except (IOError, OSError, ValueError):
+            self._answers = {}
+
+    def get(self, cmd):
+        """
+        :param cmd: command without the frame characters.
+        :return: cached answer of the command (Reply) or None.
+        """
+        ans = self._answers.get(cmd)
+        return None if ans is None else parse_reply(ans)
+
+    def store(self, cmd, ans):
+        """
+        Store the answer of a command if it is a metadata query. It is
+        written to the file on flush.
+
+        :param cmd: command without the frame characters.
+        :param ans: answer, already checked for errors.
+        :return: None
+        """
+        if split_cmd(cmd)[0] not in self.QUERIES:
+            return
+        with self._lock:
+            if self._answers.get(cmd) != ans:
+                self._answers[cmd] = ans
+                self._dirty = True
+
+    def flush(self):
+        """
+        Write the answers stored since the last flush, if any.
+
+        :return: None
+        """
+        with self._lock:
+            if self._dirty:
+                self._dirty = False
+                self._save()
+
+    def clear(self):
+        """
+        Drop all the cached answers.
+
+        :return: None
+        """
+        with self._lock:
+            self._answers = {}
+            self._dirty = False
+            self._save()
+
+    def _save(self):
+        _write_json(self.path, self._answers)
+
+
+class BaudrateCache(object):
+    """
+    Baudrates negotiated with the controllers by serial port (see
+    SmaractMCSController.negotiate_baudrate), stored on disk in a JSON file.
+
+    :param directory: directory of the cache file, created if needed.
+    """
+    FILENAME = 'baudrates.json'
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.path = os.path.join(directory, self.FILENAME)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, port):
+        """
+        :param port: serial port name.
+        :return: baudrate stored for the port or None.
+        """
+        return self._load().get(port)
+
+    def store(self, port, baudrate):
+        """
+        :param port: serial port name.
+        :param baudrate: baudrate negotiated.
+        :return: None
+        """
+        baudrates = self._load()
+        baudrates[port] = baudrate
+        _write_json(self.path, baudrates)
+
+
+def _write_json(path, data):
+    # The caches are an optimization: failing to write them is not an error
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        if hasattr(os, 'replace'):
+            os.replace(tmp, path)
+        else:
+            os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
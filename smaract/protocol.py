@@ -0,0 +1,541 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Sans-IO implementation of the ASCII protocol of the controllers: the
+formatting and framing of the commands, the framing of the received byte
+stream and the parsing of the answers into typed replies. It performs no
+I/O, so the same code is used by the blocking transports, the I/O threads
+and the asyncio front-end::
+
+    data = encode(['GP0', 'GS0'])       # b':GP0\\n:GS0\\n'
+    decoder = FrameDecoder()
+    decoder.feed(b':P0,1000\\n:S0,0\\n')
+    reply = decoder.next_reply()        # PositionReply, reply.position 1000
+"""
+
+from .constants import Report, TURN
+
+
+FRAME_START = ':'
+FRAME_END = '\n'
+
+# Controller commands (without channel index) and the code of their answer.
+# The commands at the channel level which return a value answer with the same
+# name without the leading 'G' followed by the channel index, e.g.
+# GP0 -> :P0,1000 or GCLS1 -> :CLS1,2000. The rest of commands are only
+# acknowledged (:E<channel>,0) in synchronous communication mode.
+GLOBAL_ANSWERS = {'GNC': 'N',
+                  'GIV': 'IV',
+                  'GSI': 'ID',
+                  'GCM': 'CM',
+                  'GSE': 'SE',
+                  'BR': 'BR'}
+
+GLOBAL_COMMANDS = ['SCM', 'R', 'SHE', 'SSE', 'TC', 'K'] + list(GLOBAL_ANSWERS)
+
+CHANNEL_ANSWERS = {'FP': 'FP'}
+
+_GLOBAL_CODES = frozenset(GLOBAL_ANSWERS.values())
+
+# Commands which skip the queue of the commands to send (see IOThread)
+PRIORITY_COMMANDS = ['S']
+
+# Messages sent by the controller without request (e.g. :MCC0 when the
+# report on complete is enabled), with the frame character.
+REPORT_FRAMES = (FRAME_START + Report.COMPLETED,
+                 FRAME_START + Report.TRIGGERED)
+
+# Answer code of the errors and acknowledgements, e.g. :E0,0 or :E-1,5
+ERROR_CODE = 'E'
+_CHANNEL_CHARS = '-0123456789'
+
+
+def to_bytes(data):
+    """
+    Encodes the data to be written on the wire (no-op on Python 2).
+    """
+    if isinstance(data, bytes):
+        return data
+    return data.encode('ascii')
+
+
+def to_str(data):
+    """
+    Decodes the data read from the wire (no-op on Python 2).
+    """
+    if isinstance(data, str):
+        return data
+    return data.decode('ascii')
+
+
+# Commands
+# -----------------------------------------------------------------------------
+class CommandTemplate(object):
+    """
+    Precompiled command of a channel with a fixed number of parameters.
+    The format strings are built once, so rendering a command or its wire
+    frame is a single formatting operation, and the commands without
+    parameters are constants (cmd, line and data).
+
+    :param name: command name, e.g. 'MPA'.
+    :param channel: channel index, None for the controller commands.
+    :param npars: number of integer parameters.
+    """
+    __slots__ = ('name', 'channel', 'npars', 'cmd', 'line', 'data',
+                 '_cmd_fmt', '_line_fmt')
+
+    def __init__(self, name, channel=None, npars=0):
+        self.name = name
+        self.channel = channel
+        self.npars = npars
+        pars = ','.join(['%d'] * npars)
+        if channel is None:
+            self._cmd_fmt = name + pars
+        else:
+            self._cmd_fmt = '%s%d' % (name, channel) + ',%d' * npars
+        self._line_fmt = FRAME_START + self._cmd_fmt + FRAME_END
+        if npars:
+            self.cmd = self.line = self.data = None
+        else:
+            self.cmd = self._cmd_fmt
+            self.line = self._line_fmt
+            self.data = to_bytes(self.line)
+
+    def render(self, *pars):
+        """
+        :param pars: parameters of the command.
+        :return: command without the frame characters, e.g. 'MPA0,1000,0'.
+        """
+        return self._cmd_fmt % pars
+
+    def frame(self, *pars):
+        """
+        :param pars: parameters of the command.
+        :return: framed command, e.g. ':MPA0,1000,0\\n'.
+        """
+        return self._line_fmt % pars
+
+    def encode(self, *pars):
+        """
+        :param pars: parameters of the command.
+        :return: framed command as bytes.
+        """
+        return to_bytes(self._line_fmt % pars)
+
+    def __repr__(self):
+        return 'CommandTemplate(%r, %r, %d)' % (self.name, self.channel,
+                                                self.npars)
+
+
+def frame(cmd):
+    """
+    :param cmd: command or answer without the frame characters.
+    :return: framed message, e.g. ':GP0\\n'.
+    """
+    return FRAME_START + cmd + FRAME_END
+
+
+def frame_cmds(cmds):
+    """
+    Frame several commands to be sent in one write.
+
+    :param cmds: list of commands without the frame characters.
+    :return: string with the framed commands.
+    """
+    return ''.join([FRAME_START + cmd + FRAME_END for cmd in cmds])
+
+
+def encode(cmds):
+    """
+    Encode several commands to be sent in one write.
+
+    :param cmds: list of commands without the frame characters.
+    :return: bytes with the framed commands.
+    """
+    return to_bytes(frame_cmds(cmds))
+
+
+def unframe(line):
+    """
+    :param line: framed message, e.g. ':P0,1000\\n'.
+    :return: message without the frame characters, e.g. 'P0,1000'.
+    """
+    return line.strip()[1:]
+
+
+def is_report(line):
+    """
+    :param line: framed message.
+    :return: True if it is a message sent without request (report).
+    """
+    return line.startswith(REPORT_FRAMES)
+
+
+def split_cmd(cmd):
+    """
+    Split a command in its name and its channel index.
+
+    :param cmd: command without the frame characters, e.g. 'GP0'.
+    :return: (name, channel), channel is None for controller commands.
+    """
+    i = 0
+    while i < len(cmd) and cmd[i].isalpha():
+        i += 1
+    name = cmd[:i]
+    if name in GLOBAL_COMMANDS:
+        return name, None
+    channel = cmd[i:].split(',', 1)[0]
+    return name, int(channel) if channel else None
+
+
+def is_priority(cmd, name=None):
+    """
+    :param cmd: command without the frame characters.
+    :param name: command name, if it is already known (e.g. from the
+    CommandTemplate which rendered the command).
+    :return: True if the command skips the queue of commands to send.
+    """
+    if name is None:
+        name = split_cmd(cmd)[0]
+    return name in PRIORITY_COMMANDS
+
+
+def answer_key(cmd, name=None, channel=None):
+    """
+    Get the (code, channel) of the answer expected for a command when the
+    controller works in asynchronous communication mode.
+
+    :param cmd: command without the frame characters.
+    :param name: command name, if it is already known. Then the command
+    is not parsed and channel must be given too.
+    :param channel: channel index of the command (see split_cmd).
+    :return: (code, channel) or None if the command is not answered.
+    """
+    if name is None:
+        name, channel = split_cmd(cmd)
+    if name in GLOBAL_ANSWERS:
+        return GLOBAL_ANSWERS[name], None
+    if channel is None:
+        return None
+    if name in CHANNEL_ANSWERS:
+        return CHANNEL_ANSWERS[name], channel
+    if name.startswith('G'):
+        return name[1:], channel
+    return None
+
+
+# Answers
+# -----------------------------------------------------------------------------
+def split_answer(ans):
+    """
+    Split an answer in its code and its channel index.
+
+    :param ans: answer without the frame characters, e.g. 'P0,1000'.
+    :return: (code, channel), channel is None for controller answers.
+    """
+    i = 0
+    while i < len(ans) and ans[i].isalpha():
+        i += 1
+    code = ans[:i]
+    if code in _GLOBAL_CODES:
+        return code, None
+    channel = ans[i:].split(',', 1)[0]
+    try:
+        channel = int(channel)
+    except ValueError:
+        return code, None
+    # The errors of the controller commands are reported on channel -1
+    return code, channel if channel >= 0 else None
+
+
+def error_code(ans):
+    """
+    Get the error code of an error or acknowledgement answer.
+
+    :param ans: answer without the frame characters.
+    :return: error code (0 for an acknowledgement) or None if the answer
+    is not an error.
+    """
+    if not ans.startswith(ERROR_CODE) or len(ans) < 2 or \
+            ans[1] not in _CHANNEL_CHARS:
+        return None
+    return int(ans.rsplit(',', 1)[1])
+
+
+def is_error(ans):
+    """
+    :param ans: answer without the frame characters.
+    :return: True if the answer reports an error (not an acknowledgement).
+    """
+    return bool(error_code(ans))
+
+
+def error_message(code, error_codes=None):
+    """
+    :param code: error code.
+    :param error_codes: dictionary {code: description}, e.g.
+    SmaractBaseController.ERROR_CODES.
+    :return: error message.
+    """
+    if error_codes and code in error_codes:
+        description = error_codes[code]
+    else:
+        description = 'There is not message for this error on ' + \
+            'the documentation'
+    return 'Error %d: %s' % (code, description)
+
+
+def check_answer(ans, error_codes=None):
+    """
+    Raise the error reported on an answer, if any.
+
+    :param ans: answer without the frame characters.
+    :param error_codes: dictionary {code: description}.
+    :return: None
+    """
+    parse_reply(ans).check(error_codes)
+
+
+class Reply(str):
+    """
+    Answer of the controller without the frame characters. It is the answer
+    string itself, so it compares equal to it, with its code and channel
+    parsed. The generic replies keep the values as strings, see parse_reply
+    for the typed ones.
+
+    :param ans: answer without the frame characters, e.g. 'CLS0,2000'.
+    """
+    def __new__(cls, ans):
+        self = str.__new__(cls, ans)
+        self.code, self.channel = split_answer(ans)
+        return self
+
+    @property
+    def text(self):
+        return str(self)
+
+    @property
+    def values(self):
+        """
+        :return: list of the values after the code and the channel.
+        """
+        if self.code in _GLOBAL_CODES:
+            return self[len(self.code):].split(',')
+        return self.split(',')[1:]
+
+    @property
+    def is_error(self):
+        return False
+
+    def check(self, error_codes=None):
+        """
+        Raise the error reported, if any.
+
+        :param error_codes: dictionary {code: description}.
+        :return: self.
+        """
+        return self
+
+
+class Ack(Reply):
+    """
+    Acknowledgement of a command, e.g. 'E0,0'.
+    """
+
+
+class ErrorReply(Reply):
+    """
+    Error answer, e.g. 'E0,7'. The errors of the controller commands have
+    no channel.
+    """
+    def __new__(cls, ans):
+        self = Reply.__new__(cls, ans)
+        self.error_code = int(ans.rsplit(',', 1)[1])
+        return self
+
+    @property
+    def is_error(self):
+        return True
+
+    def message(self, error_codes=None):
+        """
+        :param error_codes: dictionary {code: description}.
+        :return: error message.
+        """
+        return error_message(self.error_code, error_codes)
+
+    def check(self, error_codes=None):
+        raise RuntimeError(self.message(error_codes))
+
+
+class PositionReply(Reply):
+    """
+    Position of a linear sensor, e.g. 'P0,1000' (nm).
+    """
+    def __new__(cls, ans):
+        self = Reply.__new__(cls, ans)
+        self.position = float(ans.rsplit(',', 1)[1])
+        return self
+
+
+class AngleReply(Reply):
+    """
+    Angle of a rotary sensor, e.g. 'A0,1000,1': angle (micro degrees) and
+    revolution. The position is the total angle.
+    """
+    def __new__(cls, ans):
+        self = Reply.__new__(cls, ans)
+        angle, revolution = ans.split(',')[-2:]
+        self.angle = float(angle)
+        self.revolution = int(revolution)
+        return self
+
+    @property
+    def position(self):
+        return self.revolution * TURN + self.angle
+
+
+class ReportReply(Reply):
+    """
+    Message sent without request, e.g. 'MCC0' when a movement is completed.
+    """
+
+
+_REPLY_TYPES = {'P': PositionReply,
+                'A': AngleReply,
+                Report.COMPLETED: ReportReply,
+                Report.TRIGGERED: ReportReply}
+
+
+def parse_reply(ans):
+    """
+    Parse an answer into a typed reply: Ack, ErrorReply, PositionReply,
+    AngleReply, ReportReply or a generic Reply.
+
+    :param ans: answer without the frame characters (a Reply is returned
+    as it is).
+    :return: Reply instance.
+    """
+    if isinstance(ans, Reply):
+        return ans
+    code = error_code(ans)
+    if code is not None:
+        return ErrorReply(ans) if code else Ack(ans)
+    i = 0
+    while i < len(ans) and ans[i].isalpha():
+        i += 1
+    return _REPLY_TYPES.get(ans[:i], Reply)(ans)
+
+
+class FrameDecoder(object):
+    """
+    Split a received byte stream in messages. The bytes are kept in a
+    persistent buffer: a message split in several reads or several messages
+    in one read are handled, and the bytes after the last new line are kept
+    for the next message. The data is either fed (feed) or read directly
+    into the free space of the buffer (buffer and advance), e.g. with
+    socket.recv_into.
+
+    :param size: initial size of the buffer, it grows for longer messages.
+    """
+    def __init__(self, size=4096):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def feed(self, data):
+        """
+        :param data: bytes received.
+        :return: None
+        """
+        n = len(data)
+        while len(self._buf) - self._end < n:
+            self._compact()
+        self._buf[self._end:self._end + n] = data
+        self._end += n
+
+    def buffer(self):
+        """
+        :return: writable memoryview of the free space of the buffer.
+        Call advance with the number of bytes written into it.
+        """
+        if self._end == len(self._buf):
+            self._compact()
+        return self._view[self._end:]
+
+    def advance(self, n):
+        """
+        :param n: number of bytes written into the view returned by buffer.
+        :return: None
+        """
+        self._end += n
+
+    def clear(self):
+        """
+        Discard the data buffered.
+
+        :return: None
+        """
+        self._start = self._end = 0
+
+    def next_line(self):
+        """
+        :return: next message with its frame characters, e.g. ':P0,1000\\n',
+        or None if there is no complete message.
+        """
+        idx = self._buf.find(b'\n', self._start, self._end)
+        if idx < 0:
+            return None
+        line = to_str(bytes(self._buf[self._start:idx + 1]))
+        self._start = idx + 1
+        if self._start == self._end:
+            self._start = self._end = 0
+        return line
+
+    def next_answer(self):
+        """
+        :return: next message without the frame characters, or None if
+        there is no complete message. The empty lines are skipped.
+        """
+        while True:
+            line = self.next_line()
+            if line is None:
+                return None
+            ans = unframe(line)
+            if ans:
+                return ans
+
+    def next_reply(self):
+        """
+        :return: next message parsed with parse_reply, or None if there is
+        no complete message.
+        """
+        ans = self.next_answer()
+        return None if ans is None else parse_reply(ans)
+
+    def _compact(self):
+        # Move the incomplete message to the beginning of the buffer or grow
+        # it when the message does not fit (e.g. long capture buffers).
+        size = self._end - self._start
+        if self._start == 0:
+            self._buf = self._buf + bytearray(len(self._buf))
+            self._view = memoryview(self._buf)
+        else:
+            self._buf[:size] = self._buf[self._start:self._end]
+        self._start = 0
+        self._end = size
@@ -0,0 +1,461 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Proxy daemon sharing the connection with a controller, which accepts only
+one TCP client, among many clients. The clients connect to the proxy through
+TCP or a Unix socket and use the same ASCII protocol as with the controller,
+e.g. with CommType.Socket.
+
+The proxy keeps the controller in synchronous communication mode and
+emulates the mode selected by each client. The identical queries of several
+clients in flight at the same time are sent once (see IOThread), the recent
+positions and states are served from a cache, and the stop commands skip
+the commands queued by the other clients. The reports of the controller are
+sent to all the clients.
+
+Run it with:
+
+    python -m smaract.proxy --controller <ip_address> --port 5000
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+from collections import deque
+
+from .constants import CommunicationMode, Report
+from .communication import SmaractCommunication, CommType, PendingAnswer, \
+    PendingReport
+from .protocol import split_cmd, split_answer, answer_key, error_code, \
+    frame, to_bytes, to_str
+
+
+class ProxySession(object):
+    """
+    Connection of one client to the proxy. It frames the received data in
+    commands, sends them through the proxy and writes the framed answers in
+    the order of the commands with the given function.
+
+    :param proxy: SmaractProxy instance.
+    :param write: function called with the framed answers.
+    :param close: function called when the controller fails to answer.
+    """
+    def __init__(self, proxy, write, close):
+        self.proxy = proxy
+        # Communication mode of the client
+        self.mode = CommunicationMode.SYNC
+        self._write = write
+        self._close = close
+        self._lock = threading.Lock()
+        self._buf = ''
+        # (PendingAnswer, mode of the client when the command was received)
+        self._pendings = deque()
+
+    def feed(self, data):
+        """
+        Process the received data. Incomplete commands are kept until the
+        rest of the data is received.
+        """
+        self._buf += data
+        if '\n' not in self._buf:
+            return
+        lines = self._buf.split('\n')
+        self._buf = lines.pop()
+        entries = []
+        upstream = []
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(':'):
+                continue
+            cmd = line[1:]
+            name = split_cmd(cmd)[0]
+            if name not in ('SCM', 'GCM'):
+                upstream.append((len(entries), cmd))
+                entries.append([None, self.mode])
+                continue
+            # The communication mode commands are answered by the proxy
+            pending = PendingAnswer(cmd)
+            entries.append([pending, self.mode])
+            pending.set_answer(self._set_mode(cmd) if name == 'SCM'
+                               else 'CM%d' % self.mode)
+        sent = self.proxy.submit([cmd for _, cmd in upstream])
+        for (i, _), pending in zip(upstream, sent):
+            entries[i][0] = pending
+        with self._lock:
+            self._pendings.extend([tuple(entry) for entry in entries])
+        for pending, _ in entries:
+            pending.add_done_callback(self._flush)
+
+    def report(self, ans):
+        """
+        Send a report of the controller to the client.
+
+        :param ans: report without the frame characters.
+        :return: None
+        """
+        with self._lock:
+            self._write(frame(ans))
+
+    def _set_mode(self, cmd):
+        previous = self.mode
+        try:
+            mode = int(cmd[3:])
+        except ValueError:
+            mode = None
+        if mode not in (CommunicationMode.SYNC, CommunicationMode.ASYNC):
+            return 'E-1,7'
+        self.mode = mode
+        # The acknowledge depends on the mode when the command is received
+        return None if previous == CommunicationMode.ASYNC else 'E-1,0'
+
+    def _flush(self, _=None):
+        with self._lock:
+            data = []
+            while self._pendings and self._pendings[0][0].done():
+                pending, mode = self._pendings.popleft()
+                try:
+                    ans = pending.result(0)
+                except RuntimeError:
+                    self._pendings.clear()
+                    self._close()
+                    return
+                if ans is None:
+                    continue
+                if mode == CommunicationMode.ASYNC and \
+                        answer_key(pending.cmd) is None and \
+                        error_code(ans) == 0:
+                    continue
+                data.append(frame(ans))
+            if data:
+                self._write(''.join(data))
+
+
+class SmaractProxy(object):
+    """
+    Proxy daemon which owns the connection with a controller and serves
+    many clients through TCP and/or a Unix socket.
+
+    :param comm: SmaractCommunication with the controller.
+    :param host: TCP listening address.
+    :param port: TCP listening port (0 selects a free port, None disables
+    the TCP server).
+    :param unix_path: path of the listening Unix socket (None disables it).
+    :param cache_ttl: time to live (s) of the cached answers, by query
+    (default CACHE_TTL). Any other command for the channel invalidates its
+    cached answers.
+    """
+    CACHE_TTL = {'GP': 0.02, 'GA': 0.02, 'GS': 0.02}
+
+    def __init__(self, comm, host='127.0.0.1', port=0, unix_path=None,
+                 cache_ttl=None):
+        self._comm = comm
+        if cache_ttl is None:
+            cache_ttl = self.CACHE_TTL
+        self.cache_ttl = dict(cache_ttl)
+        # command -> (expiration time, answer)
+        self._cache = {}
+        self._cache_generation = 0
+        self._cache_lock = threading.Lock()
+        self.stats = {'requests': 0, 'cached': 0}
+        self.sessions = []
+        self._clients = []
+        self._servers = []
+        self._running = False
+        self.host = self.port = self.unix_path = None
+        if port is not None:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen(16)
+            self.host, self.port = server.getsockname()
+            self._servers.append(server)
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(unix_path)
+            server.listen(16)
+            self.unix_path = unix_path
+            self._servers.append(server)
+        comm.add_listener(self._report)
+        # The controller must answer every command
+        comm.send_cmd('SCM%d' % CommunicationMode.SYNC)
+        # The reports awaited by the clients are read even if no command is
+        # in flight (never done, it is failed when the proxy is closed)
+        self._reports = PendingReport('', comm)
+
+    @property
+    def coalesced(self):
+        """
+        :return: number of queries which shared the answer of an identical
+        query in flight.
+        """
+        return self._comm._io.coalesced
+
+    def start(self):
+        self._running = True
+        for server in self._servers:
+            thread = threading.Thread(target=self._serve, args=(server,),
+                                      name='SmaractProxy')
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop serving the clients and close the connection with the
+        controller.
+
+        :return: None
+        """
+        self._running = False
+        for server in self._servers:
+            server.close()
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.remove(self.unix_path)
+        for client in list(self._clients):
+            self._shutdown(client)
+        self._comm.close()
+        self._comm._io.join(1.0)
+
+    def submit(self, cmds):
+        """
+        Send commands to the controller, or get their answers from the
+        cache.
+
+        :param cmds: list of commands without the frame characters.
+        :return: list of PendingAnswer.
+        """
+        pendings = [None] * len(cmds)
+        sent = []
+        now = time.time()
+        with self._cache_lock:
+            self.stats['requests'] += len(cmds)
+            for i, cmd in enumerate(cmds):
+                if not cmd.startswith('G'):
+                    self._invalidate(split_cmd(cmd)[1])
+                entry = self._cache.get(cmd)
+                if entry is not None and entry[0] > now:
+                    pendings[i] = PendingAnswer(cmd)
+                    pendings[i].set_answer(entry[1])
+                    self.stats['cached'] += 1
+                else:
+                    sent.append(i)
+            generation = self._cache_generation
+        if not sent:
+            return pendings
+        answers = self._comm.send_cmds_async([cmds[i] for i in sent])
+        for i, pending in zip(sent, answers):
+            pendings[i] = pending
+            ttl = self.cache_ttl.get(split_cmd(cmds[i])[0])
+            if ttl:
+                pending.add_done_callback(
+                    lambda p, ttl=ttl: self._store(p, ttl, generation))
+        return pendings
+
+    def _store(self, pending, ttl, generation):
+        try:
+            ans = pending.result(0)
+        except RuntimeError:
+            return
+        if ans.startswith('E'):
+            return
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                self._cache[pending.cmd] = (time.time() + ttl, ans)
+
+    def _invalidate(self, channel=None):
+        self._cache_generation += 1
+        if channel is None:
+            self._cache.clear()
+            return
+        for cmd in list(self._cache):
+            if split_cmd(cmd)[1] == channel:
+                del self._cache[cmd]
+
+    def _report(self, ans):
+        code, channel = split_answer(ans)
+        if code in (Report.COMPLETED, Report.TRIGGERED):
+            with self._cache_lock:
+                self._invalidate(channel)
+        for session in list(self.sessions):
+            session.report(ans)
+
+    def _serve(self, server):
+        while self._running:
+            try:
+                client, _ = server.accept()
+            except socket.error:
+                return
+            if client.family == socket.AF_INET:
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._clients.append(client)
+            thread = threading.Thread(target=self._serve_client,
+                                      args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve_client(self, client):
+        def write(data):
+            try:
+                client.sendall(to_bytes(data))
+            except socket.error:
+                pass
+        session = ProxySession(self, write, lambda: self._shutdown(client))
+        self.sessions.append(session)
+        try:
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                session.feed(to_str(data))
+        except socket.error:
+            pass
+        finally:
+            if session in self.sessions:
+                self.sessions.remove(session)
+            if client in self._clients:
+                self._clients.remove(client)
+            client.close()
+
+    def _shutdown(self, client):
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+def load_test(host, port, nclients, duration, channels):
+    """
+    Simulate many clients polling the position and state of the given
+    channels through the proxy.
+
+    :param host: proxy address, or path of its Unix socket.
+    :param port: proxy TCP port.
+    :param nclients: number of clients, each one in its own thread.
+    :param duration: test duration (s).
+    :param channels: list of channel indexes.
+    :return: (number of requests, list of exchange latencies in s)
+    """
+    cmds = ['GP%d' % ch for ch in channels] + ['GS%d' % ch for ch in channels]
+    latencies = []
+    errors = []
+    end = time.time() + duration
+
+    def poll():
+        try:
+            comm = SmaractCommunication(CommType.Socket, host, port)
+        except RuntimeError as e:
+            errors.append(e)
+            return
+        try:
+            while time.time() < end:
+                t = time.time()
+                comm.send_cmds(cmds)
+                latencies.append(time.time() - t)
+        except RuntimeError as e:
+            errors.append(e)
+        finally:
+            comm.close()
+    threads = [threading.Thread(target=poll) for _ in range(nclients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError('%d clients failed: %s' % (len(errors), errors[0]))
+    return len(latencies) * len(cmds), latencies
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Smaract controller proxy')
+    parser.add_argument('--controller', type=str,
+                        help='controller address')
+    parser.add_argument('--controller-port', default=5000, type=int)
+    parser.add_argument('--simulate', default=0, type=int,
+                        help='use a simulated controller with this number '
+                             'of channels')
+    parser.add_argument('--latency', default=0.001, type=float,
+                        help='simulated controller answer latency (s)')
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', default=5000, type=int,
+                        help='TCP port (0 disables the TCP server)')
+    parser.add_argument('--unix', type=str, help='Unix socket path')
+    parser.add_argument('--cache-ttl', action='append', default=[],
+                        metavar='QUERY=TTL',
+                        help='e.g. GP=0.05, 0 disables the cache of a query')
+    parser.add_argument('--load-test', default=0, type=int, metavar='CLIENTS',
+                        help='run this number of polling clients and print '
+                             'the statistics')
+    parser.add_argument('--duration', default=5.0, type=float,
+                        help='load test duration (s)')
+    args = parser.parse_args()
+
+    if args.simulate:
+        from .simulator import SmaractSimulator
+        simulator = SmaractSimulator(args.simulate, latency=args.latency)
+        comm = SmaractCommunication(CommType.Simulator, simulator)
+        nchannels = args.simulate
+    elif args.controller:
+        comm = SmaractCommunication(CommType.Socket, args.controller,
+                                    args.controller_port)
+        nchannels = int(comm.send_cmd('GNC')[1:])
+    else:
+        parser.error('Either --controller or --simulate is required')
+    cache_ttl = dict(SmaractProxy.CACHE_TTL)
+    for item in args.cache_ttl:
+        query, ttl = item.split('=')
+        cache_ttl[query] = float(ttl)
+    proxy = SmaractProxy(comm, args.host, args.port or None, args.unix,
+                         cache_ttl).start()
+    if proxy.port:
+        print('Proxy listening on %s:%d' % (proxy.host, proxy.port))
+    if proxy.unix_path:
+        print('Proxy listening on %s' % proxy.unix_path)
+    sys.stdout.flush()
+    try:
+        if args.load_test:
+            host, port = (proxy.host, proxy.port) if proxy.port else \
+                (proxy.unix_path, 0)
+            nrequests, latencies = load_test(host, port, args.load_test,
+                                             args.duration,
+                                             range(nchannels))
+            latencies.sort()
+            coalesced = proxy.coalesced
+            upstream = nrequests - proxy.stats['cached'] - coalesced
+            print('clients:           %d' % args.load_test)
+            print('requests:          %d (%.0f/s)' %
+                  (nrequests, nrequests / args.duration))
+            print('served from cache: %d' % proxy.stats['cached'])
+            print('coalesced:         %d' % coalesced)
+            print('sent upstream:     %d (%.0f/s)' %
+                  (upstream, upstream / args.duration))
+            print('exchange latency:  p50 %.2f ms, p99 %.2f ms' %
+                  (latencies[len(latencies) // 2] * 1e3,
+                   latencies[int(len(latencies) * 0.99)] * 1e3))
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.close()
+
+
+if __name__ == '__main__':
+    main()
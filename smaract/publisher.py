@@ -0,0 +1,225 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Publication of the positions and states of the axes of a controller in a
+memory-mapped file (e.g. in /dev/shm), so that any number of local
+processes read them without any request to the controller.
+
+The file holds a header and a ring of records, each one with the time, the
+position and the state of all the channels. Each record is protected by a
+sequence lock: its sequence number is odd while it is written, so the
+readers detect and retry the torn reads without taking any lock.
+"""
+
+import time
+import threading
+
+MAGIC = b'SMARACT1'
+
+# Records are aligned to the cache line size
+_ALIGNMENT = 64
+
+
+def _header_dtype():
+    import numpy
+    return numpy.dtype([('magic', 'S8'), ('nchannels', '<u4'),
+                        ('size', '<u4'), ('head', '<u8')])
+
+
+def _record_dtype(nchannels):
+    import numpy
+    return numpy.dtype([('seq', '<u8'), ('timestamp', '<f8'),
+                        ('position', '<f8', (nchannels,)),
+                        ('state', '<i4', (nchannels,))])
+
+
+def _records_offset():
+    size = _header_dtype().itemsize
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class PositionPublisher(object):
+    """
+    Poll the position and state of all the axes of a controller at a fixed
+    rate, with one snapshot per poll, and publish them in a memory-mapped
+    file. The positions which can not be read are published as NaN and the
+    states as -1.
+
+    :param ctrl: SmaractMCSController instance.
+    :param path: file path, e.g. /dev/shm/smaract (created or overwritten).
+    :param rate: polls per second.
+    :param size: number of records kept in the ring.
+    """
+    def __init__(self, ctrl, path, rate=100.0, size=1024):
+        import numpy
+
+        self.ctrl = ctrl
+        self.path = path
+        self.rate = rate
+        self.size = size
+        nchannels = len(ctrl)
+        offset = _records_offset()
+        record = _record_dtype(nchannels)
+        with open(path, 'wb') as f:
+            f.truncate(offset + record.itemsize * size)
+        self._header = numpy.memmap(path, _header_dtype(), 'r+', 0, (1,))
+        self._ring = numpy.memmap(path, record, 'r+', offset, (size,))
+        self._header['nchannels'] = nchannels
+        self._header['size'] = size
+        self._header['head'] = 0
+        # Written last: the readers check it to know the file is ready
+        self._header['magic'] = MAGIC
+        self._head = 0
+        self._running = False
+        self._thread = None
+
+    def publish(self):
+        """
+        Read the positions and states and publish them as a new record.
+
+        :return: None
+        """
+        snap = self.ctrl.snapshot(('position', 'state'), raise_errors=False)
+        timestamp = time.time()
+        seq = 2 * self._head
+        i = self._head % self.size
+        ring = self._ring
+        ring['seq'][i] = seq + 1
+        ring['timestamp'][i] = timestamp
+        ring['position'][i] = snap['position']
+        ring['state'][i] = snap['state']
+        ring['seq'][i] = seq + 2
+        self._head += 1
+        self._header['head'] = self._head
+
+    def start(self):
+        """
+        Start publishing from a thread at the configured rate.
+
+        :return: self
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='PositionPublisher')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop publishing. The file is kept with the last records.
+
+        :return: None
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._ring.flush()
+
+    def _run(self):
+        period = 1.0 / self.rate
+        next_poll = time.time()
+        while self._running:
+            try:
+                self.publish()
+            except RuntimeError:
+                # e.g. a communication timeout, the next poll retries
+                pass
+            next_poll += period
+            delay = next_poll - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_poll = time.time()
+
+
+class PositionReader(object):
+    """
+    Reader of the positions and states published by a PositionPublisher,
+    possibly from another process. The file is mapped read-only and the
+    reads take no lock and send nothing to the controller.
+
+    :param path: file path given to the PositionPublisher.
+    """
+    # Attempts to read a record while it is overwritten
+    RETRIES = 100
+
+    def __init__(self, path):
+        import numpy
+
+        header = numpy.memmap(path, _header_dtype(), 'r', 0, (1,))
+        if header['magic'][0] != MAGIC:
+            raise RuntimeError('%s is not a position publisher file' % path)
+        self.path = path
+        self.nchannels = int(header['nchannels'][0])
+        self.size = int(header['size'][0])
+        self._header = header
+        self._ring = numpy.memmap(path, _record_dtype(self.nchannels), 'r',
+                                  _records_offset(), (self.size,))
+
+    @property
+    def count(self):
+        """
+        :return: number of records published.
+        """
+        return int(self._header['head'][0])
+
+    def latest(self):
+        """
+        Get the last record published.
+
+        :return: (timestamp, positions, states), the positions and states
+        are NumPy arrays with one item per channel, or None if nothing is
+        published yet.
+        """
+        for _ in range(self.RETRIES):
+            head = self.count
+            if head == 0:
+                return None
+            record = self._read(head - 1)
+            if record is not None:
+                return (float(record['timestamp']), record['position'],
+                        record['state'])
+        raise RuntimeError('Failed to read a consistent record')
+
+    def history(self, n):
+        """
+        Get the last records published (at most the ring size).
+
+        :param n: number of records.
+        :return: NumPy structured array with the fields 'timestamp',
+        'position' and 'state', oldest first. The records overwritten while
+        they are read are skipped.
+        """
+        head = self.count
+        first = max(0, head - min(n, self.size))
+        records = [self._read(k) for k in range(first, head)]
+        records = [r for r in records if r is not None]
+        import numpy
+        result = numpy.array(records, dtype=self._ring.dtype)
+        return result[['timestamp', 'position', 'state']]
+
+    def _read(self, k):
+        # Copy the k-th record published. The sequence number must be the
+        # same, and even, before and after the copy; it identifies the
+        # record, so a slot reused by a newer record is detected too.
+        i = k % self.size
+        seq = 2 * k + 2
+        if self._ring['seq'][i] != seq:
+            return None
+        record = self._ring[i].copy()
+        if self._ring['seq'][i] != seq:
+            return None
+        return record
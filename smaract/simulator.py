@@ -0,0 +1,1105 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+Simulator of the Smaract MCS/SDC ASCII programming interface. It allows to
+test and benchmark the library without hardware. The simulated controller can
+be accessed through a TCP server (SimulatorServer), a pseudo-terminal serial
+pair (SimulatorPty) or in-process (CommType.Simulator). SimulatorDeviceProxy
+stands for the DeviceProxy of a Tango Serial device (CommType.SerialTango).
+
+Example:
+
+    python -m smaract.simulator --port 5000 --channels 9
+"""
+
+import os
+import sys
+import math
+import time
+import select
+import socket
+import threading
+from collections import deque
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from .constants import *
+from .communication import comm_error_handler
+from .protocol import split_cmd, to_bytes, to_str, frame, frame_cmds
+from .controller import SmaractBaseController
+
+
+# Sensor code used by default: linear positioner (S)
+DEFAULT_SENSOR_TYPE = 1
+
+# Commands which start a movement. They can be loaded into the command queue
+# after an ATC command.
+MOVEMENT_COMMANDS = ['MPA', 'MPR', 'MAA', 'MAR', 'MST', 'MSCA', 'MSCR', 'FRM',
+                     'CS']
+
+
+class SimulatorError(Exception):
+    """
+    Error reported by the simulated controller as :E<channel>,<code>
+    """
+    def __init__(self, code):
+        Exception.__init__(self, code)
+        self.code = code
+
+
+class Kinematics(object):
+    """
+    Motion parameters of the simulated positioners.
+
+    :param max_speed: speed used when the closed-loop speed is disabled
+    (nm/s or udeg/s).
+    :param speed: initial closed-loop speed, 0 disables it (nm/s or udeg/s).
+    :param acceleration: initial closed-loop acceleration, 0 disables it
+    (um/s^2 or mdeg/s^2).
+    :param step_size: displacement of one step at maximum amplitude (nm or
+    udeg).
+    :param calibration_time: duration of the sensor calibration (s).
+    :param time_scale: simulated seconds per real second.
+    """
+    def __init__(self, max_speed=1e7, speed=0, acceleration=0, step_size=100,
+                 calibration_time=0.1, time_scale=1.0):
+        self.max_speed = max_speed
+        self.speed = speed
+        self.acceleration = acceleration
+        self.step_size = step_size
+        self.calibration_time = calibration_time
+        self.time_scale = time_scale
+
+
+class Motion(object):
+    """
+    Trapezoidal motion profile from start to target.
+
+    :param t0: simulated start time (s).
+    :param start: start position.
+    :param target: target position.
+    :param speed: speed (units/s).
+    :param acc: acceleration (units/s^2), 0 means infinite.
+    :param state: channel state during the motion.
+    :param duration: minimum duration (s) e.g. for calibration.
+    :param hold_time: time to hold the target (ms), 60000 means forever.
+    """
+    def __init__(self, t0, start, target, speed, acc=0, state=Status.TARGETING,
+                 duration=0, hold_time=0):
+        self.t0 = t0
+        self.start = start
+        self.target = target
+        self.state = state
+        self.hold_time = hold_time
+        self.distance = abs(target - start)
+        self.direction = 1 if target >= start else -1
+        self.speed = float(speed)
+        self.acc = float(acc)
+        if self.distance == 0:
+            self.t_acc = 0
+            self.duration = 0
+        elif self.acc <= 0:
+            self.t_acc = 0
+            self.duration = self.distance / self.speed
+        else:
+            self.t_acc = self.speed / self.acc
+            d_acc = self.speed * self.t_acc / 2
+            if 2 * d_acc >= self.distance:
+                self.t_acc = math.sqrt(self.distance / self.acc)
+                self.duration = 2 * self.t_acc
+            else:
+                self.duration = (2 * self.t_acc +
+                                 (self.distance - 2 * d_acc) / self.speed)
+        self.duration = max(self.duration, duration)
+
+    @property
+    def end_time(self):
+        return self.t0 + self.duration
+
+    def position(self, t):
+        """
+        Position at the simulated time t.
+        """
+        dt = t - self.t0
+        if dt >= self.duration or self.distance == 0:
+            return self.target
+        if self.acc <= 0:
+            travel = self.speed * dt
+        elif dt < self.t_acc:
+            travel = self.acc * dt * dt / 2
+        elif dt > self.duration - self.t_acc:
+            rem = self.duration - dt
+            travel = self.distance - self.acc * rem * rem / 2
+        else:
+            travel = (self.acc * self.t_acc * self.t_acc / 2 +
+                      self.speed * (dt - self.t_acc))
+        return self.start + self.direction * min(travel, self.distance)
+
+    def state_at(self, t):
+        """
+        Channel state at the simulated time t.
+        """
+        if t < self.end_time:
+            return self.state
+        if self.state == Status.TARGETING and self.hold_time:
+            if self.hold_time >= MAX_HOLD_TIME or \
+                    t < self.end_time + self.hold_time / 1000.:
+                return Status.HOLDING
+        return Status.STOPPED
+
+
+class SimulatedChannel(object):
+    """
+    Simulated positioner channel. The positions are in nm for linear sensors
+    and in udeg for rotary sensors.
+    """
+    def __init__(self, simulator, index, sensor_type=DEFAULT_SENSOR_TYPE,
+                 kinematics=None):
+        self.simulator = simulator
+        self.index = index
+        self.sensor_type = sensor_type
+        self.kinematics = kinematics or Kinematics()
+        self.channel_type = ChannelType.POSITIONER
+        self.speed = self.kinematics.speed
+        self.acceleration = self.kinematics.acceleration
+        self.max_frequency = MAX_FREQUENCY
+        self.safe_direction = Direction.FORWARD
+        self.physical_position_known = 0
+        self.reference_position = 0
+        self.limits = [0, 0]
+        self.scale = [0, 0]
+        self.accumulate_rel_pos = 0
+        self.report_on_complete = 0
+        self.report_on_triggered = 0
+        self.step_while_scan = 0
+        self.end_effector = [0, 0, 0]
+        self.serial_number = '0x%08X' % (0x1F000000 + index)
+        self.firmware_version = [1, 2, 3, 4, 1, 5, 6, 7]
+        self.feature_permissions = [0xFF, 0x0F]
+        self.properties = {ChannelProperties.EmergencyStop: 0,
+                           ChannelProperties.EmergencyStopDefault: 0,
+                           ChannelProperties.LowVibration: 0,
+                           ChannelProperties.BroadcastStop: 0,
+                           ChannelProperties.PositionControl: 1,
+                           ChannelProperties.SensorPowerSupply: 1,
+                           ChannelProperties.SensorScaleOffset: 0,
+                           ChannelProperties.SensorScaleInverted: 0,
+                           ChannelProperties.DigitalIn: 0,
+                           ChannelProperties.DigitalInEdge: 0,
+                           ChannelProperties.CounterTriggerSource: 0,
+                           ChannelProperties.Counter: 0,
+                           ChannelProperties.CaptureBuffer: 0,
+                           ChannelProperties.QueueCapacity: 16}
+        self.capture_buffer = []
+        self.queue = deque()
+        self._trigger_source = None
+        self._position = 0
+        self._motion = None
+        self._completion = None
+        # SDC configuration tables
+        self.tables = [[0] * 8 for _ in range(3)]
+        self.errors = deque()
+
+    @property
+    def is_rotary(self):
+        return self.sensor_type in SmaractBaseController.ROTARY_SENSORS
+
+    def position(self):
+        t = self.simulator.now()
+        if self._motion is not None:
+            return self._motion.position(t)
+        return self._position
+
+    def state(self):
+        if self._motion is not None:
+            return self._motion.state_at(self.simulator.now())
+        return Status.STOPPED
+
+    def start_motion(self, target, state=Status.TARGETING, speed=None,
+                     acc=None, duration=0, hold_time=0):
+        """
+        Start a movement from the current position to the target.
+        """
+        low, high = self.limits
+        if low < high:
+            target = min(max(target, low), high)
+        if speed is None:
+            speed = self.speed or self.kinematics.max_speed
+        if acc is None:
+            acc = self.acceleration * 1000.
+        now = self.simulator.now()
+        start = self.position()
+        self._cancel_completion()
+        self._position = start
+        self._motion = Motion(now, start, target, speed, acc, state,
+                              duration, hold_time)
+        if self.report_on_complete:
+            real_delay = (self._motion.duration /
+                          self.kinematics.time_scale)
+            self._completion = threading.Timer(real_delay, self._complete,
+                                               (self._motion,))
+            self._completion.daemon = True
+            self._completion.start()
+
+    def stop(self):
+        # A stopped movement is reported as completed too
+        interrupted = self._completion is not None
+        self._position = self.position()
+        self._motion = None
+        self._cancel_completion()
+        if interrupted:
+            self.simulator.report('%s%d' % (Report.COMPLETED, self.index))
+
+    def set_position(self, position):
+        self.stop()
+        self._position = position
+
+    def capture(self):
+        """
+        Store the current position in the capture buffer and increase the
+        counter, as done by the controller on a trigger event.
+        """
+        self.capture_buffer.append(int(self.position()))
+        self.properties[ChannelProperties.Counter] += 1
+
+    def _cancel_completion(self):
+        if self._completion is not None:
+            self._completion.cancel()
+            self._completion = None
+
+    def _complete(self, motion):
+        if motion is self._motion:
+            self._completion = None
+            self.simulator.report('%s%d' % (Report.COMPLETED, self.index))
+
+
+class SmaractSimulator(object):
+    """
+    Simulated Smaract MCS/SDC controller. It processes the ASCII commands
+    (without frame characters) and returns the answers. The answers of the
+    commands which do not return a value depend on the communication mode:
+    they are acknowledged only in synchronous mode.
+
+    :param nchannels: number of channels.
+    :param sensor_types: sensor code of each channel (default linear).
+    :param kinematics: Kinematics instance shared by all the channels.
+    :param latency: time (s) spent by the controller to answer a request.
+    :param system_id: controller ID returned by GSI.
+    """
+    def __init__(self, nchannels=3, sensor_types=None, kinematics=None,
+                 latency=0.0, system_id=3118000000):
+        self.kinematics = kinematics or Kinematics()
+        if sensor_types is None:
+            sensor_types = [DEFAULT_SENSOR_TYPE] * nchannels
+        if len(sensor_types) != nchannels:
+            raise ValueError('One sensor type per channel is required')
+        self.channels = [SimulatedChannel(self, i, s, self.kinematics)
+                         for i, s in enumerate(sensor_types)]
+        self.latency = latency
+        self.system_id = system_id
+        self.interface_version = [1, 3, 0]
+        self.communication_mode = CommunicationMode.SYNC
+        self.hcm_mode = HandControlModuleMode.ENABLED
+        self.sensor_mode = SensorMode.ENABLED
+        self.baudrate = MIN_BAUDRATE
+        self.keep_alive = 0
+        self.sessions = []
+        self.lock = threading.RLock()
+        self._t0 = time.time()
+        # Time of the controller cycle being processed, if frozen
+        self._cycle = None
+
+    def now(self):
+        """
+        Simulated time in seconds.
+        """
+        if self._cycle is not None:
+            return self._cycle
+        return (time.time() - self._t0) * self.kinematics.time_scale
+
+    def report(self, msg):
+        """
+        Send a message without request to all the connected sessions.
+        """
+        for session in list(self.sessions):
+            session.write(msg)
+
+    def process(self, cmd):
+        """
+        Process one command.
+
+        :param cmd: command without the frame characters, e.g. 'GP0'.
+        :return: list of answers without the frame characters.
+        """
+        name, channel = split_cmd(cmd)
+        idx = len(name)
+        if channel is not None:
+            idx += len(str(channel))
+        args = [_to_int(x) for x in cmd[idx:].split(',') if x != '']
+        with self.lock:
+            mode = self.communication_mode
+            try:
+                handler = getattr(self, '_cmd_%s' % name, None)
+                if handler is None or not name:
+                    raise SimulatorError(2)
+                if channel is None:
+                    ans = handler(*args)
+                else:
+                    if channel >= len(self.channels):
+                        raise SimulatorError(7)
+                    ch = self.channels[channel]
+                    if ch._trigger_source is not None and \
+                            name in MOVEMENT_COMMANDS:
+                        ans = self._enqueue(ch, name, args)
+                    else:
+                        ans = handler(ch, *args)
+            except SimulatorError as e:
+                return ['E%d,%d' % (_err_channel(channel), e.code)]
+            except TypeError:
+                code = 5 if len(args) < 1 else 6
+                return ['E%d,%d' % (_err_channel(channel), code)]
+        if ans is not None:
+            return [ans]
+        if mode == CommunicationMode.SYNC:
+            return ['E%d,0' % _err_channel(channel)]
+        return []
+
+    def _enqueue(self, ch, name, args):
+        source, ch._trigger_source = ch._trigger_source, None
+        capacity = ch.properties[ChannelProperties.QueueCapacity]
+        if len(ch.queue) >= capacity:
+            raise SimulatorError(153)
+        ch.queue.append((source, name, args))
+
+    # Controller commands
+    # -------------------------------------------------------------------------
+    def _cmd_GIV(self):
+        return 'IV%s' % ','.join([str(v) for v in self.interface_version])
+
+    def _cmd_GNC(self):
+        return 'N%d' % len(self.channels)
+
+    def _cmd_GSI(self):
+        return 'ID%d' % self.system_id
+
+    def _cmd_GCM(self):
+        return 'CM%d' % self.communication_mode
+
+    def _cmd_SCM(self, mode):
+        if mode not in (CommunicationMode.SYNC, CommunicationMode.ASYNC):
+            raise SimulatorError(7)
+        # The acknowledge depends on the mode when the command is received
+        ans = None
+        if self.communication_mode == CommunicationMode.SYNC:
+            ans = 'E-1,0'
+        self.communication_mode = mode
+        return ans
+
+    def _cmd_R(self):
+        for ch in self.channels:
+            ch.stop()
+        self.communication_mode = CommunicationMode.SYNC
+        return 'E-1,0'
+
+    def _cmd_SHE(self, mode):
+        self.hcm_mode = mode
+
+    def _cmd_GSE(self):
+        return 'SE%d' % self.sensor_mode
+
+    def _cmd_SSE(self, mode):
+        if mode not in (0, 1, 2):
+            raise SimulatorError(7)
+        self.sensor_mode = mode
+
+    def _cmd_TC(self, code):
+        if self.communication_mode != CommunicationMode.ASYNC:
+            raise SimulatorError(8)
+        # The triggered commands are executed on the same controller cycle
+        self._cycle = self.now()
+        try:
+            for ch in self.channels:
+                if ch.queue and ch.queue[0][0] == code:
+                    source, name, args = ch.queue.popleft()
+                    getattr(self, '_cmd_%s' % name)(ch, *args)
+                    if ch.report_on_triggered:
+                        self.report('%s%d' % (Report.TRIGGERED, ch.index))
+        finally:
+            self._cycle = None
+
+    def _cmd_BR(self, baudrate):
+        if not (MIN_BAUDRATE <= baudrate <= MAX_BAUDRATE):
+            raise SimulatorError(7)
+        self.baudrate = baudrate
+        return 'BR%d' % baudrate
+
+    def _cmd_K(self, delay):
+        self.keep_alive = delay
+
+    # Channel configuration commands
+    # -------------------------------------------------------------------------
+    def _cmd_GCT(self, ch):
+        return 'CT%d,%d' % (ch.index, ch.channel_type)
+
+    def _cmd_GSD(self, ch):
+        return 'SD%d,%d' % (ch.index, ch.safe_direction)
+
+    def _cmd_SSD(self, ch, direction):
+        if direction not in (0, 1):
+            raise SimulatorError(7)
+        ch.safe_direction = direction
+
+    def _cmd_GST(self, ch):
+        return 'ST%d,%d' % (ch.index, ch.sensor_type)
+
+    def _cmd_SST(self, ch, sensor_type):
+        ch.sensor_type = sensor_type
+
+    def _cmd_GCLA(self, ch):
+        return 'CLA%d,%d' % (ch.index, ch.acceleration)
+
+    def _cmd_SCLA(self, ch, acceleration):
+        ch.acceleration = acceleration
+
+    def _cmd_GCLS(self, ch):
+        return 'CLS%d,%d' % (ch.index, ch.speed)
+
+    def _cmd_SCLS(self, ch, speed):
+        ch.speed = speed
+
+    def _cmd_SCLF(self, ch, frequency):
+        ch.max_frequency = frequency
+
+    def _cmd_GSC(self, ch):
+        return 'SC%d,%d,%d' % (ch.index, ch.scale[0], ch.scale[1])
+
+    def _cmd_SSC(self, ch, shift, inverted):
+        ch.scale = [shift, inverted]
+
+    def _cmd_GPL(self, ch):
+        self._check_linear(ch)
+        return 'PL%d,%d,%d' % (ch.index, ch.limits[0], ch.limits[1])
+
+    def _cmd_SPL(self, ch, min_pos, max_pos):
+        self._check_linear(ch)
+        ch.limits = [min_pos, max_pos]
+
+    def _cmd_GAL(self, ch):
+        self._check_rotary(ch)
+        values = []
+        for limit in ch.limits:
+            values.extend(_angle_rev(limit))
+        return 'AL%d,%d,%d,%d,%d' % tuple([ch.index] + values)
+
+    def _cmd_SAL(self, ch, min_angle, min_rev, max_angle, max_rev):
+        self._check_rotary(ch)
+        ch.limits = [min_rev * TURN + min_angle, max_rev * TURN + max_angle]
+
+    def _cmd_GCP(self, ch, key):
+        if key == ChannelProperties.QueueSize:
+            return 'CP%d,%d,%d' % (ch.index, key, len(ch.queue))
+        if key not in ch.properties:
+            raise SimulatorError(156)
+        return 'CP%d,%d,%d' % (ch.index, key, ch.properties[key])
+
+    def _cmd_SCP(self, ch, key, value):
+        if key not in ch.properties:
+            raise SimulatorError(156)
+        if key in (ChannelProperties.QueueSize,
+                   ChannelProperties.QueueCapacity):
+            raise SimulatorError(157)
+        ch.properties[key] = value
+
+    def _cmd_GEET(self, ch):
+        return 'EET%d,%d,%d,%d' % tuple([ch.index] + ch.end_effector)
+
+    def _cmd_SEET(self, ch, eff_type, p1, p2):
+        ch.end_effector = [eff_type, p1, p2]
+
+    def _cmd_SARP(self, ch, enable):
+        ch.accumulate_rel_pos = enable
+
+    def _cmd_SP(self, ch, position):
+        ch.set_position(position)
+
+    def _cmd_SRC(self, ch, enable):
+        ch.report_on_complete = enable
+
+    def _cmd_SRT(self, ch, enable):
+        ch.report_on_triggered = enable
+
+    def _cmd_SSW(self, ch, enable):
+        ch.step_while_scan = enable
+
+    def _cmd_SZF(self, ch):
+        pass
+
+    def _cmd_GSN(self, ch):
+        return 'SN%d,%s' % (ch.index, ch.serial_number)
+
+    def _cmd_GFV(self, ch):
+        return 'FV%d,%s' % (ch.index,
+                            ','.join([str(v) for v in ch.firmware_version]))
+
+    def _cmd_GFP(self, ch, byte_idx):
+        if byte_idx == 255:
+            value = len(ch.feature_permissions)
+        elif byte_idx < len(ch.feature_permissions):
+            value = ch.feature_permissions[byte_idx]
+        else:
+            raise SimulatorError(7)
+        return 'FP%d,%d,%d' % (ch.index, byte_idx, value)
+
+    # Movement commands
+    # -------------------------------------------------------------------------
+    def _cmd_CS(self, ch):
+        self._check_sensor()
+        ch.start_motion(ch.position(), Status.CALIBRATING,
+                        duration=self.kinematics.calibration_time)
+
+    def _cmd_FRM(self, ch, direction, hold_time=0, auto_zero=0):
+        # The reference mark is at the position 0, so the auto zero does
+        # not change the position reached.
+        self._check_sensor()
+        ch.start_motion(ch.reference_position, Status.HOMING,
+                        hold_time=hold_time)
+        ch.physical_position_known = 1
+
+    def _cmd_MST(self, ch, steps, amplitude, frequency):
+        if not steps or not (0 <= amplitude <= MAX_AMPLITUDE) or \
+                not (0 < frequency <= MAX_FREQUENCY):
+            raise SimulatorError(7)
+        step = self.kinematics.step_size * float(amplitude) / MAX_AMPLITUDE
+        ch.start_motion(ch.position() + steps * step, Status.STEPPING,
+                        speed=step * frequency or 1, acc=0)
+
+    def _cmd_S(self, ch):
+        ch.stop()
+        ch._trigger_source = None
+
+    def _cmd_MPA(self, ch, position, hold_time=0):
+        self._check_linear(ch)
+        self._check_sensor()
+        ch.start_motion(position, hold_time=hold_time)
+
+    def _cmd_MPR(self, ch, position, hold_time=0):
+        self._check_linear(ch)
+        self._check_sensor()
+        base = ch.position()
+        if ch.accumulate_rel_pos and ch._motion is not None:
+            base = ch._motion.target
+        ch.start_motion(base + position, hold_time=hold_time)
+
+    def _cmd_MAA(self, ch, angle, rev, hold_time=0):
+        self._check_rotary(ch)
+        self._check_sensor()
+        ch.start_motion(rev * TURN + angle, hold_time=hold_time)
+
+    def _cmd_MAR(self, ch, angle, rev, hold_time=0):
+        self._check_rotary(ch)
+        self._check_sensor()
+        ch.start_motion(ch.position() + rev * TURN + angle,
+                        hold_time=hold_time)
+
+    def _cmd_MSCA(self, ch, target, scan_speed):
+        ch.start_motion(ch.position(), Status.SCANNING,
+                        duration=float(target) / (scan_speed or 1))
+
+    def _cmd_MSCR(self, ch, target, scan_speed):
+        ch.start_motion(ch.position(), Status.SCANNING,
+                        duration=float(abs(target)) / (scan_speed or 1))
+
+    def _cmd_MGFA(self, ch, force, speed, hold_time=0):
+        pass
+
+    def _cmd_MGOA(self, ch, opening, speed):
+        pass
+
+    def _cmd_MGOR(self, ch, opening, speed):
+        pass
+
+    def _cmd_ATC(self, ch, trigger_source):
+        if self.communication_mode != CommunicationMode.ASYNC:
+            raise SimulatorError(8)
+        ch._trigger_source = trigger_source
+
+    def _cmd_CTCQ(self, ch):
+        ch.queue.clear()
+        ch._trigger_source = None
+
+    # Feedback commands
+    # -------------------------------------------------------------------------
+    def _cmd_GP(self, ch):
+        self._check_linear(ch)
+        self._check_sensor()
+        return 'P%d,%d' % (ch.index, round(ch.position()))
+
+    def _cmd_GA(self, ch):
+        self._check_rotary(ch)
+        self._check_sensor()
+        angle, rev = _angle_rev(ch.position())
+        return 'A%d,%d,%d' % (ch.index, angle, rev)
+
+    def _cmd_GS(self, ch):
+        return 'S%d,%d' % (ch.index, ch.state())
+
+    def _cmd_GPPK(self, ch):
+        return 'PPK%d,%d' % (ch.index, ch.physical_position_known)
+
+    def _cmd_GVL(self, ch):
+        level = MAX_AMPLITUDE / 2 if ch.state() != Status.STOPPED else 0
+        return 'VL%d,%d' % (ch.index, level)
+
+    def _cmd_GF(self, ch):
+        return 'F%d,0' % ch.index
+
+    def _cmd_GGO(self, ch):
+        return 'GO%d,0' % ch.index
+
+    def _cmd_GB(self, ch, buffer_idx):
+        data, ch.capture_buffer = ch.capture_buffer, []
+        return 'B%d,%d%s' % (ch.index, buffer_idx,
+                             ''.join([',%d' % v for v in data]))
+
+    # SDC commands
+    # -------------------------------------------------------------------------
+    def _cmd_GTP(self, ch):
+        return 'TP%d,%d' % (ch.index, round(ch.position()))
+
+    def _cmd_GES(self, ch):
+        err = ch.errors.popleft() if ch.errors else 0
+        return 'ES%d,%d,%d' % (ch.index, err, len(ch.errors))
+
+    def _cmd_GTE(self, ch, table, row):
+        if not (0 <= table <= 2) or not (0 <= row <= 7):
+            raise SimulatorError(7)
+        return 'TE%d,%d,%d,%d' % (ch.index, table, row, ch.tables[table][row])
+
+    def _cmd_STE(self, ch, table, row, value):
+        if not (0 <= table <= 2) or not (0 <= row <= 7):
+            raise SimulatorError(7)
+        ch.tables[table][row] = value
+
+    # Checks
+    # -------------------------------------------------------------------------
+    def _check_linear(self, ch):
+        if ch.is_rotary:
+            raise SimulatorError(143)
+
+    def _check_rotary(self, ch):
+        if not ch.is_rotary:
+            raise SimulatorError(143)
+
+    def _check_sensor(self):
+        if self.sensor_mode == SensorMode.DISABLED:
+            raise SimulatorError(140)
+
+
+class SimulatorSession(object):
+    """
+    Connection of one client to the simulator. It frames the received data
+    in commands and writes the framed answers with the given function.
+
+    :param simulator: SmaractSimulator instance.
+    :param write: function called with the framed answers.
+    :param sleep: wait the simulator latency before answering. Otherwise
+    the write function is responsible of delaying the answers.
+    """
+    def __init__(self, simulator, write, sleep=True):
+        self.simulator = simulator
+        self.sleep = sleep
+        self._write = write
+        self._lock = threading.Lock()
+        self._buf = ''
+        # Answers of the commands being processed, the reports sent
+        # meanwhile are queued after them as done by the controller
+        self._batch = None
+        simulator.sessions.append(self)
+
+    def feed(self, data):
+        """
+        Process the received data. Incomplete commands are kept until the
+        rest of the data is received.
+        """
+        self._buf += data
+        if '\n' not in self._buf:
+            return
+        lines = self._buf.split('\n')
+        self._buf = lines.pop()
+        if self.sleep and self.simulator.latency:
+            time.sleep(self.simulator.latency)
+        with self._lock:
+            self._batch = []
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(':'):
+                continue
+            answers = self.simulator.process(line[1:])
+            with self._lock:
+                self._batch.extend(answers)
+        with self._lock:
+            answers, self._batch = self._batch, None
+            if answers:
+                self._write(frame_cmds(answers))
+
+    def write(self, ans):
+        with self._lock:
+            if self._batch is not None:
+                self._batch.append(ans)
+            else:
+                self._write(frame(ans))
+
+    def close(self):
+        try:
+            self.simulator.sessions.remove(self)
+        except ValueError:
+            pass
+
+
+class SimulatorCom(object):
+    """
+    Class which implements an in-process communication layer with a
+    simulated controller (CommType.Simulator).
+
+    :param simulator: SmaractSimulator instance (by default a new one).
+    :param timeout: maximum time to wait an answer (s).
+    """
+    def __init__(self, simulator=None, timeout=3.0):
+        self.simulator = simulator or SmaractSimulator()
+        self.timeout = timeout
+        self._answers = Queue()
+        self._partial = ''
+        # The latency delays the answers without blocking the writer, so
+        # several commands can be in flight as with the real transports.
+        self._session = SimulatorSession(self.simulator, self._put,
+                                         sleep=False)
+
+    @comm_error_handler
+    def send_cmd(self, cmd):
+        self.write_cmd(cmd)
+        ans = self.read_answer()
+        if not ans:
+            raise RuntimeError('Timeout waiting the answer of command %s' %
+                               cmd.strip())
+        return ans
+
+    def write_cmd(self, cmd):
+        self._session.feed(cmd)
+
+    def read_answer(self, timeout=None):
+        wakeable = timeout is not None
+        if timeout is None:
+            timeout = self.timeout
+        while '\n' not in self._partial:
+            try:
+                ready, data = self._answers.get(timeout=timeout)
+            except Empty:
+                return ''
+            if data is None:
+                # Wakeup, ignored by the reads without timeout
+                if wakeable:
+                    return ''
+                continue
+            delay = ready - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._partial += data
+        line, self._partial = self._partial.split('\n', 1)
+        return line + '\n'
+
+    def read_available(self):
+        """
+        Read without waiting the data already sent by the simulator.
+
+        :return: string, possibly with several or partial answers.
+        """
+        data, self._partial = self._partial, ''
+        while True:
+            with self._answers.mutex:
+                if not self._answers.queue or \
+                        self._answers.queue[0][0] > time.time():
+                    return data
+            data += self._answers.get()[1] or ''
+
+    def wakeup(self):
+        """
+        Interrupt a read_answer with timeout, which returns an empty string.
+        """
+        self._answers.put((0, None))
+
+    def close(self):
+        self._session.close()
+
+    def _put(self, data):
+        self._answers.put((time.time() + self.simulator.latency, data))
+
+
+class SimulatorDeviceProxy(object):
+    """
+    Stand-in of the PyTango DeviceProxy of a Tango Serial device connected
+    to a simulated controller, to be used with CommType.SerialTango.
+
+    :param simulator: SmaractSimulator instance (by default a new one).
+    :param timeout: maximum time to wait an answer (s).
+    :param call_latency: time added to each call (s), the round trip to a
+    remote device server.
+    """
+    def __init__(self, simulator=None, timeout=3.0, call_latency=0.0):
+        self._com = SimulatorCom(simulator, timeout)
+        self.simulator = self._com.simulator
+        self.call_latency = call_latency
+        # Number of calls to the device
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.call_latency:
+            time.sleep(self.call_latency)
+
+    def DevSerFlush(self, what):
+        # 0: input, 1: output, 2: both. Only the input is buffered.
+        self._call()
+        if what in (0, 2):
+            while not self._com._answers.empty():
+                self._com._answers.get()
+            self._com._partial = ''
+
+    def DevSerWriteString(self, data):
+        self._call()
+        self._com.write_cmd(data)
+        return len(data)
+
+    def DevSerReadLine(self):
+        self._call()
+        return self._com.read_answer()
+
+    def DevSerReadRaw(self):
+        self._call()
+        return self._com.read_available()
+
+    def close(self):
+        self._com.close()
+
+
+class SimulatorServer(object):
+    """
+    TCP server of a simulated controller, to be used with CommType.Socket.
+
+    :param simulator: SmaractSimulator instance (by default a new one).
+    :param host: listening address.
+    :param port: listening port (0 selects a free port).
+    """
+    def __init__(self, simulator=None, host='127.0.0.1', port=0):
+        self.simulator = simulator or SmaractSimulator()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(5)
+        self.host, self.port = self._sock.getsockname()
+        self._running = False
+        self._clients = []
+
+    def start(self):
+        self._running = True
+        thread = threading.Thread(target=self._serve, name='SimulatorServer')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+        self._sock.close()
+        for client in list(self._clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            client.close()
+
+    def _serve(self):
+        while self._running:
+            try:
+                client, _ = self._sock.accept()
+            except socket.error:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._clients.append(client)
+            thread = threading.Thread(target=self._serve_client,
+                                      args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve_client(self, client):
+        def write(data):
+            client.sendall(to_bytes(data))
+        session = SimulatorSession(self.simulator, write)
+        try:
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                session.feed(to_str(data))
+        except socket.error:
+            pass
+        finally:
+            session.close()
+            if client in self._clients:
+                self._clients.remove(client)
+            client.close()
+
+
+class SimulatorPty(object):
+    """
+    Pseudo-terminal serial pair of a simulated controller, to be used with
+    CommType.Serial. The serial port name is given by the port attribute.
+
+    By default the baudrate is not emulated. With max_baudrate, the data is
+    lost while the baudrate of the port is not the one of the simulator
+    (see the BR command), and the answers are corrupted above max_baudrate,
+    as on a line which does not carry higher rates.
+
+    :param simulator: SmaractSimulator instance (by default a new one).
+    :param max_baudrate: highest baudrate carried by the line.
+    """
+    def __init__(self, simulator=None, max_baudrate=None):
+        import tty
+        self.simulator = simulator or SmaractSimulator()
+        self.max_baudrate = max_baudrate
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = False
+        # Baudrate at which the command being processed was received
+        self._rate = None
+
+    def start(self):
+        self._running = True
+        thread = threading.Thread(target=self._serve, name='SimulatorPty')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+
+    def _port_baudrate(self):
+        import termios
+        speed = termios.tcgetattr(self._master)[4]
+        for baudrate in BAUDRATES:
+            if getattr(termios, 'B%d' % baudrate, None) == speed:
+                return baudrate
+        return None
+
+    def _write(self, data):
+        if self.max_baudrate is not None:
+            rate = self._rate or self.simulator.baudrate
+            if self._port_baudrate() != rate:
+                return
+            if rate > self.max_baudrate:
+                data = ''.join(['?' * len(line) + '\n'
+                                for line in data.split('\n')[:-1]])
+        os.write(self._master, to_bytes(data))
+
+    def _serve(self):
+        session = SimulatorSession(self.simulator, self._write)
+        try:
+            while self._running:
+                ready, _, _ = select.select([self._master], [], [], 0.1)
+                if not ready:
+                    continue
+                data = to_str(os.read(self._master, 4096))
+                if self.max_baudrate is not None and \
+                        self._port_baudrate() != self.simulator.baudrate:
+                    continue
+                # The answers are sent at the baudrate of the command, e.g.
+                # the one of BR is sent before the change
+                self._rate = self.simulator.baudrate
+                try:
+                    session.feed(data)
+                finally:
+                    self._rate = None
+        except OSError:
+            pass
+        finally:
+            session.close()
+            os.close(self._master)
+            os.close(self._slave)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+def _err_channel(channel):
+    return -1 if channel is None else channel
+
+
+def _angle_rev(position):
+    rev = int(math.floor(position / TURN))
+    angle = int(round(position - rev * TURN))
+    return angle, rev
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Smaract controller '
+                                                 'simulator')
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', default=5000, type=int,
+                        help='TCP port (0 disables the TCP server)')
+    parser.add_argument('--pty', action='store_true',
+                        help='create a pseudo-terminal serial port')
+    parser.add_argument('--channels', default=3, type=int)
+    parser.add_argument('--sensor-types', type=str,
+                        help='comma separated sensor codes per channel')
+    parser.add_argument('--speed', default=0, type=float,
+                        help='initial closed-loop speed (nm/s or udeg/s)')
+    parser.add_argument('--acceleration', default=0, type=float,
+                        help='initial closed-loop acceleration')
+    parser.add_argument('--time-scale', default=1.0, type=float)
+    parser.add_argument('--latency', default=0.0, type=float,
+                        help='answer latency (s)')
+    args = parser.parse_args()
+
+    sensor_types = None
+    if args.sensor_types:
+        sensor_types = [int(x) for x in args.sensor_types.split(',')]
+        args.channels = len(sensor_types)
+    kinematics = Kinematics(speed=args.speed, acceleration=args.acceleration,
+                            time_scale=args.time_scale)
+    simulator = SmaractSimulator(args.channels, sensor_types, kinematics,
+                                 args.latency)
+    if args.port:
+        server = SimulatorServer(simulator, args.host, args.port).start()
+        print('Simulator listening on %s:%d' % (server.host, server.port))
+    if args.pty:
+        pty = SimulatorPty(simulator).start()
+        print('Simulator serial port: %s' % pty.port)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
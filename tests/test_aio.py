@@ -0,0 +1,149 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import sys
+import unittest
+
+from smaract.constants import CommunicationMode, Status, TURN
+from smaract.simulator import SmaractSimulator, Kinematics, SimulatorServer
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    from smaract.aio import (AsyncSmaractMCSController,
+                             AsyncSmaractMCSLinearAxis,
+                             AsyncSmaractMCSAngularAxis)
+    from smaract.controller import SmaractMCSController
+    from smaract.axis import SmaractMCSLinearAxis, SmaractMCSAngularAxis
+    from smaract.protocol import AngleReply, PositionReply
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio front-end needs 3.7')
+class TestAsyncController(unittest.TestCase):
+
+    def setUp(self):
+        kinematics = Kinematics(speed=1e6, time_scale=100)
+        self.sim = SmaractSimulator(3, [1, 2, 1], kinematics)
+        # The previous client left the controller in asynchronous mode
+        self.sim.communication_mode = CommunicationMode.ASYNC
+        self.server = SimulatorServer(self.sim).start()
+        self.loop = asyncio.new_event_loop()
+        self.ctrl = self.wait(AsyncSmaractMCSController.connect(
+            self.server.host, self.server.port, 1, loop=self.loop))
+
+    def tearDown(self):
+        self.ctrl.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        self.server.close()
+
+    def wait(self, fut):
+        return self.loop.run_until_complete(fut)
+
+    def test_axes(self):
+        self.assertEqual(len(self.ctrl), 3)
+        self.assertIsInstance(self.ctrl[0], AsyncSmaractMCSLinearAxis)
+        self.assertIsInstance(self.ctrl[1], AsyncSmaractMCSAngularAxis)
+        self.assertEqual(self.wait(self.ctrl.version), 'Version: 1.3.0')
+        self.assertEqual(self.wait(self.ctrl[2].sensor_type), 'S')
+
+    def test_concurrent(self):
+        futs = [self.ctrl[i % 3].state for i in range(100)]
+        futs.append(self.ctrl[0].position)
+        results = self.wait(asyncio.gather(*futs))
+        self.assertEqual(results, [Status.STOPPED] * 100 + [0])
+
+    def test_move(self):
+        linear, angular = self.ctrl[0], self.ctrl[1]
+        self.wait(asyncio.gather(linear.move(1000),
+                                 angular.move(-0.5 * TURN)))
+        self.wait(asyncio.gather(linear.wait_stopped(0.01),
+                                 angular.wait_stopped(0.01)))
+        self.assertEqual(self.wait(linear.position), 1000)
+        self.assertEqual(self.wait(angular.position), -0.5 * TURN)
+        self.wait(linear.set_position_limits([-100, 100]))
+        self.assertEqual(self.wait(linear.position_limits), [-100, 100])
+
+    def test_move_wait(self):
+        linear, angular = self.ctrl[0], self.ctrl[1]
+        self.wait(asyncio.gather(linear.move(5e6, wait=True),
+                                 angular.move(-0.1 * TURN, wait=True)))
+        self.assertEqual(self.wait(linear.state), Status.STOPPED)
+        self.assertEqual(self.wait(linear.position), 5e6)
+        self.wait(linear.move(5e6, wait=True))
+        with self.assertRaises(RuntimeError):
+            self.wait(self.ctrl.send_movement(1, 'MPA1,1000,0'))
+
+    def test_replies(self):
+        ans = self.wait(self.ctrl.send_cmd('GA1'))
+        self.assertIsInstance(ans, AngleReply)
+        self.assertEqual(ans, 'A1,0,0')
+        self.assertIsInstance(self.wait(self.ctrl.send_cmd('GP0')),
+                              PositionReply)
+
+    def test_error(self):
+        with self.assertRaises(RuntimeError):
+            self.wait(self.ctrl.send_cmd('MPA1,1000,0'))
+        self.assertEqual(self.wait(self.ctrl[0].position), 0)
+
+    def test_mirror(self):
+        for aio_cls, sync_cls in [
+                (AsyncSmaractMCSLinearAxis, SmaractMCSLinearAxis),
+                (AsyncSmaractMCSAngularAxis, SmaractMCSAngularAxis)]:
+            for name in dir(sync_cls):
+                member = getattr(sync_cls, name)
+                if name.startswith('_') or name == 'invalidate_cache' or \
+                        not callable(member) and \
+                        not isinstance(member, property):
+                    continue
+                self.assertTrue(hasattr(aio_cls, name), name)
+                if isinstance(member, property) and member.fset:
+                    self.assertTrue(hasattr(aio_cls, 'set_' + name), name)
+        for name in AsyncSmaractMCSController.MEMBERS:
+            self.assertTrue(hasattr(SmaractMCSController, name), name)
+
+    def test_members(self):
+        linear, angular = self.ctrl[0], self.ctrl[1]
+        self.assertEqual(self.wait(linear.serial_number),
+                         'SN0,' + self.sim.channels[0].serial_number)
+        self.wait(linear.set_closed_loop_vel(1000))
+        self.assertEqual(self.wait(linear.closed_loop_vel), 1000)
+        self.wait(linear.set_safe_direction('backward'))
+        self.assertEqual(self.wait(linear.safe_direction), 'backward')
+        self.assertEqual(self.wait(self.ctrl.sensor_enabled), '1')
+        self.assertEqual(self.wait(linear.status)[0], Status.STOPPED)
+        self.wait(angular.move_angle_absolute(1000, 0))
+        self.wait(angular.wait_stopped(0.01))
+        snap = self.wait(self.ctrl.snapshot(('position', 'state')))
+        self.assertEqual(list(snap['position']), [0, 1000, 0])
+        self.assertEqual(list(snap['state']), [Status.STOPPED] * 3)
+        self.wait(self.ctrl.stop_all())
+        with self.assertRaises(ValueError):
+            self.wait(linear.set_emergency_stop('wrong'))
+        # The wait option of the sync methods uses the reports
+        self.wait(linear.calibrate_sensor(wait=True, timeout=1))
+        self.wait(linear.move(1000, wait=True))
+        self.assertEqual(self.wait(linear.position), 1000)
+
+    def test_unknown_sensor(self):
+        self.ctrl.close()
+        self.server.close()
+        self.sim = SmaractSimulator(2, [1, 9999])
+        self.server = SimulatorServer(self.sim).start()
+        with self.assertRaises(RuntimeError):
+            self.ctrl = self.wait(AsyncSmaractMCSController.connect(
+                self.server.host, self.server.port, 1, loop=self.loop))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,94 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from smaract import SmaractMCSController
+from smaract.capture import CaptureStream
+from smaract.communication import CommType
+from smaract.constants import ChannelProperties
+from smaract.simulator import SmaractSimulator
+
+
+class TestCaptureStream(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SmaractSimulator(1)
+        self.channel = self.sim.channels[0]
+        self.ctrl = SmaractMCSController(CommType.Simulator, self.sim)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.ctrl._comm.close()
+        shutil.rmtree(self.directory)
+
+    def capture(self, positions):
+        for position in positions:
+            self.channel.set_position(position)
+            self.channel.capture()
+
+    def test_ring(self):
+        # Captured before the stream is configured
+        self.capture([-1])
+        stream = CaptureStream(self.ctrl[0], size=5, trigger_source=2)
+        stream.configure()
+        self.assertEqual(
+            self.channel.properties[ChannelProperties.CaptureBuffer], 2)
+        self.assertEqual(len(stream.data()), 0)
+        self.capture([1, 2, 3])
+        self.assertEqual(stream.poll(), 3)
+        self.assertEqual(stream.poll(), 0)
+        self.assertEqual(list(stream.data()), [1, 2, 3])
+        self.capture([4, 5, 6, 7])
+        stream.poll()
+        self.assertEqual(list(stream.data()), [3, 4, 5, 6, 7])
+        self.assertEqual(list(stream.data(2)), [6, 7])
+        self.capture(range(10, 22))
+        stream.poll()
+        self.assertEqual(list(stream.data()), [17, 18, 19, 20, 21])
+        self.assertEqual(stream.count, 19)
+        self.assertEqual(stream.lost, 0)
+        # Captures counted but not in the buffer
+        self.channel.properties[ChannelProperties.Counter] += 4
+        stream.poll()
+        self.assertEqual(stream.lost, 4)
+
+    def test_counter_property(self):
+        axis = self.ctrl[0]
+        self.assertEqual(axis.get_channel_property(ChannelProperties.Counter),
+                         0)
+        self.capture([1, 2])
+        # The counter is changed by the controller, it is never cached
+        self.assertEqual(axis.get_channel_property(ChannelProperties.Counter),
+                         2)
+
+    def test_memmap(self):
+        path = os.path.join(self.directory, 'capture')
+        stream = CaptureStream(self.ctrl[0], size=1000, path=path,
+                               period=0.001).start()
+        for i in range(50):
+            self.capture([i])
+            time.sleep(0.0005)
+        stream.close()
+        self.assertIsNone(stream.error)
+        self.assertEqual(list(stream.data()), list(range(50)))
+        self.assertEqual(os.path.getsize(path), 8000)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
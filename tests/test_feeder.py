@@ -0,0 +1,90 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import time
+import unittest
+
+from smaract import SmaractMCSController
+from smaract.communication import CommType
+from smaract.constants import CommunicationMode
+from smaract.feeder import QueueFeeder
+from smaract.simulator import SmaractSimulator, Kinematics
+
+
+class TestQueueFeeder(unittest.TestCase):
+
+    def setUp(self):
+        kinematics = Kinematics(speed=1e6, time_scale=100)
+        self.sim = SmaractSimulator(3, [1, 2, 1], kinematics)
+        self.ctrl = SmaractMCSController(CommType.Simulator, self.sim)
+        self.ctrl.communication_mode = CommunicationMode.ASYNC
+        self.taken = 0
+
+    def tearDown(self):
+        self.ctrl.communication_mode = CommunicationMode.SYNC
+        self.ctrl._comm.close()
+
+    def points(self, n):
+        for i in range(n):
+            self.taken += 1
+            yield (i * 10, -i * 10)
+
+    def wait(self, condition, timeout=3):
+        end = time.time() + timeout
+        while not condition() and time.time() < end:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_backpressure(self):
+        feeder = QueueFeeder(self.ctrl, [0, 2], self.points(100)).start()
+        # The points are taken only while they fit in the queues
+        self.wait(lambda: feeder.loaded == 16)
+        time.sleep(0.05)
+        self.assertEqual(self.taken, 16)
+        self.assertEqual(feeder.queued, {0: 16, 2: 16})
+        while feeder._thread.is_alive():
+            self.ctrl.trigger_command(0)
+            self.assertLessEqual(max(len(ch.queue)
+                                     for ch in self.sim.channels), 16)
+        feeder.join(3)
+        self.assertEqual(feeder.loaded, 100)
+        while any(feeder.queued.values()):
+            self.ctrl.trigger_command(0)
+        feeder.wait_empty(3)
+        self.assertEqual(feeder.triggered, {0: 100, 2: 100})
+        self.wait(lambda: self.ctrl[2].position == -990)
+        self.assertEqual(self.ctrl[0].position, 990)
+        self.assertEqual(self.ctrl.async_errors, [])
+        feeder.close()
+
+    def test_close(self):
+        feeder = QueueFeeder(self.ctrl, [0], ((i,) for i in range(50)))
+        feeder.start()
+        self.wait(lambda: feeder.loaded == 16)
+        feeder.close(clean=True)
+        self.assertEqual(len(self.sim.channels[0].queue), 0)
+        self.assertEqual(feeder.queued, {0: 0})
+        feeder.wait_empty(0)
+
+    def test_errors(self):
+        feeder = QueueFeeder(self.ctrl, [0, 2], [(1, 2, 3)]).start()
+        with self.assertRaises(ValueError):
+            feeder.join(3)
+        self.ctrl.communication_mode = CommunicationMode.SYNC
+        with self.assertRaises(RuntimeError):
+            QueueFeeder(self.ctrl, [0], [(1,)]).run()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
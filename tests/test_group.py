@@ -0,0 +1,105 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import time
+import unittest
+
+from smaract import SmaractMCSController, SmaractSDCController
+from smaract.communication import CommType
+from smaract.constants import CommunicationMode, Status
+from smaract.group import ControllerGroup
+from smaract.simulator import SmaractSimulator, Kinematics
+
+
+class TestControllerGroup(unittest.TestCase):
+
+    def setUp(self):
+        kinematics = Kinematics(speed=1e6, time_scale=100)
+        self.sims = [SmaractSimulator(2, [1, 2], kinematics),
+                     SmaractSimulator(3, kinematics=kinematics),
+                     SmaractSimulator(1)]
+        self.group = ControllerGroup.connect(
+            [(SmaractMCSController, CommType.Simulator, self.sims[0]),
+             (SmaractMCSController, CommType.Simulator, self.sims[1]),
+             (SmaractSDCController, CommType.Simulator, self.sims[2])])
+
+    def tearDown(self):
+        self.group.close()
+
+    def test_connect(self):
+        self.assertEqual([len(ctrl) for ctrl in self.group], [2, 3, 1])
+        self.assertIsInstance(self.group[2], SmaractSDCController)
+        with self.assertRaises(RuntimeError):
+            ControllerGroup.connect([(SmaractMCSController, 'Wrong')])
+        group = ControllerGroup.connect(
+            [(SmaractMCSController, 'Wrong'),
+             (SmaractMCSController, CommType.Simulator, self.sims[1])],
+            raise_errors=False)
+        self.assertIsInstance(group[0], Exception)
+        self.assertEqual(len(group[1]), 3)
+        group.close()
+
+    def test_stop_all(self):
+        for sim in self.sims:
+            sim.latency = 0.05
+        for ctrl in self.group[:2]:
+            for axis in ctrl:
+                axis.move(1e9)
+        t0 = time.time()
+        self.group.stop_all()
+        # The controllers are stopped concurrently
+        self.assertLess(time.time() - t0, 0.15)
+        for sim in self.sims:
+            sim.latency = 0
+        snapshots = self.group.snapshot(('state',))
+        self.assertIsNone(snapshots[2])
+        for snapshot in snapshots[:2]:
+            self.assertEqual(list(snapshot['state']),
+                             [Status.STOPPED] * len(snapshot))
+
+    def test_stop_all_async(self):
+        for ctrl in self.group[:2]:
+            ctrl.communication_mode = CommunicationMode.ASYNC
+        try:
+            self.test_stop_all()
+            # The errors of the commands not acknowledged are reported
+            results = self.group.send_cmds(['MPA7,0,0'], raise_errors=False)
+            self.assertIsInstance(results[0], RuntimeError)
+            self.assertIsInstance(results[1], RuntimeError)
+        finally:
+            for ctrl in self.group[:2]:
+                ctrl.communication_mode = CommunicationMode.SYNC
+
+    def test_fan_out(self):
+        mcs = ControllerGroup(self.group[:2])
+        mcs.set_axes_property('closed_loop_vel', 2000)
+        self.assertEqual(mcs.send_cmds(['GCLS0']), [['CLS0,2000']] * 2)
+        mcs.find_reference_marks(0, auto_zero=1, timeout=3)
+        self.assertEqual([list(s['position']) for s in mcs.snapshot()],
+                         [[0, 0], [0, 0, 0]])
+
+    def test_errors(self):
+        with self.assertRaises(RuntimeError) as context:
+            self.group.send_cmds(lambda ctrl: ['GP%d' % (len(ctrl) % 3)])
+        # The channel is out of range on the first and last controllers
+        self.assertIn('Controller 0:', str(context.exception))
+        self.assertIn('Controller 2:', str(context.exception))
+        self.assertNotIn('Controller 1:', str(context.exception))
+        results = self.group.send_cmds(['GS0', 'GP7'], raise_errors=False)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(self.group.map(len), [2, 3, 1])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,145 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import pickle
+import unittest
+
+from smaract.constants import TURN
+from smaract.controller import SmaractBaseController
+from smaract.protocol import (FrameDecoder, Reply, Ack, ErrorReply,
+                              PositionReply, AngleReply, ReportReply,
+                              CommandTemplate, encode, unframe, parse_reply,
+                              check_answer, error_code, error_message,
+                              split_answer, answer_key, is_priority)
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_template(self):
+        template = CommandTemplate('GP', 2)
+        self.assertEqual((template.cmd, template.line, template.data),
+                         ('GP2', ':GP2\n', b':GP2\n'))
+        template = CommandTemplate('MPA', 2, 2)
+        self.assertEqual(template.cmd, None)
+        self.assertEqual(template.render(1000, 0), 'MPA2,1000,0')
+        self.assertEqual(template.frame(-5, 10), ':MPA2,-5,10\n')
+        self.assertEqual(template.encode(1.9, 0), b':MPA2,1,0\n')
+        self.assertEqual(CommandTemplate('TC', None, 1).render(1792), 'TC1792')
+        self.assertRaises(TypeError, template.render, 1)
+        for name, channel, pars, cmd in (('GS', 0, (), 'GS0'),
+                                         ('SCLS', 1, (500,), 'SCLS1,500'),
+                                         ('SCM', None, (1,), 'SCM1'),
+                                         ('R', None, (), 'R')):
+            self.assertEqual(
+                CommandTemplate(name, channel, len(pars)).render(*pars), cmd)
+
+    def test_encode(self):
+        self.assertEqual(encode(['GP0', 'S1']), b':GP0\n:S1\n')
+        self.assertEqual(unframe(':P0,1000\n'), 'P0,1000')
+
+    def test_keys(self):
+        self.assertEqual(answer_key('GP0'), ('P', 0))
+        self.assertEqual(answer_key('GCM'), ('CM', None))
+        self.assertEqual(answer_key('MPA0,10,0'), None)
+        # The name and channel given are not parsed again
+        self.assertEqual(answer_key('GP0', 'GP', 1), ('P', 1))
+        self.assertTrue(is_priority('S0'))
+        self.assertFalse(is_priority('S0', 'GP'))
+        self.assertEqual(split_answer('E-1,5'), ('E', None))
+
+
+class TestReplies(unittest.TestCase):
+
+    def test_types(self):
+        reply = parse_reply('P1,-1000')
+        self.assertIsInstance(reply, PositionReply)
+        self.assertEqual((reply.channel, reply.position), (1, -1000))
+        reply = parse_reply('A1,1000,-2')
+        self.assertIsInstance(reply, AngleReply)
+        self.assertEqual((reply.angle, reply.revolution), (1000, -2))
+        self.assertEqual(reply.position, -2 * TURN + 1000)
+        self.assertIsInstance(parse_reply('E2,0'), Ack)
+        self.assertIsInstance(parse_reply('MCC2'), ReportReply)
+        reply = parse_reply('CLS0,2000')
+        self.assertIs(type(reply), Reply)
+        self.assertEqual((reply.code, reply.values), ('CLS', ['2000']))
+        self.assertEqual(parse_reply('IV2,3,1').values, ['2', '3', '1'])
+        self.assertIs(parse_reply(reply), reply)
+
+    def test_str(self):
+        # The replies are the answers themselves
+        reply = parse_reply('A1,1000,-2')
+        self.assertEqual(reply, 'A1,1000,-2')
+        self.assertEqual(reply.text, 'A1,1000,-2')
+        self.assertEqual(reply.split(','), ['A1', '1000', '-2'])
+        copy = pickle.loads(pickle.dumps(reply))
+        self.assertIsInstance(copy, AngleReply)
+        self.assertEqual(copy.position, reply.position)
+
+    def test_errors(self):
+        reply = parse_reply('E-1,7')
+        self.assertIsInstance(reply, ErrorReply)
+        self.assertEqual((reply.channel, reply.error_code), (None, 7))
+        self.assertTrue(reply.is_error)
+        with self.assertRaises(RuntimeError) as cm:
+            reply.check(SmaractBaseController.ERROR_CODES)
+        self.assertIn('Invalid Parameter', str(cm.exception))
+        reply = parse_reply('P0,1')
+        self.assertIs(reply.check(), reply)
+        self.assertEqual(split_answer('E-1,7'), ('E', None))
+        self.assertEqual(error_code('E-1,7'), 7)
+        self.assertTrue(error_message(7).startswith('Error 7: '))
+        check_answer('P0,1')
+        self.assertRaises(RuntimeError, check_answer, 'E0,1000')
+        check_answer('E0,0')
+        # The end effector type answer starts with E but it is not an error
+        self.assertEqual(error_code('EET0,1,0,0'), None)
+        self.assertEqual(error_code('P0,1'), None)
+
+
+class TestFrameDecoder(unittest.TestCase):
+
+    def test_split(self):
+        decoder = FrameDecoder(8)
+        decoder.feed(b':P0,1000\n:S')
+        self.assertEqual(decoder.next_line(), ':P0,1000\n')
+        self.assertEqual(decoder.next_line(), None)
+        decoder.feed(b'0,0\n\n:E-1,5\n')
+        self.assertEqual(decoder.next_answer(), 'S0,0')
+        reply = decoder.next_reply()
+        self.assertIsInstance(reply, ErrorReply)
+        self.assertEqual(reply, 'E-1,5')
+        self.assertEqual(decoder.next_reply(), None)
+        self.assertEqual(len(decoder), 0)
+
+    def test_buffer(self):
+        # Messages longer than the buffer and direct reads into it
+        decoder = FrameDecoder(4)
+        data = b':CB0,' + b','.join([b'1234'] * 20) + b'\n:MCC0\n'
+        for i in range(0, len(data), 3):
+            chunk = data[i:i + 3]
+            view = decoder.buffer()
+            n = min(len(view), len(chunk))
+            view[:n] = chunk[:n]
+            decoder.advance(n)
+            decoder.feed(chunk[n:])
+        self.assertEqual(decoder.next_answer().count('1234'), 20)
+        self.assertIsInstance(decoder.next_reply(), ReportReply)
+        decoder.feed(b':P0')
+        decoder.clear()
+        self.assertEqual(len(decoder), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from smaract import SmaractMCSController
+from smaract.communication import SmaractCommunication, CommType
+from smaract.constants import CommunicationMode, Status
+from smaract.proxy import SmaractProxy, load_test
+from smaract.simulator import SmaractSimulator, Kinematics
+
+
+class TestProxy(unittest.TestCase):
+
+    def setUp(self):
+        kinematics = Kinematics(speed=1e6, time_scale=100)
+        self.sim = SmaractSimulator(3, [1, 2, 1], kinematics)
+        self.directory = tempfile.mkdtemp()
+        comm = SmaractCommunication(CommType.Simulator, self.sim)
+        self.proxy = SmaractProxy(
+            comm, unix_path=os.path.join(self.directory, 'smaract')).start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client._comm.close()
+        self.proxy.close()
+        shutil.rmtree(self.directory)
+
+    def connect(self, host=None):
+        ctrl = SmaractMCSController(CommType.Socket, host or self.proxy.host,
+                                    self.proxy.port)
+        self.clients.append(ctrl)
+        return ctrl
+
+    def test_clients(self):
+        gui, scan = self.connect(), self.connect(self.proxy.unix_path)
+        self.assertEqual(len(gui), 3)
+        reports = []
+        gui._comm.add_listener(reports.append)
+        scan[0].move(1e6, wait=True, timeout=3)
+        self.assertEqual(gui[0].position, 1e6)
+        self.assertEqual(gui[0].state, Status.STOPPED)
+        # The reports are sent to all the clients
+        self.assertEqual(reports, ['MCC0'])
+        with self.assertRaises(RuntimeError):
+            gui.send_cmd('MPA1,1000,0')
+        self.assertEqual(scan[1].position, 0)
+
+    def test_communication_mode(self):
+        gui, scan = self.connect(), self.connect()
+        scan.communication_mode = CommunicationMode.ASYNC
+        self.assertEqual(scan.communication_mode, CommunicationMode.ASYNC)
+        self.assertEqual(gui.communication_mode, CommunicationMode.SYNC)
+        self.assertEqual(scan.send_cmds(['GP0', 'SCLS0,10', 'GS0']),
+                         ['P0,0', None, 'S0,0'])
+        self.assertEqual(gui.send_cmds(['GP0', 'SCLS0,20', 'GS0']),
+                         ['P0,0', 'E0,0', 'S0,0'])
+        self.assertEqual(scan[0].closed_loop_vel, 20)
+        scan.communication_mode = CommunicationMode.SYNC
+        self.assertEqual(scan[0].position, 0)
+        self.assertEqual(self.sim.communication_mode, CommunicationMode.SYNC)
+
+    def test_cache(self):
+        gui = self.connect()
+        cached = self.proxy.stats['cached']
+        self.proxy.cache_ttl['GP'] = 10
+        self.assertEqual(gui[0].position, 0)
+        self.assertEqual(gui[0].position, 0)
+        self.assertEqual(self.proxy.stats['cached'], cached + 1)
+        gui[0].set_position(500)
+        self.assertEqual(gui[0].position, 500)
+        gui[0].move(1000, wait=True, timeout=3)
+        self.assertEqual(gui[0].position, 1000)
+
+    def test_load(self):
+        nrequests, latencies = load_test(self.proxy.host, self.proxy.port, 4,
+                                         0.2, range(3))
+        self.assertEqual(nrequests, len(latencies) * 6)
+        self.assertEqual(self.proxy.stats['requests'], nrequests)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from smaract import SmaractMCSController
+from smaract.communication import CommType
+from smaract.constants import Status, TURN
+from smaract.publisher import PositionPublisher, PositionReader
+from smaract.simulator import SmaractSimulator, Kinematics
+
+
+class TestPublisher(unittest.TestCase):
+
+    def setUp(self):
+        kinematics = Kinematics(speed=1e6, time_scale=100)
+        self.ctrl = SmaractMCSController(
+            CommType.Simulator, SmaractSimulator(3, [1, 2, 1], kinematics))
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'positions')
+
+    def tearDown(self):
+        self.ctrl._comm.close()
+        shutil.rmtree(self.directory)
+
+    def test_publish(self):
+        publisher = PositionPublisher(self.ctrl, self.path, size=4)
+        reader = PositionReader(self.path)
+        self.assertEqual(reader.nchannels, 3)
+        self.assertIsNone(reader.latest())
+        self.ctrl[0].move(1000, wait=True, timeout=3)
+        self.ctrl[1].move(-0.5 * TURN, wait=True, timeout=3)
+        t0 = time.time()
+        publisher.publish()
+        timestamp, positions, states = reader.latest()
+        self.assertGreaterEqual(timestamp, t0)
+        self.assertEqual(list(positions), [1000, -0.5 * TURN, 0])
+        self.assertEqual(list(states), [Status.STOPPED] * 3)
+        # The ring keeps the last records
+        for i in range(5):
+            self.ctrl[2].set_position(i)
+            publisher.publish()
+        history = reader.history(10)
+        self.assertEqual(len(history), 4)
+        self.assertEqual(list(history['position'][:, 2]), [1, 2, 3, 4])
+        self.assertTrue(all(history['timestamp'][1:] >=
+                            history['timestamp'][:-1]))
+        self.assertEqual(reader.count, 6)
+        publisher.close()
+
+    def test_thread(self):
+        publisher = PositionPublisher(self.ctrl, self.path, rate=200).start()
+        time.sleep(0.1)
+        publisher.close()
+        reader = PositionReader(self.path)
+        self.assertGreater(reader.count, 5)
+        self.assertEqual(len(reader.history(1000)), reader.count)
+
+    def test_other_process(self):
+        publisher = PositionPublisher(self.ctrl, self.path)
+        self.ctrl[0].set_position(1234)
+        publisher.publish()
+        code = ('from smaract.publisher import PositionReader;'
+                'print(PositionReader(%r).latest()[1][0])' % self.path)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+            [p for p in [env.get('PYTHONPATH')] if p])
+        out = subprocess.check_output([sys.executable, '-c', code], env=env)
+        self.assertEqual(float(out), 1234)
+        publisher.close()
+
+    def test_wrong_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 128)
+        with self.assertRaises(RuntimeError):
+            PositionReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
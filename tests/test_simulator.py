@@ -0,0 +1,716 @@
+# ------------------------------------------------------------------------------
+# This file is part of smaract (https://github.com/ALBA-Synchrotron/smaract)
+#
+# Copyright 2008-2017 CELLS / ALBA Synchrotron, Bellaterra, Spain
+#
+# Distributed under the terms of the GNU General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+#
+# You should have received a copy of the GNU General Public License
+# along with smaract. If not, see <http://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+
+import os
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from smaract import SmaractMCSController, SmaractSDCController
+from smaract.communication import CommType, SerialCom, SocketCom
+from smaract.constants import CommunicationMode, Status, TURN
+from smaract.protocol import (split_cmd, AngleReply, PositionReply,
+                              ReportReply)
+from smaract.axis import SmaractMCSLinearAxis, SmaractMCSAngularAxis
+from smaract.metadata import BaudrateCache
+from smaract.simulator import (SmaractSimulator, Kinematics, SimulatorServer,
+                               SimulatorPty, SimulatorCom,
+                               SimulatorDeviceProxy)
+
+
+class TestSimulator(unittest.TestCase):
+    """
+    Tests of the library against the in-process simulator. The subclasses
+    run the same tests through the other transports.
+    """
+    SENSOR_TYPES = [1, 2, 1]
+
+    def setUp(self):
+        kinematics = Kinematics(speed=1e6, time_scale=100)
+        self.sim = SmaractSimulator(len(self.SENSOR_TYPES), self.SENSOR_TYPES,
+                                    kinematics)
+        self.ctrl = self.create_controller()
+
+    def create_controller(self):
+        return SmaractMCSController(CommType.Simulator, self.sim)
+
+    def tearDown(self):
+        self.ctrl.communication_mode = CommunicationMode.SYNC
+        self.ctrl._comm._comm.close()
+
+    def test_axes(self):
+        self.assertEqual(self.ctrl.nchannels, 3)
+        self.assertIsInstance(self.ctrl[0], SmaractMCSLinearAxis)
+        self.assertIsInstance(self.ctrl[1], SmaractMCSAngularAxis)
+        self.assertEqual(self.ctrl.version, 'Version: 1.3.0')
+        self.assertEqual(self.ctrl[0].sensor_type, 'S')
+
+    def test_move(self):
+        linear, angular = self.ctrl[0], self.ctrl[1]
+        linear.move(1000)
+        angular.move(-45e6)
+        time.sleep(0.01)
+        self.assertEqual(linear.position, 1000)
+        self.assertEqual(linear.state, Status.STOPPED)
+        angular.move(-0.5 * TURN)
+        while angular.state != Status.STOPPED:
+            time.sleep(0.01)
+        self.assertEqual(angular.position, -0.5 * TURN)
+
+    def test_move_wait(self):
+        axis = self.ctrl[0]
+        completion = axis.move_async(5e6)
+        self.assertEqual(axis.state, Status.TARGETING)
+        done = []
+        completion.add_done_callback(done.append)
+        self.assertEqual(completion.result(3), 'MCC0')
+        self.assertEqual(done, [completion])
+        self.assertEqual(axis.position, 5e6)
+        axis.move(0, wait=True, timeout=3)
+        self.assertEqual(axis.state, Status.STOPPED)
+        # Already at the target
+        axis.move(0, wait=True, timeout=3)
+        self.ctrl[1].move(-0.1 * TURN, wait=True, timeout=3)
+        self.assertEqual(self.ctrl[1].position, -0.1 * TURN)
+        # A stopped movement is completed too
+        completion = axis.move_async(1e9)
+        axis.stop()
+        completion.result(3)
+        with self.assertRaises(RuntimeError):
+            self.ctrl.send_movement(1, 'MPA1,1000,0').result(3)
+
+    def test_move_wait_async(self):
+        self.ctrl.communication_mode = CommunicationMode.ASYNC
+        self.test_move_wait()
+
+    def test_read_write(self):
+        axis = self.ctrl[0]
+        axis.closed_loop_vel = 2000
+        self.assertEqual(axis.closed_loop_vel, 2000)
+        axis.position_limits = [-100, 100]
+        self.assertEqual(axis.position_limits, [-100, 100])
+        axis.scale_inverted = True
+        self.assertTrue(axis.scale_inverted)
+        # The commands are rendered by the templates cached on the axis
+        self.assertEqual(axis._templates[('SCLS', 1)].render(2000),
+                         'SCLS0,2000')
+
+    def test_error(self):
+        with self.assertRaises(RuntimeError):
+            self.ctrl[0].get_channel_property(1)
+        with self.assertRaises(RuntimeError):
+            self.ctrl.send_cmd('MPA1,1000,0')
+        # The communication is still in sync after an error
+        self.assertEqual(self.ctrl[0].position, 0)
+
+    def test_cache(self):
+        axis = self.ctrl[0]
+        transport = self.ctrl._comm._comm
+        writes = []
+        write_cmd = transport.write_cmd
+
+        def counted_write(cmd):
+            writes.append(str(cmd))
+            return write_cmd(cmd)
+        transport.write_cmd = counted_write
+
+        def sent(query):
+            return sum(w.count(query) for w in writes)
+        self.assertEqual(axis.closed_loop_vel, axis.closed_loop_vel)
+        self.assertEqual(sent('GCLS0'), 1)
+        axis.closed_loop_vel = 2000
+        self.assertEqual(axis.closed_loop_vel, 2000)
+        self.ctrl.send_cmd('SCLS0,3000')
+        self.assertEqual(axis.closed_loop_vel, 3000)
+        self.assertEqual(sent('GCLS0'), 3)
+        # The position is not cached by default
+        self.assertEqual(axis.position, axis.position)
+        self.assertEqual(sent('GP0'), 2)
+        axis.cache_ttl['GP'] = 10
+        self.assertEqual(axis.position, 0)
+        axis.move(1000, wait=True, timeout=3)
+        self.assertEqual(axis.position, 1000)
+        self.assertEqual(axis.position, 1000)
+        self.assertEqual(sent('GP0'), 4)
+        axis.cache_ttl['GCLS'] = 0
+        self.assertEqual(axis.closed_loop_vel, axis.closed_loop_vel)
+        self.assertEqual(sent('GCLS0'), 5)
+
+    def test_batch(self):
+        answers = self.ctrl.send_cmds(['GP0', 'GA1', 'GS0', 'GS1'])
+        self.assertEqual(answers, ['P0,0', 'A1,0,0', 'S0,0', 'S1,0'])
+        answers = self.ctrl.send_cmds(['GP0', 'GP1', 'GS2'],
+                                      raise_errors=False)
+        self.assertIsInstance(answers[1], RuntimeError)
+        self.assertEqual(answers[2], 'S2,0')
+        with self.assertRaises(RuntimeError):
+            self.ctrl.send_cmds(['GP0', 'GP1'])
+
+    def test_replies(self):
+        for mode in (CommunicationMode.SYNC, CommunicationMode.ASYNC):
+            self.ctrl.communication_mode = mode
+            ans = self.ctrl.send_cmd('GA1')
+            self.assertIsInstance(ans, AngleReply)
+            self.assertEqual(ans, 'A1,0,0')
+            answers = self.ctrl.send_cmds(['GP0', 'GA1'])
+            self.assertIsInstance(answers[0], PositionReply)
+            self.assertIsInstance(answers[1], AngleReply)
+            completion = self.ctrl[0].move_async(1000)
+            self.assertIsInstance(completion.result(3), ReportReply)
+
+    def test_batch_write(self):
+        transport = self.ctrl._comm._comm
+        writes = []
+        write_cmd = transport.write_cmd
+
+        def counted_write(cmd):
+            writes.append(cmd)
+            return write_cmd(cmd)
+        transport.write_cmd = counted_write
+        cmds = ['GP0', 'SCLS0,1000', 'GCLS0', 'GP1', 'GS2']
+        # The commands which are not acknowledged in asynchronous mode
+        for mode, ack in ((CommunicationMode.SYNC, 'E0,0'),
+                          (CommunicationMode.ASYNC, None)):
+            self.ctrl.communication_mode = mode
+            del writes[:]
+            answers = self.ctrl.send_cmds(cmds, raise_errors=False)
+            # One write, the answers in order and the errors in place
+            self.assertEqual(writes, [''.join(':%s\n' % cmd
+                                              for cmd in cmds)])
+            self.assertEqual(answers[:3], ['P0,0', ack, 'CLS0,1000'])
+            self.assertIsInstance(answers[3], RuntimeError)
+            self.assertEqual(answers[4], 'S2,0')
+
+    def test_threads(self):
+        for axis in self.ctrl:
+            axis.set_position(1000 * (axis._axis_nr + 1))
+        transport = self.ctrl._comm._comm
+        writes = []
+        write_cmd = transport.write_cmd
+
+        def counted_write(cmd):
+            writes.append(cmd)
+            return write_cmd(cmd)
+        transport.write_cmd = counted_write
+        errors = []
+
+        def read(axis):
+            try:
+                for _ in range(100):
+                    if axis.position != 1000 * (axis._axis_nr + 1):
+                        errors.append(axis._axis_nr)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=read, args=(self.ctrl[i % 3],))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # The requests queued together are sent in one write
+        self.assertLess(len(writes), 800)
+
+    def test_priority(self):
+        self.sim.latency = 0.002
+        # The writes keep the identical reads from being coalesced
+        reads = self.ctrl._comm.send_cmds_async(['GP0', 'SCLS0,0'] * 100)
+        self.ctrl[0].stop()
+        # The stop does not wait for the queued reads
+        self.assertFalse(reads[-2].done())
+        self.assertEqual(reads[-2].result(10), 'P0,0')
+
+    def test_priority_batch(self):
+        self.sim.latency = 0.01
+        # The stop comes while the batch is written in chunks
+        pendings = self.ctrl._comm.send_cmds_async(
+            ['GP2', 'SCLS2,1000'] * 20 + ['MPA0,100000000,0'])
+        pendings[0].result(3)
+        self.ctrl[0].stop()
+        pendings[-1].result(10)
+        # The movement queued before the stop is stopped too
+        time.sleep(0.05)
+        self.assertEqual(self.ctrl[0].state, Status.STOPPED)
+
+    def test_template_commands(self):
+        # The commands of the axes are not parsed again to get their
+        # channel, priority and answer
+        axis = self.ctrl[0]
+        for mode in (CommunicationMode.SYNC, CommunicationMode.ASYNC):
+            self.ctrl.communication_mode = mode
+            with mock.patch('smaract.communication.split_cmd',
+                            wraps=split_cmd) as parse:
+                axis.stop()
+                axis.closed_loop_vel = 1000
+                self.assertEqual(axis.position, 0)
+            parsed = [call[0][0] for call in parse.call_args_list]
+            self.assertFalse(set(parsed) & {'S0', 'SCLS0,1000', 'GP0'})
+
+    def test_coalescing(self):
+        self.sim.latency = 0.002
+        io = self.ctrl._comm._io
+        coalesced = io.coalesced
+        first, second, other = self.ctrl._comm.send_cmds_async(
+            ['GP0', 'GP0', 'GP2'])
+        self.assertEqual(io.coalesced, coalesced + 1)
+        self.assertEqual(second.result(3), 'P0,0')
+        self.assertEqual(first.result(3), 'P0,0')
+        self.assertEqual(other.result(3), 'P2,0')
+        # A query after a write is sent again
+        first = self.ctrl._comm.send_cmd_async('GP0')
+        self.ctrl._comm.send_cmd_async('SP0,500')
+        second = self.ctrl._comm.send_cmd_async('GP0')
+        self.assertEqual(io.coalesced, coalesced + 1)
+        self.assertEqual(first.result(3), 'P0,0')
+        self.assertEqual(second.result(3), 'P0,500')
+
+    def test_snapshot(self):
+        self.ctrl[0].move(1000)
+        self.ctrl[1].move(-1e6)
+        time.sleep(0.05)
+        snap = self.ctrl.snapshot(('position', 'state', 'closed_loop_vel'))
+        self.assertEqual(list(snap['channel']), [0, 1, 2])
+        self.assertEqual(list(snap['position']), [1000, -1e6, 0])
+        self.assertEqual(list(snap['state']), [Status.STOPPED] * 3)
+        self.assertEqual(snap['closed_loop_vel'][0], 1e6)
+        self.ctrl.sensor_enabled = 0
+        with self.assertRaises(RuntimeError):
+            self.ctrl.snapshot()
+        snap = self.ctrl.snapshot(raise_errors=False)
+        self.assertTrue(all(snap['position'] != snap['position']))
+        self.assertEqual(list(snap['state']), [Status.STOPPED] * 3)
+
+    def test_async(self):
+        self.ctrl.communication_mode = CommunicationMode.ASYNC
+        self.assertEqual(self.ctrl.communication_mode, CommunicationMode.ASYNC)
+        pending = [self.ctrl.send_cmd_async('GP%d' % (i % 3 and 2))
+                   for i in range(30)]
+        self.assertEqual(set([p.result(3) for p in pending]),
+                         set(['P0,0', 'P2,0']))
+        self.ctrl[0].closed_loop_vel = 3000
+        self.assertEqual(self.ctrl[0].closed_loop_vel, 3000)
+        self.ctrl[0].set_channel_property(1, 1)
+        with self.assertRaises(RuntimeError):
+            self.ctrl[0].get_channel_property(1)
+        self.assertEqual(self.ctrl.send_cmds(['GP0', 'SCLS0,10', 'GS0']),
+                         ['P0,0', None, 'S0,0'])
+        time.sleep(0.05)
+        self.assertEqual(len(self.ctrl.async_errors), 1)
+        self.ctrl.communication_mode = CommunicationMode.SYNC
+        self.assertEqual(self.ctrl.communication_mode, CommunicationMode.SYNC)
+        self.assertEqual(self.ctrl[0].position, 0)
+
+    def test_async_errors(self):
+        self.ctrl.communication_mode = CommunicationMode.ASYNC
+        # The error of a command not acknowledged goes to its own slot,
+        # not to the later queries of the same channel
+        pendings = self.ctrl.send_cmds_async(['GS1', 'MPA1,0,0', 'GS1'])
+        self.assertEqual(pendings[0].result(3), 'S1,0')
+        self.assertEqual(pendings[2].result(3), 'S1,0')
+        with self.assertRaises(RuntimeError):
+            pendings[1].result(0)
+        self.assertEqual(self.ctrl.async_errors,
+                         ['Command MPA1,0,0 failed. '
+                          'Error 143: Wrong Sensor Type Error'])
+
+    def test_async_timeout(self):
+        self.ctrl.communication_mode = CommunicationMode.ASYNC
+        process = self.sim.process
+        dropped = []
+
+        def drop_answer(cmd):
+            answers = process(cmd)
+            if cmd == 'GP0' and not dropped:
+                dropped.append(cmd)
+                return []
+            return answers
+        self.sim.process = drop_answer
+        with self.assertRaises(RuntimeError):
+            self.ctrl._comm.send_cmd('GP0', timeout=0.2)
+        # The command timed out does not take the next answer
+        self.assertEqual(dropped, ['GP0'])
+        self.assertEqual(self.ctrl._comm.send_cmd('GP0'), 'P0,0')
+        self.assertEqual(self.ctrl[0].position, 0)
+
+    def test_idle_wakeup(self):
+        io = self.ctrl._comm._io
+        if io._wakeup is None:
+            self.skipTest('The transport can not be woken up')
+        io.IDLE_WAKEUP_TIMEOUT = 10
+        completion = self.ctrl[0].move_async(1e9)
+        time.sleep(0.1)
+        # The requests interrupt the idle reads of the reports
+        for _ in range(5):
+            t0 = time.time()
+            self.assertEqual(self.ctrl[2].position, 0)
+            self.assertLess(time.time() - t0, 0.1)
+        self.ctrl[0].stop()
+        self.assertEqual(completion.result(3), 'MCC0')
+
+    def test_triggered_move(self):
+        targets = {0: 1e6, 1: -45e6, 2: -2000}
+        with self.assertRaises(RuntimeError):
+            self.ctrl.triggered_move(targets)
+        self.ctrl.communication_mode = CommunicationMode.ASYNC
+        completions = self.ctrl.triggered_move(targets, wait=True, timeout=3)
+        self.assertEqual([c.result(0) for c in completions],
+                         ['MCC0', 'MCC1', 'MCC2'])
+        snap = self.ctrl.snapshot(('position',))
+        self.assertEqual(list(snap['position']), [1e6, -45e6, -2000])
+        # All the axes start on the same controller cycle
+        starts = [ch._motion.t0 for ch in self.sim.channels]
+        self.assertEqual(max(starts), min(starts))
+        # Loaded and triggered later
+        self.ctrl.load_triggered_move({0: 0, 2: 0}, trigger_idx=3)
+        self.assertEqual(self.ctrl[0].position, 1e6)
+        self.ctrl.trigger_command(3)
+        time.sleep(0.05)
+        self.assertEqual(self.ctrl[0].position, 0)
+        self.assertEqual(self.ctrl[2].position, 0)
+        # A queue overflow cleans the queues of all the axes loaded
+        for i in range(16):
+            self.ctrl.load_triggered_move({0: i, 2: i}, trigger_idx=4)
+        with self.assertRaises(RuntimeError):
+            self.ctrl.load_triggered_move({0: 100, 2: 100}, trigger_idx=4)
+        self.ctrl.trigger_command(4)
+        time.sleep(0.05)
+        self.assertEqual(self.ctrl[0].position, 0)
+        # No axis moves if any movement can not be loaded
+        for i in range(16):
+            self.ctrl.load_triggered_move({2: i}, trigger_idx=5)
+        with self.assertRaises(RuntimeError):
+            self.ctrl.triggered_move({0: 5000, 2: 5000}, trigger_idx=5)
+        time.sleep(0.05)
+        self.assertEqual(self.ctrl[0].position, 0)
+        self.assertEqual(self.ctrl[0].state, Status.STOPPED)
+
+
+class TestSimulatorSocket(TestSimulator):
+
+    def create_controller(self):
+        self.server = SimulatorServer(self.sim).start()
+        return SmaractMCSController(CommType.Socket, self.server.host,
+                                    self.server.port, 1)
+
+    def tearDown(self):
+        TestSimulator.tearDown(self)
+        self.server.close()
+
+
+class TestSimulatorSerial(TestSimulator):
+
+    def create_controller(self):
+        self.pty = SimulatorPty(self.sim).start()
+        return SmaractMCSController(CommType.Serial, self.pty.port, 115200,
+                                    8, 'N', 1, 1)
+
+    def tearDown(self):
+        TestSimulator.tearDown(self)
+        self.pty.close()
+
+
+class TestSerialCom(unittest.TestCase):
+
+    def setUp(self):
+        import tty
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.addCleanup(os.close, self.master)
+        self.addCleanup(os.close, slave)
+        self.com = SerialCom(os.ttyname(slave), 115200, timeout=1)
+        self.addCleanup(self.com.close)
+
+    def test_framing(self):
+        os.write(self.master, b':P0,')
+        self.assertEqual(self.com.read_answer(0.05), '')
+        os.write(self.master, b'12\n:S0,0\n:MCC')
+        self.assertEqual(self.com.read_answer(0.05), ':P0,12\n')
+        self.assertEqual(self.com.read_answer(0), ':S0,0\n')
+        self.assertEqual(self.com.read_answer(0), '')
+        os.write(self.master, b'0\n')
+        self.assertEqual(self.com.read_answer(), ':MCC0\n')
+
+
+class TestSocketCom(unittest.TestCase):
+
+    def setUp(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.com = SocketCom('127.0.0.1', server.getsockname()[1], timeout=1)
+        self.addCleanup(self.com.close)
+        self.peer = server.accept()[0]
+        self.peer.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.addCleanup(self.peer.close)
+
+    def test_framing(self):
+        # An answer split in several segments
+        self.peer.sendall(b':P0,')
+        self.assertEqual(self.com.read_answer(0.05), '')
+        # Several answers in one segment
+        self.peer.sendall(b'12\n:S0,0\n:MCC')
+        self.assertEqual(self.com.read_answer(0.05), ':P0,12\n')
+        self.assertEqual(self.com.read_answer(0.05), ':S0,0\n')
+        self.assertEqual(self.com.read_answer(0.05), '')
+        self.peer.sendall(b'0\n')
+        self.assertEqual(self.com.read_answer(), ':MCC0\n')
+
+    def test_long_answer(self):
+        # An answer longer than the receive buffer grows it
+        data = ','.join(['%d' % i for i in range(2000)])
+        self.assertGreater(len(data), SocketCom.RX_BUFFER_SIZE)
+        frame = ':VB0,%s\n' % data
+        for i in range(0, len(frame), 1000):
+            self.peer.sendall(frame[i:i + 1000].encode())
+            time.sleep(0.01)
+        self.peer.sendall(b':E0,0\n')
+        self.assertEqual(self.com.read_answer(), frame)
+        self.assertEqual(self.com.read_answer(), ':E0,0\n')
+
+    def test_send_cmd(self):
+        # The bytes after the answer are kept for the next read
+        self.peer.sendall(b':P0,5\n:MCC0\n')
+        self.assertEqual(self.com.send_cmd(':GP0\n'), ':P0,5\n')
+        self.assertEqual(self.peer.recv(64), b':GP0\n')
+        self.assertEqual(self.com.read_answer(0.05), ':MCC0\n')
+
+
+class TestBaudrate(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.sim = SmaractSimulator(3, [1, 2, 1])
+        self.changes = []
+        set_baudrate = self.sim._cmd_BR
+
+        def recorded(baudrate):
+            self.changes.append(baudrate)
+            return set_baudrate(baudrate)
+        self.sim._cmd_BR = recorded
+        # The line does not carry more than 38400 bauds
+        self.pty = SimulatorPty(self.sim, max_baudrate=38400).start()
+        self.ctrl = SmaractMCSController(CommType.Serial, self.pty.port, 9600,
+                                         8, 'N', 1, 1)
+
+    def tearDown(self):
+        self.ctrl._comm.close()
+        self.pty.close()
+
+    def test_configure(self):
+        self.assertEqual(self.ctrl.configure_baudrate(19200), 19200)
+        self.assertEqual(self.ctrl._comm._comm.baudrate, 19200)
+        self.assertEqual(self.ctrl[0].position, 0)
+        with self.assertRaises(ValueError):
+            self.ctrl.configure_baudrate(230400)
+
+    def test_negotiate(self):
+        self.assertEqual(self.ctrl.negotiate_baudrate(remember=self.directory),
+                         38400)
+        self.assertEqual(self.sim.baudrate, 38400)
+        self.assertEqual(self.ctrl._comm._comm.baudrate, 38400)
+        self.assertEqual(self.ctrl[0].position, 0)
+        # The higher baudrates were reverted
+        self.assertEqual(self.changes,
+                         [115200, 9600, 57600, 9600, 38400])
+        self.assertEqual(BaudrateCache(self.directory).get(self.pty.port),
+                         38400)
+        # The stored baudrate is tried first
+        self.ctrl.configure_baudrate(9600)
+        del self.changes[:]
+        self.assertEqual(self.ctrl.negotiate_baudrate(remember=self.directory),
+                         38400)
+        self.assertEqual(self.changes, [38400])
+        self.assertEqual(self.ctrl.negotiate_baudrate(remember=False), 38400)
+
+    def test_not_serial(self):
+        ctrl = SmaractMCSController(CommType.Simulator, self.sim)
+        with self.assertRaises(RuntimeError):
+            ctrl.negotiate_baudrate()
+        ctrl._comm.close()
+
+
+class TestSimulatorTango(TestSimulator):
+
+    def create_controller(self):
+        self.proxy = SimulatorDeviceProxy(self.sim, timeout=0.2)
+        return SmaractMCSController(CommType.SerialTango, self.proxy)
+
+    def tearDown(self):
+        self.ctrl.communication_mode = CommunicationMode.SYNC
+        self.ctrl._comm.close()
+        self.proxy.close()
+
+    def test_idle_poll(self):
+        completion = self.ctrl[0].move_async(1e9)
+        time.sleep(0.1)
+        # The reads ignore the timeout, the reports awaited are polled
+        # instead of blocking the requests for the timeout of the device
+        for _ in range(5):
+            t0 = time.time()
+            self.assertEqual(self.ctrl[2].position, 0)
+            self.assertLess(time.time() - t0, 0.1)
+        self.ctrl[0].stop()
+        self.assertEqual(completion.result(3), 'MCC0')
+
+
+class TestSimulatorTangoBulk(TestSimulatorTango):
+
+    def create_controller(self):
+        self.proxy = SimulatorDeviceProxy(self.sim, timeout=0.2)
+        return SmaractMCSController(CommType.SerialTango, self.proxy, True)
+
+    def test_bulk_calls(self):
+        cmds = ['GP0', 'GS0', 'GCLS0', 'GS1', 'GS2']
+        self.ctrl.send_cmds(cmds)
+        calls = self.proxy.calls
+        self.sim.latency = 0.01
+        self.assertEqual(self.ctrl.send_cmds(cmds),
+                         ['P0,0', 'S0,0', 'CLS0,1000000', 'S1,0', 'S2,0'])
+        # Write, first answer and the rest in bulk, without any flush
+        self.assertEqual(self.proxy.calls - calls, 3)
+        self.assertEqual(len(self.ctrl._comm._comm._rx), 0)
+
+
+    def test_concurrent_stop(self):
+        transport = self.ctrl._comm._comm
+        self.sim.latency = 0.005
+        cmds = ['GP0', 'GS0', 'GCLS0', 'GS1', 'GS2'] * 3
+        expected = ['P0,0', 'S0,0', 'CLS0,1000000', 'S1,0', 'S2,0'] * 3
+        for _ in range(5):
+            # The input is flushed before the next write
+            transport._flushed = False
+            stops = []
+
+            def stop():
+                for _ in range(5):
+                    self.ctrl[0].stop()
+                    stops.append(True)
+            thread = threading.Thread(target=stop)
+            thread.start()
+            # The stops written meanwhile do not flush the answers
+            for _ in range(3):
+                self.assertEqual(self.ctrl.send_cmds(cmds), expected)
+            thread.join()
+            self.assertEqual(len(stops), 5)
+        # After the copies of the stops queued behind the batches
+        self.assertEqual(self.ctrl.send_cmd('GS0'), 'S0,0')
+        self.assertEqual(transport._expected, 0)
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SmaractSimulator(3, [1, 2, 1])
+        self.writes = []
+        write_cmd = SimulatorCom.write_cmd
+
+        def counted_write(com, cmd):
+            self.writes.append(str(cmd))
+            return write_cmd(com, cmd)
+        SimulatorCom.write_cmd = counted_write
+        self.addCleanup(setattr, SimulatorCom, 'write_cmd', write_cmd)
+
+    def test_pipelined(self):
+        ctrl = SmaractMCSController(CommType.Simulator, self.sim)
+        # SCM and GNC, then all the GST
+        self.assertEqual(len(self.writes), 2)
+        self.assertEqual(len(ctrl), 3)
+        self.assertIsInstance(ctrl[1], SmaractMCSAngularAxis)
+        ctrl._comm.close()
+
+    def test_lazy(self):
+        ctrl = SmaractMCSController(CommType.Simulator, self.sim,
+                                    lazy_axes=True)
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(len(ctrl), 3)
+        self.assertIsInstance(ctrl[-2], SmaractMCSAngularAxis)
+        self.assertIs(ctrl[1], ctrl[-2])
+        self.assertEqual(len(self.writes), 2)
+        self.assertEqual([axis._axis_nr for axis in ctrl], [0, 1, 2])
+        self.assertEqual(len(self.writes), 4)
+        self.assertIsInstance(ctrl[0:2][0], SmaractMCSLinearAxis)
+        ctrl._comm.close()
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sim = SmaractSimulator(3, [1, 2, 1])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def connect(self):
+        ctrl = SmaractMCSController(CommType.Simulator, self.sim,
+                                    metadata_cache=self.directory)
+        writes = []
+        write_cmd = ctrl._comm._comm.write_cmd
+
+        def counted_write(cmd):
+            writes.append(str(cmd))
+            return write_cmd(cmd)
+        ctrl._comm._comm.write_cmd = counted_write
+        return ctrl, writes
+
+    def test_metadata(self):
+        ctrl, writes = self.connect()
+        serial_number = ctrl[0].serial_number
+        self.assertEqual(len(writes), 1)
+        ctrl._comm.close()
+        self.assertTrue(os.path.exists(ctrl.metadata_cache.path))
+        ctrl, writes = self.connect()
+        self.assertEqual(len(ctrl), 3)
+        self.assertIsInstance(ctrl[1], SmaractMCSAngularAxis)
+        self.assertEqual(ctrl[0].serial_number, serial_number)
+        self.assertEqual(ctrl.nchannels, 3)
+        self.assertEqual(writes, [])
+        # The answers of an exchange are written to the file once
+        with mock.patch('smaract.metadata._write_json') as write_json:
+            ctrl.send_cmds(['GSN1', 'GSN2', 'GFV0', 'GP0'])
+            ctrl.send_cmds(['GSN1', 'GP0'])
+        self.assertEqual(write_json.call_count, 1)
+        # The sensor types are not cached
+        ctrl[0].sensor_type = 2
+        self.assertEqual(ctrl[0].sensor_type, 'SR')
+        ctrl._comm.close()
+        ctrl, writes = self.connect()
+        self.assertIsInstance(ctrl[0], SmaractMCSAngularAxis)
+        ctrl._comm.close()
+        # Another controller does not use the metadata of the first one
+        self.sim.system_id += 1
+        self.sim.channels[0].sensor_type = 1
+        ctrl, writes = self.connect()
+        self.assertIsInstance(ctrl[0], SmaractMCSLinearAxis)
+        ctrl._comm.close()
+
+
+class TestSimulatorSDC(unittest.TestCase):
+
+    def test_table_entry(self):
+        ctrl = SmaractSDCController(CommType.Simulator, SmaractSimulator(1))
+        axis = ctrl[0]
+        axis.step_increment = [1, 2, 3, 4, 5, 6, 7, 8]
+        self.assertEqual(axis.step_increment, [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(axis.target_position, 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)